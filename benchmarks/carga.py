@@ -0,0 +1,312 @@
+"""
+Benchmark de carga reproducible de la API de la cafetería.
+
+Siembra un catálogo sintético (productos y postres) y ejecuta en concurrencia los
+endpoints reales a través de un cliente ASGI (sin red): listado, consulta por ID,
+por categoría, /buscar/{termino}, /estadisticas/, alta y actualización.
+Reporta latencias p50/p95/p99 y throughput por escenario, guarda los resultados en
+JSON y puede compararlos con una corrida anterior para detectar regresiones.
+
+Uso:
+    # Contra un mongod local (base cafeteria_benchmark; se borran sus productos y postres)
+    python benchmarks/carga.py --productos 100000 --postres 20000 --concurrencia 32 --duracion 30
+
+    # Con el sustituto en proceso (mongomock-motor), sin servidor de MongoDB
+    python benchmarks/carga.py --en-memoria --productos 10000
+
+    # Comparar con una corrida anterior (código de salida 1 si hay regresión)
+    python benchmarks/carga.py --salida nueva.json --comparar base.json
+
+La siembra reemplaza los productos y postres de la base, por eso solo se aceptan bases
+cuyo nombre contenga "benchmark". El código de salida es 1 si algún escenario supera la
+tasa de errores de --max-errores.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from comun import es_base_de_benchmark
+
+CATEGORIAS_PRODUCTOS = ["torta", "cuernito", "quesadilla", "taco", "baguette", "bebida", "postre"]
+CATEGORIAS_POSTRES = ["pastel", "postre_frio"]
+PALABRAS = ["jamón", "queso", "pollo", "café", "chocolate", "fresa", "canela", "pastor", "hongos", "vainilla"]
+TERMINOS_BUSQUEDA = ["taco", "queso", "chocolate", "café", "pastel", "de", "fresa"]
+
+# Peso relativo de cada escenario en la mezcla de tráfico
+ESCENARIOS = {
+    "listar": 15,
+    "obtener_por_id": 30,
+    "por_categoria": 15,
+    "buscar": 15,
+    "estadisticas": 10,
+    "crear": 5,
+    "actualizar": 10,
+}
+
+def preparar_en_memoria():
+    """Sustituye el cliente de Motor por mongomock-motor (sustituto en proceso)"""
+    import mongomock_motor
+    from mongomock import aggregate
+
+    import main
+
+    # mongomock no implementa $unionWith, que usa la reconstrucción de estadísticas
+    def union_with(in_collection, database, options):
+        otros = list(database[options["coll"]].aggregate(options.get("pipeline", [])))
+        return list(in_collection) + otros
+    aggregate._PIPELINE_HANDLERS.setdefault("$unionWith", union_with)
+
+    # Ni $merge, que usa la reconstrucción del catálogo
+    def merge(in_collection, database, options):
+        destino = database[options["into"]]
+        for documento in in_collection:
+            destino.replace_one({"_id": documento["_id"]}, documento, upsert=True)
+        return []
+    aggregate._PIPELINE_HANDLERS["$merge"] = aggregate._PIPELINE_HANDLERS.get("$merge") or merge
+
+    main.AsyncIOMotorClient = lambda *args, **kwargs: mongomock_motor.AsyncMongoMockClient()
+
+def producto_sintetico(i: int, rng: random.Random) -> dict:
+    palabras = rng.sample(PALABRAS, 3)
+    return {
+        "_id": i,
+        "nombre": f"{palabras[0].capitalize()} {i}",
+        "categoria": rng.choice(CATEGORIAS_PRODUCTOS),
+        "descripcion": f"Preparado con {palabras[1]} y {palabras[2]}",
+        "precio": float(rng.randint(15, 120)),
+        "disponible": rng.choice([0, 1, 1, 1]),
+        "version": 0,
+    }
+
+def postre_sintetico(i: int, rng: random.Random) -> dict:
+    rebanadas = rng.randint(6, 16)
+    precio_rebanada = float(rng.randint(25, 60))
+    palabras = rng.sample(PALABRAS, 2)
+    return {
+        "_id": i,
+        "nombre": f"Pastel de {palabras[0]} {i}",
+        "descripcion": f"Pastel con {palabras[1]}",
+        "categoria": rng.choice(CATEGORIAS_POSTRES),
+        "rebanadas": rebanadas,
+        "precio_rebanada": precio_rebanada,
+        "precio_total": precio_rebanada * rebanadas,
+        "disponible": rng.choice([0, 1, 1, 1]),
+        "version": 0,
+    }
+
+async def sembrar(total_productos: int, total_postres: int, semilla: int):
+    """Reemplaza productos y postres por un catálogo sintético del tamaño pedido"""
+    import main
+
+    rng = random.Random(semilla)
+    for documento, total, generar in (
+        (main.Producto, total_productos, producto_sintetico),
+        (main.Postre, total_postres, postre_sintetico),
+    ):
+        coleccion = documento.get_motor_collection()
+        await coleccion.delete_many({})
+        for inicio in range(1, total + 1, 5000):
+            lote = [generar(i, rng) for i in range(inicio, min(inicio + 5000, total + 1))]
+            await coleccion.insert_many(lote, ordered=False)
+        await main.Contador.get_motor_collection().update_one(
+            {"collection_name": coleccion.name}, {"$set": {"sequence_value": total}}, upsert=True
+        )
+    await main.reconstruir_estadisticas()
+    await main.reconstruir_catalogo()
+    await main.construir_indices_busqueda()
+    main.cache_lectura.limpiar()
+
+async def ejecutar_escenario(cliente: httpx.AsyncClient, escenario: str, rng: random.Random, args) -> int:
+    """Ejecuta una petición del escenario y devuelve el código de estado"""
+    if escenario == "listar":
+        respuesta = await cliente.get("/productos/", params={"limit": 50, "skip": rng.randint(0, 1000)})
+    elif escenario == "obtener_por_id":
+        if rng.random() < 0.5:
+            respuesta = await cliente.get(f"/productos/{rng.randint(1, args.productos)}")
+        else:
+            respuesta = await cliente.get(f"/postres/{rng.randint(1, args.postres)}")
+    elif escenario == "por_categoria":
+        respuesta = await cliente.get(f"/productos/categoria/{rng.choice(CATEGORIAS_PRODUCTOS)}")
+    elif escenario == "buscar":
+        respuesta = await cliente.get(f"/buscar/{rng.choice(TERMINOS_BUSQUEDA)}", params={"limit": 50})
+    elif escenario == "estadisticas":
+        respuesta = await cliente.get("/estadisticas/")
+    elif escenario == "crear":
+        respuesta = await cliente.post("/productos/", json={
+            "nombre": f"Producto benchmark {rng.randint(1, 10**9)}",
+            "categoria": rng.choice(CATEGORIAS_PRODUCTOS),
+            "descripcion": "Alta generada por el benchmark",
+            "precio": float(rng.randint(15, 120)),
+        })
+    else:
+        respuesta = await cliente.put(
+            f"/productos/{rng.randint(1, args.productos)}",
+            json={"precio": float(rng.randint(15, 120)), "disponible": rng.choice([0, 1])}
+        )
+    return respuesta.status_code
+
+def percentil(valores, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+def resumir(latencias, errores: int, duracion: float) -> dict:
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "throughput_rps": round(len(latencias) / duracion, 2) if duracion else 0.0,
+        "media_ms": round(statistics.fmean(latencias), 3) if latencias else 0.0,
+        "p50_ms": round(percentil(latencias, 50), 3),
+        "p95_ms": round(percentil(latencias, 95), 3),
+        "p99_ms": round(percentil(latencias, 99), 3),
+    }
+
+async def generar_carga(cliente: httpx.AsyncClient, args) -> dict:
+    """Lanza `concurrencia` clientes que envían la mezcla de escenarios durante `duracion` segundos"""
+    nombres = list(ESCENARIOS)
+    pesos = [ESCENARIOS[n] for n in nombres]
+    latencias = {n: [] for n in nombres}
+    errores = {n: 0 for n in nombres}
+    fin = time.perf_counter() + args.duracion
+
+    async def trabajador(numero: int):
+        rng = random.Random(args.semilla * 1000 + numero)
+        while time.perf_counter() < fin:
+            escenario = rng.choices(nombres, pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                estado = await ejecutar_escenario(cliente, escenario, rng, args)
+            except Exception:
+                estado = 599
+            latencias[escenario].append((time.perf_counter() - inicio) * 1000)
+            if estado >= 500 or estado in (400, 422):
+                errores[escenario] += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador(i) for i in range(args.concurrencia)))
+    duracion = time.perf_counter() - inicio
+
+    todas = [l for valores in latencias.values() for l in valores]
+    return {
+        "duracion_s": round(duracion, 3),
+        "escenarios": {n: resumir(latencias[n], errores[n], duracion) for n in nombres},
+        "total": resumir(todas, sum(errores.values()), duracion),
+    }
+
+def revisar_errores(resultado: dict, maximo: float) -> bool:
+    """Imprime los escenarios con una tasa de errores mayor a `maximo`; True si hay alguno"""
+    fallidos = {
+        nombre: m["errores"] / m["peticiones"]
+        for nombre, m in resultado["escenarios"].items()
+        if m["peticiones"] and m["errores"] / m["peticiones"] > maximo
+    }
+    for nombre, tasa in fallidos.items():
+        print(f"❌ {nombre}: {tasa:.1%} de errores (máximo {maximo:.1%}); sus latencias no son comparables")
+    return bool(fallidos)
+
+def comparar(actual: dict, anterior: dict, umbral: float) -> bool:
+    """Imprime las diferencias contra una corrida anterior; True si hay regresiones"""
+    hay_regresion = False
+    print(f"\nComparación contra {anterior.get('fecha', 'corrida anterior')} (umbral {umbral:.0%}):")
+    for nombre, metricas in actual["escenarios"].items():
+        base = anterior.get("escenarios", {}).get(nombre)
+        if not base or not base["p95_ms"] or not base["throughput_rps"]:
+            continue
+        cambio_p95 = metricas["p95_ms"] / base["p95_ms"] - 1
+        cambio_rps = metricas["throughput_rps"] / base["throughput_rps"] - 1
+        regresion = cambio_p95 > umbral or cambio_rps < -umbral
+        hay_regresion = hay_regresion or regresion
+        marca = "❌ REGRESIÓN" if regresion else "✅"
+        print(f"  {nombre:<16} p95 {cambio_p95:+7.1%}  throughput {cambio_rps:+7.1%}  {marca}")
+    return hay_regresion
+
+def imprimir(resultado: dict):
+    print(f"\n{'escenario':<16} {'peticiones':>10} {'errores':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    filas = list(resultado["escenarios"].items()) + [("TOTAL", resultado["total"])]
+    for nombre, m in filas:
+        print(
+            f"{nombre:<16} {m['peticiones']:>10} {m['errores']:>8} {m['throughput_rps']:>9} "
+            f"{m['p50_ms']:>9} {m['p95_ms']:>9} {m['p99_ms']:>9}"
+        )
+
+async def ejecutar(args) -> int:
+    if not es_base_de_benchmark(args.base_datos):
+        return 2
+    os.environ["MONGODB_DB"] = args.base_datos
+    if args.mongodb_url:
+        os.environ["MONGODB_URL"] = args.mongodb_url
+    if args.en_memoria:
+        preparar_en_memoria()
+
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        print(f"🌱 Sembrando {args.productos} productos y {args.postres} postres...")
+        inicio = time.perf_counter()
+        await sembrar(args.productos, args.postres, args.semilla)
+        print(f"   listo en {time.perf_counter() - inicio:.1f}s")
+
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://benchmark") as cliente:
+            if args.calentamiento:
+                await generar_carga(cliente, argparse.Namespace(**{**vars(args), "duracion": args.calentamiento}))
+            resultado = await generar_carga(cliente, args)
+
+    resultado = {
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "configuracion": {
+            "productos": args.productos,
+            "postres": args.postres,
+            "concurrencia": args.concurrencia,
+            "duracion_s": args.duracion,
+            "semilla": args.semilla,
+            "base_datos": args.base_datos,
+            "backend": "mongomock" if args.en_memoria else "mongod",
+        },
+        **resultado,
+    }
+    imprimir(resultado)
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados guardados en {args.salida}")
+
+    codigo = 1 if revisar_errores(resultado, args.max_errores) else 0
+    if args.comparar:
+        with open(args.comparar) as f:
+            anterior = json.load(f)
+        if comparar(resultado, anterior, args.umbral):
+            codigo = 1
+    return codigo
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", help="URL de MongoDB (por defecto MONGODB_URL)")
+    parser.add_argument("--base-datos", default="cafeteria_benchmark",
+                        help="Base a sembrar (se borran sus productos y postres; debe contener 'benchmark')")
+    parser.add_argument("--en-memoria", action="store_true", help="Usa mongomock-motor en lugar de un mongod")
+    parser.add_argument("--productos", type=int, default=10000)
+    parser.add_argument("--postres", type=int, default=2000)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--duracion", type=float, default=20.0, help="Segundos de carga medida")
+    parser.add_argument("--calentamiento", type=float, default=2.0, help="Segundos de carga previa sin medir")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--umbral", type=float, default=0.10, help="Empeoramiento tolerado (0.10 = 10%%)")
+    parser.add_argument("--max-errores", type=float, default=0.01,
+                        help="Tasa de errores tolerada por escenario (0.01 = 1%%)")
+    sys.exit(asyncio.run(ejecutar(parser.parse_args())))
@@ -0,0 +1,13 @@
+"""
+Utilidades compartidas por los benchmarks.
+"""
+
+def es_base_de_benchmark(nombre: str) -> bool:
+    """
+    Los benchmarks borran y siembran productos y postres: solo se aceptan bases cuyo nombre
+    contenga "benchmark", para no apuntar por error a la base de la API.
+    """
+    if "benchmark" in nombre:
+        return True
+    print(f"❌ El benchmark borra los productos y postres de '{nombre}'; usa una base con 'benchmark' en el nombre")
+    return False
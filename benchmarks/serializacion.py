@@ -0,0 +1,134 @@
+"""
+Benchmark de serialización de los endpoints de lectura.
+
+Compara la ruta anterior (documentos Beanie -> producto_to_response -> validación
+de ProductoResponse -> jsonable_encoder -> json) con la ruta rápida (dicts crudos de
+Motor con proyección -> producto_crudo_to_response -> orjson).
+Reporta operaciones por segundo y memoria asignada (tracemalloc) de cada ruta.
+
+Uso (requiere un MongoDB accesible en MONGODB_URL):
+    python benchmarks/serializacion.py --productos 5000 --repeticiones 20
+
+Borra los productos de la base al empezar y al terminar, por eso solo acepta bases cuyo
+nombre contenga "benchmark" (por defecto cafeteria_benchmark).
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from beanie import init_beanie
+from fastapi.encoders import jsonable_encoder
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import TypeAdapter
+
+from comun import es_base_de_benchmark
+from main import (
+    Categoria, Contador, Postre, Producto, ProductoResponse, PROYECCION_PRODUCTO,
+    producto_crudo_to_response, producto_to_response
+)
+
+adaptador_respuesta = TypeAdapter(List[ProductoResponse])
+
+async def ruta_beanie() -> bytes:
+    """Ruta anterior: hidratación Beanie + validación del response_model + json"""
+    productos = await Producto.find_all().to_list()
+    respuesta = [producto_to_response(p) for p in productos]
+    validados = adaptador_respuesta.validate_python(respuesta)
+    return json.dumps(jsonable_encoder(validados)).encode()
+
+async def ruta_cruda() -> bytes:
+    """Ruta rápida: dicts crudos con proyección + orjson"""
+    productos = await Producto.get_motor_collection().find({}, PROYECCION_PRODUCTO).to_list(length=None)
+    return orjson.dumps([producto_crudo_to_response(p) for p in productos])
+
+async def medir(nombre: str, funcion, repeticiones: int) -> dict:
+    """Ejecuta la ruta varias veces midiendo tiempo y memoria asignada"""
+    await funcion()  # Calentamiento
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cuerpo = await funcion()
+    duracion = time.perf_counter() - inicio
+
+    tracemalloc.start()
+    await funcion()
+    actual, pico = tracemalloc.get_traced_memory()
+    bloques = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+
+    return {
+        "ruta": nombre,
+        "peticiones_por_segundo": round(repeticiones / duracion, 2),
+        "ms_por_peticion": round(duracion / repeticiones * 1000, 3),
+        "memoria_pico_kb": round(pico / 1024, 1),
+        "bloques_vivos": bloques,
+        "bytes_respuesta": len(cuerpo),
+        "bytes_gzip": len(gzip.compress(cuerpo)),
+    }
+
+async def sembrar(total: int):
+    """Inserta `total` productos sintéticos en la base de benchmark"""
+    await Producto.delete_all()
+    documentos = [
+        {
+            "_id": i,
+            "nombre": f"Producto {i}",
+            "categoria": ("torta", "taco", "bebida", "quesadilla")[i % 4],
+            "descripcion": f"Descripción de prueba número {i} con jamón, queso y café",
+            "precio": float(10 + i % 90),
+            "disponible": i % 2,
+        }
+        for i in range(1, total + 1)
+    ]
+    for inicio in range(0, total, 1000):
+        await Producto.get_motor_collection().insert_many(documentos[inicio:inicio + 1000], ordered=False)
+
+async def ejecutar(args) -> int:
+    if not es_base_de_benchmark(args.base_datos):
+        return 2
+    client = AsyncIOMotorClient(args.mongodb_url)
+    await init_beanie(
+        database=client[args.base_datos],
+        document_models=[Contador, Categoria, Producto, Postre]
+    )
+    await sembrar(args.productos)
+
+    resultados = [
+        await medir("beanie + pydantic + json", ruta_beanie, args.repeticiones),
+        await medir("motor crudo + orjson", ruta_cruda, args.repeticiones),
+    ]
+    for r in resultados:
+        print(
+            f"{r['ruta']:<28} {r['peticiones_por_segundo']:>9} req/s  "
+            f"{r['ms_por_peticion']:>9} ms  pico {r['memoria_pico_kb']:>9} KB  "
+            f"{r['bytes_respuesta']} B ({r['bytes_gzip']} B gzip)"
+        )
+    mejora = resultados[1]["peticiones_por_segundo"] / resultados[0]["peticiones_por_segundo"]
+    print(f"Mejora: {mejora:.2f}x")
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({"productos": args.productos, "resultados": resultados}, f, indent=2)
+
+    await Producto.delete_all()
+    client.close()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--base-datos", default="cafeteria_benchmark",
+                        help="Base a sembrar (se borran sus productos; debe contener 'benchmark')")
+    parser.add_argument("--productos", type=int, default=5000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    sys.exit(asyncio.run(ejecutar(parser.parse_args())))
@@ -1,11 +1,51 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder
 from beanie import Document, init_beanie
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo import ASCENDING, DESCENDING, TEXT, DeleteMany, DeleteOne, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from types import MappingProxyType
+import asyncio
+import base64
+import bisect
+import codecs
+import contextvars
+import csv
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import math
+import orjson
 import os
+import random
+import secrets
+import sys
+import threading
+import time
+import unicodedata
+
+def indice_texto(nombre: str) -> IndexModel:
+    """Índice de texto en español sobre nombre, descripción y categoría"""
+    return IndexModel(
+        [("nombre", TEXT), ("descripcion", TEXT), ("categoria", TEXT)],
+        name=nombre, default_language="spanish"
+    )
+
+# Los modelos declaran sus índices en Settings.indices y la API los concilia al arrancar
+# (ver SINCRONIZACIÓN DE ÍNDICES). No se usa Settings.indexes de Beanie porque init_beanie
+# los construye antes de terminar el arranque.
 
 # Modelo para Contadores (para auto incremento)
 class Contador(Document):
@@ -14,6 +54,7 @@ class Contador(Document):
     
     class Settings:
         name = "contadores"
+        indices = [IndexModel([("collection_name", ASCENDING)], unique=True)]
 
 # Modelo de Categorías (MongoDB Document)
 class Categoria(Document):
@@ -23,6 +64,10 @@ class Categoria(Document):
     
     class Settings:
         name = "categorias"
+        indices = [
+            IndexModel([("nombre", ASCENDING)], unique=True),
+            IndexModel([("descripcion", ASCENDING)]),
+        ]
 
 # Modelo de Productos (MongoDB Document) con ID auto incremental
 class Producto(Document):
@@ -32,9 +77,23 @@ class Producto(Document):
     descripcion: str
     precio: float
     disponible: int = Field(default=1, description="1 = disponible, 0 = no disponible")
+    version: int = Field(default=0, description="Versión para control de concurrencia optimista")
     
     class Settings:
         name = "productos"
+        indices = [
+            IndexModel([("nombre", ASCENDING)]),
+            IndexModel([("categoria", ASCENDING)]),
+            IndexModel([("precio", ASCENDING)]),
+            IndexModel([("disponible", ASCENDING)]),
+            IndexModel([("categoria", ASCENDING), ("disponible", ASCENDING)]),
+            # Paginación por cursor (orden + _id como desempate)
+            IndexModel([("precio", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("nombre", ASCENDING), ("_id", ASCENDING)]),
+            # /productos/filtro: igualdad (categoría, disponible) + orden/rango por precio
+            IndexModel([("categoria", ASCENDING), ("disponible", ASCENDING), ("precio", ASCENDING), ("_id", ASCENDING)]),
+            indice_texto("busqueda_texto_productos"),
+        ]
 
 # Modelo de Postres (MongoDB Document) con ID auto incremental
 class Postre(Document):
@@ -46,25 +105,183 @@ class Postre(Document):
     precio_rebanada: float = Field(..., gt=0)
     precio_total: float = Field(..., gt=0)
     disponible: int = Field(default=1, description="1 = disponible, 0 = no disponible")
+    version: int = Field(default=0, description="Versión para control de concurrencia optimista")
     
     class Settings:
         name = "postres"
+        indices = [
+            IndexModel([("nombre", ASCENDING)]),
+            IndexModel([("categoria", ASCENDING)]),
+            IndexModel([("precio_rebanada", ASCENDING)]),
+            IndexModel([("precio_total", ASCENDING)]),
+            IndexModel([("rebanadas", ASCENDING)]),
+            IndexModel([("disponible", ASCENDING)]),
+            IndexModel([("categoria", ASCENDING), ("disponible", ASCENDING)]),
+            # Paginación por cursor (orden + _id como desempate)
+            IndexModel([("nombre", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("precio_rebanada", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("precio_total", ASCENDING), ("_id", ASCENDING)]),
+            # /postres/filtro: igualdad (categoría, disponible) + orden/rango por precio por rebanada
+            IndexModel([("categoria", ASCENDING), ("disponible", ASCENDING), ("precio_rebanada", ASCENDING), ("_id", ASCENDING)]),
+            indice_texto("busqueda_texto_postres"),
+        ]
+
+# Modelo de Estadísticas materializadas (un documento por colección y categoría)
+class Estadistica(Document):
+    id: str = Field(..., alias="_id")  # "<coleccion>:<categoria>"
+    coleccion: str
+    categoria: str
+    total: int = 0
+    sumas: Dict[str, float] = Field(default_factory=dict)
+    minimos: Dict[str, float] = Field(default_factory=dict)
+    maximos: Dict[str, float] = Field(default_factory=dict)
+    
+    class Settings:
+        name = "estadisticas"
+
+# Modelo de lectura desnormalizado: un documento por producto o postre vendible
+class ItemCatalogo(Document):
+    id: str = Field(..., alias="_id")  # "<coleccion>:<id>"
+    tipo: str  # "Producto" o "Postre"
+    id_origen: int
+    nombre: str
+    descripcion: str
+    categoria: str
+    categoria_descripcion: Optional[str] = None
+    disponible: int
+    precio: Optional[float] = None  # Solo productos
+    rebanadas: Optional[int] = None  # Solo postres
+    precio_rebanada: Optional[float] = None
+    precio_total: Optional[float] = None
+
+    class Settings:
+        name = "catalogo"
+        indices = [
+            # Consultas por categoría y relaciones misma-categoria
+            IndexModel([("categoria", ASCENDING), ("tipo", ASCENDING), ("id_origen", ASCENDING)]),
+            indice_texto("busqueda_texto_catalogo"),
+        ]
+
+# Segundos que se conserva cada registro de cambios del catálogo (índice TTL sobre `fecha`)
+CATALOG_CHANGELOG_TTL_SECONDS = int(os.getenv("CATALOG_CHANGELOG_TTL_SECONDS", "3600"))
+
+# Registro de cambios del catálogo: los IDs que tocó cada versión, para que los demás workers
+# pongan al día su instantánea leyendo solo esos documentos
+class CambioCatalogo(Document):
+    id: int = Field(..., alias="_id")  # Versión del catálogo
+    coleccion: str
+    ids: List[int]
+    fecha: datetime
+
+    class Settings:
+        name = "cambios_catalogo"
+        indices = [IndexModel([("fecha", ASCENDING)], expireAfterSeconds=CATALOG_CHANGELOG_TTL_SECONDS)]
+
+# ==================== ASIGNACIÓN DE IDS AUTO INCREMENTALES ====================
+
+class AsignadorIDs:
+    """
+    Asigna IDs secuenciales usando un único find_one_and_update atómico ($inc + upsert).
+    Con tamano_bloque > 1 cada worker reserva un bloque de IDs y los entrega desde memoria
+    sin consultar la base de datos; los IDs no usados de un bloque se pierden al apagar.
+    """
+
+    def __init__(self, tamano_bloque: int = 1):
+        self.tamano_bloque = max(1, tamano_bloque)
+        self._bloques = {}  # collection_name -> [siguiente_id, ultimo_id]
+        self._locks = {}
+        self._stats = {}
+
+    def _stats_de(self, collection_name: str) -> dict:
+        if collection_name not in self._stats:
+            self._stats[collection_name] = {
+                "reservas": 0,
+                "ids_reservados": 0,
+                "ids_entregados": 0,
+                "ids_perdidos": 0,
+                "perdidos_por_bloque": deque(maxlen=20),
+            }
+        return self._stats[collection_name]
+
+    async def reservar_rango(self, collection_name: str, cantidad: int) -> int:
+        """Reserva `cantidad` IDs contiguos en un solo viaje y devuelve el primero"""
+        contador = await Contador.get_motor_collection().find_one_and_update(
+            {"collection_name": collection_name},
+            {"$inc": {"sequence_value": cantidad}},
+            projection={"_id": 0, "sequence_value": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        stats = self._stats_de(collection_name)
+        stats["reservas"] += 1
+        stats["ids_reservados"] += cantidad
+        return contador["sequence_value"] - cantidad + 1
+
+    async def siguiente(self, collection_name: str) -> int:
+        """Obtiene el siguiente ID, desde el bloque en memoria si hay uno disponible"""
+        if self.tamano_bloque == 1:
+            nuevo_id = await self.reservar_rango(collection_name, 1)
+            self._stats_de(collection_name)["ids_entregados"] += 1
+            return nuevo_id
+
+        lock = self._locks.setdefault(collection_name, asyncio.Lock())
+        async with lock:
+            bloque = self._bloques.get(collection_name)
+            if bloque is None or bloque[0] > bloque[1]:
+                if bloque is not None:
+                    # Bloque agotado por completo: no se perdió ningún ID
+                    self._stats_de(collection_name)["perdidos_por_bloque"].append(0)
+                inicio = await self.reservar_rango(collection_name, self.tamano_bloque)
+                bloque = [inicio, inicio + self.tamano_bloque - 1]
+                self._bloques[collection_name] = bloque
+            nuevo_id = bloque[0]
+            bloque[0] += 1
+        self._stats_de(collection_name)["ids_entregados"] += 1
+        return nuevo_id
+
+    async def descartar_bloques(self):
+        """
+        Descarta los bloques en memoria: registra en el log cada rango sin usar y acumula la
+        cantidad en el campo `ids_perdidos` de su contador, así sobrevive al reinicio del worker.
+        """
+        for collection_name, (siguiente_id, ultimo_id) in self._bloques.items():
+            perdidos = max(0, ultimo_id - siguiente_id + 1)
+            stats = self._stats_de(collection_name)
+            stats["ids_perdidos"] += perdidos
+            stats["perdidos_por_bloque"].append(perdidos)
+            if not perdidos:
+                continue
+            print(f"🕳️ IDs {siguiente_id}-{ultimo_id} de {collection_name} reservados y sin usar")
+            try:
+                await Contador.get_motor_collection().update_one(
+                    {"collection_name": collection_name}, {"$inc": {"ids_perdidos": perdidos}}
+                )
+            except PyMongoError as e:
+                print(f"⚠️ No se pudieron registrar los IDs perdidos de {collection_name}: {e}")
+        self._bloques.clear()
+
+    def estadisticas(self) -> dict:
+        """Resumen de reservas, IDs entregados y perdidos por colección"""
+        resultado = {}
+        for collection_name, stats in self._stats.items():
+            bloque = self._bloques.get(collection_name)
+            resultado[collection_name] = {
+                "reservas": stats["reservas"],
+                "ids_reservados": stats["ids_reservados"],
+                "ids_entregados": stats["ids_entregados"],
+                "ids_perdidos": stats["ids_perdidos"],
+                "ids_pendientes_en_bloque": max(0, bloque[1] - bloque[0] + 1) if bloque else 0,
+                "perdidos_por_bloque": list(stats["perdidos_por_bloque"]),
+            }
+        return {"tamano_bloque": self.tamano_bloque, "colecciones": resultado}
+
+# Tamaño de bloque configurable (1 = sin reserva por bloques)
+asignador_ids = AsignadorIDs(tamano_bloque=int(os.getenv("ID_BLOCK_SIZE", "1")))
 
 # Función para obtener el siguiente ID
 async def get_next_sequence_value(collection_name: str) -> int:
     """Obtiene el siguiente valor de secuencia para una colección"""
-    contador = await Contador.find_one(Contador.collection_name == collection_name)
-    
-    if not contador:
-        # Crear contador si no existe
-        contador = Contador(collection_name=collection_name, sequence_value=1)
-        await contador.insert()
-        return 1
-    else:
-        # Incrementar y actualizar
-        nuevo_valor = contador.sequence_value + 1
-        await contador.update({"$set": {"sequence_value": nuevo_valor}})
-        return nuevo_valor
+    return await asignador_ids.siguiente(collection_name)
 
 # Esquemas Pydantic para Categorías
 class CategoriaCreate(BaseModel):
@@ -137,6 +354,794 @@ class PostreResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Esquemas Pydantic para altas masivas
+class ResultadoBulkItem(BaseModel):
+    indice: int
+    id: Optional[int] = None
+    estado: str
+    detalle: Optional[str] = None
+
+class ResultadoBulk(BaseModel):
+    total: int
+    insertados: int
+    errores: int
+    resultados: List[ResultadoBulkItem]
+
+# Esquema Pydantic para cambios de disponibilidad en lote
+class DisponibilidadLote(BaseModel):
+    disponible: int = Field(..., ge=0, le=1)
+    productos: List[int] = Field(default_factory=list)
+    postres: List[int] = Field(default_factory=list)
+
+# ==================== MÉTRICAS ====================
+
+# Límites (en segundos) de los buckets de los histogramas de latencia
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RegistroMetricas:
+    """
+    Contadores e histogramas en memoria expuestos en formato de texto de Prometheus.
+    Es seguro entre hilos porque los listeners de pymongo corren en el pool de Motor.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}  # (nombre, etiquetas) -> valor
+        self._gauges = {}  # (nombre, etiquetas) -> valor
+        self._histogramas = {}  # (nombre, etiquetas) -> [conteos_por_bucket, suma, total]
+        self._ayuda = {}
+
+    def describir(self, nombre: str, tipo: str, ayuda: str):
+        self._ayuda[nombre] = (tipo, ayuda)
+
+    def incrementar(self, nombre: str, valor: float = 1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def fijar(self, nombre: str, valor: float, **etiquetas):
+        with self._lock:
+            self._gauges[(nombre, tuple(sorted(etiquetas.items())))] = valor
+
+    def observar(self, nombre: str, valor: float, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [[0] * len(BUCKETS_LATENCIA), 0.0, 0]
+            for i, limite in enumerate(BUCKETS_LATENCIA):
+                if valor <= limite:
+                    histograma[0][i] += 1
+            histograma[1] += valor
+            histograma[2] += 1
+
+    @staticmethod
+    def _etiquetas(etiquetas, extra=()) -> str:
+        partes = []
+        for clave, valor in (*etiquetas, *extra):
+            valor = str(valor).replace("\\", "\\\\").replace('"', '\\"')
+            partes.append(f'{clave}="{valor}"')
+        return "{" + ",".join(partes) + "}" if partes else ""
+
+    def exportar(self) -> str:
+        """Genera el texto de exposición de Prometheus"""
+        with self._lock:
+            contadores = dict(self._contadores)
+            gauges = dict(self._gauges)
+            histogramas = {k: (list(v[0]), v[1], v[2]) for k, v in self._histogramas.items()}
+
+        lineas = []
+        series = {}
+        for (nombre, etiquetas), valor in contadores.items():
+            series.setdefault(nombre, []).append(f"{nombre}{self._etiquetas(etiquetas)} {valor}")
+        for (nombre, etiquetas), valor in gauges.items():
+            series.setdefault(nombre, []).append(f"{nombre}{self._etiquetas(etiquetas)} {valor}")
+        for (nombre, etiquetas), (buckets, suma, total) in histogramas.items():
+            muestras = series.setdefault(nombre, [])
+            for limite, conteo in zip(BUCKETS_LATENCIA, buckets):
+                muestras.append(f"{nombre}_bucket{self._etiquetas(etiquetas, [('le', limite)])} {conteo}")
+            muestras.append(f"{nombre}_bucket{self._etiquetas(etiquetas, [('le', '+Inf')])} {total}")
+            muestras.append(f"{nombre}_sum{self._etiquetas(etiquetas)} {suma}")
+            muestras.append(f"{nombre}_count{self._etiquetas(etiquetas)} {total}")
+
+        for nombre in sorted(series):
+            if nombre in self._ayuda:
+                tipo, ayuda = self._ayuda[nombre]
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} {tipo}")
+            lineas.extend(series[nombre])
+        return "\n".join(lineas) + "\n"
+
+metricas = RegistroMetricas()
+metricas.describir("http_request_duration_seconds", "histogram", "Latencia de las peticiones HTTP por ruta y estado")
+metricas.describir("mongodb_commands_total", "counter", "Comandos enviados a MongoDB por colección y resultado")
+metricas.describir("mongodb_command_duration_seconds", "histogram", "Duración de los comandos de MongoDB")
+metricas.describir("mongodb_documents_returned_total", "counter", "Documentos devueltos por MongoDB por colección")
+metricas.describir("mongodb_slow_commands_total", "counter", "Comandos de MongoDB que superaron SLOW_QUERY_MS")
+metricas.describir("mongodb_pool_checkout_wait_seconds", "histogram", "Espera para obtener una conexión del pool")
+metricas.describir("mongodb_pool_connections", "gauge", "Conexiones abiertas en el pool por servidor")
+metricas.describir("mongodb_pool_checked_out", "gauge", "Conexiones del pool en uso por servidor")
+metricas.describir("mongodb_pool_checkout_failed_total", "counter", "Checkouts del pool fallidos por motivo (timeout, pool cerrado, error de conexión)")
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mide la latencia por plantilla de ruta, método y estado"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = {"codigo": 500}
+
+        async def send_con_estado(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_con_estado)
+        finally:
+            ruta = scope.get("route")
+            metricas.observar(
+                "http_request_duration_seconds",
+                time.perf_counter() - inicio,
+                route=getattr(ruta, "path", "sin_ruta"),
+                method=scope["method"],
+                status=estado["codigo"]
+            )
+
+# Comandos de MongoDB más lentos que este umbral se registran en el log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+consultas_lentas = deque(maxlen=100)
+
+def forma_filtro(valor):
+    """Reemplaza los valores de un filtro por "?" conservando campos y operadores"""
+    if isinstance(valor, dict):
+        return {k: forma_filtro(v) for k, v in valor.items()}
+    if isinstance(valor, list):
+        if valor and all(isinstance(v, dict) for v in valor):
+            return [forma_filtro(v) for v in valor]
+        return ["?"]
+    return "?"
+
+class MonitorComandos(monitoring.CommandListener):
+    """Listener de pymongo que registra conteos, duración y documentos por colección"""
+
+    def __init__(self):
+        self._pendientes = {}
+
+    def started(self, event):
+        coleccion = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        if not isinstance(coleccion, str):
+            coleccion = "admin"
+        filtro = event.command.get("filter", event.command.get("query", event.command.get("pipeline")))
+        self._pendientes[event.request_id] = (coleccion, filtro)
+
+    def _terminar(self, event, resultado: str):
+        coleccion, filtro = self._pendientes.pop(event.request_id, ("desconocida", None))
+        duracion = event.duration_micros / 1_000_000
+        metricas.incrementar("mongodb_commands_total", collection=coleccion, command=event.command_name, result=resultado)
+        metricas.observar("mongodb_command_duration_seconds", duracion, collection=coleccion, command=event.command_name)
+        registrar_en_traza(f"mongo:{event.command_name}", duracion)
+
+        if resultado == "ok":
+            cursor = event.reply.get("cursor") if isinstance(event.reply, dict) else None
+            if cursor:
+                documentos = len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+                metricas.incrementar("mongodb_documents_returned_total", documentos, collection=coleccion)
+
+        if duracion * 1000 >= SLOW_QUERY_MS:
+            entrada = {
+                "coleccion": coleccion,
+                "comando": event.command_name,
+                "duracion_ms": round(duracion * 1000, 2),
+                "filtro": forma_filtro(filtro) if filtro is not None else None,
+                "resultado": resultado
+            }
+            consultas_lentas.append(entrada)
+            metricas.incrementar("mongodb_slow_commands_total", collection=coleccion, command=event.command_name)
+            print(f"🐢 Consulta lenta: {json.dumps(entrada, ensure_ascii=False)}")
+
+    def succeeded(self, event):
+        self._terminar(event, "ok")
+
+    def failed(self, event):
+        self._terminar(event, "error")
+
+class MonitorPool(monitoring.ConnectionPoolListener):
+    """
+    Listener del pool de conexiones: mide la espera para obtener una conexión y lleva por
+    servidor las conexiones abiertas, las que están en uso y los checkouts fallidos.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._servidores = {}  # "host:puerto" -> {"abiertas", "en_uso", "fallidos"}
+
+    def _ajustar(self, direccion, campo: str, delta: int):
+        servidor = "%s:%s" % direccion
+        with self._lock:
+            estado = self._servidores.setdefault(servidor, {"abiertas": 0, "en_uso": 0, "fallidos": 0})
+            estado[campo] = max(0, estado[campo] + delta)
+            valor = estado[campo]
+        if campo == "abiertas":
+            metricas.fijar("mongodb_pool_connections", valor, servidor=servidor)
+        elif campo == "en_uso":
+            metricas.fijar("mongodb_pool_checked_out", valor, servidor=servidor)
+
+    def connection_check_out_started(self, event):
+        self._local.inicio = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        inicio = getattr(self._local, "inicio", None)
+        if inicio is not None:
+            espera = time.perf_counter() - inicio
+            metricas.observar("mongodb_pool_checkout_wait_seconds", espera)
+            registrar_en_traza("pool", espera)
+            self._local.inicio = None
+        self._ajustar(event.address, "en_uso", 1)
+
+    def connection_check_out_failed(self, event):
+        self._local.inicio = None
+        self._ajustar(event.address, "fallidos", 1)
+        metricas.incrementar("mongodb_pool_checkout_failed_total", motivo=event.reason)
+
+    def connection_checked_in(self, event):
+        self._ajustar(event.address, "en_uso", -1)
+
+    def connection_created(self, event):
+        self._ajustar(event.address, "abiertas", 1)
+
+    def connection_closed(self, event):
+        self._ajustar(event.address, "abiertas", -1)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            return {servidor: dict(estado) for servidor, estado in self._servidores.items()}
+
+    # Eventos del pool que no se miden
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+
+monitor_comandos = MonitorComandos()
+monitor_pool = MonitorPool()
+
+# ==================== POOL DE CONEXIONES Y PREFERENCIA DE LECTURA ====================
+
+# Variable de entorno -> (opción de pymongo, conversión). Las no definidas quedan con el valor
+# de pymongo o el de MONGODB_URL
+OPCIONES_POOL = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_MAX_CONNECTING": ("maxConnecting", int),
+    "MONGO_COMPRESSORS": ("compressors", str),  # p. ej. "zstd,snappy,zlib"
+}
+
+# Workers de uvicorn (cada uno es un proceso con su propio pool de conexiones)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+def opciones_pool() -> dict:
+    """Opciones del pool de Motor definidas por variables de entorno"""
+    opciones = {
+        opcion: conversion(os.environ[variable])
+        for variable, (opcion, conversion) in OPCIONES_POOL.items() if os.getenv(variable)
+    }
+    # MONGO_TOTAL_POOL_SIZE reparte un total de conexiones por servidor entre todos los workers
+    total = os.getenv("MONGO_TOTAL_POOL_SIZE")
+    if total and "maxPoolSize" not in opciones:
+        opciones["maxPoolSize"] = max(1, int(total) // WEB_CONCURRENCY)
+    return opciones
+
+# Preferencia para las lecturas de solo consulta (listados, búsqueda, estadísticas, relaciones).
+# Las escrituras, las lecturas por ID y las que forman parte de una escritura siguen en el primario.
+MODOS_LECTURA = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+READ_PREFERENCE = os.getenv("READ_PREFERENCE", "primary")
+READ_MAX_STALENESS_SECONDS = int(os.getenv("READ_MAX_STALENESS_SECONDS", "90"))
+
+def preferencia_lectura(modo: str, max_staleness: int):
+    """Construye la preferencia de lectura; primary no admite maxStalenessSeconds"""
+    if modo == "primary":
+        return Primary()
+    if modo not in MODOS_LECTURA:
+        raise ValueError(f"READ_PREFERENCE inválido: {modo}")
+    return MODOS_LECTURA[modo](max_staleness=max_staleness)
+
+preferencia_solo_lectura = preferencia_lectura(READ_PREFERENCE, READ_MAX_STALENESS_SECONDS)
+
+def coleccion_lectura(documento):
+    """Colección de Motor para lecturas de solo consulta, con la preferencia configurada"""
+    coleccion = documento.get_motor_collection()
+    if READ_PREFERENCE == "primary":
+        return coleccion
+    return coleccion.with_options(read_preference=preferencia_solo_lectura)
+
+# ==================== CONTROL DE ADMISIÓN ====================
+
+class ClaseAdmision:
+    """Límite de peticiones concurrentes de una clase de rutas y su prioridad (0 = la más alta)"""
+
+    def __init__(self, nombre: str, limite: int, prioridad: int):
+        self.nombre = nombre
+        self.limite = limite
+        self.prioridad = prioridad
+        self.en_curso = 0
+        self.esperando = 0
+
+class ControlAdmision:
+    """
+    Limita las peticiones que llegan a MongoDB: cada clase de rutas tiene su propio límite
+    y todas comparten un límite global. Las que no caben esperan en una cola acotada y al
+    liberarse un lugar entra primero la de mayor prioridad (y entre iguales, la más antigua).
+    Si la cola de su clase está llena o la espera supera el timeout se rechazan.
+    """
+
+    def __init__(self, limite_global: int, clases: List[ClaseAdmision], max_cola: int, timeout: float):
+        self.limite_global = limite_global
+        self.clases = {clase.nombre: clase for clase in clases}
+        self.max_cola = max_cola
+        self.timeout = timeout
+        self.en_curso = 0
+        self._cola = []  # heap de (prioridad, llegada, futuro, clase)
+        self._llegadas = itertools.count()
+
+    def _publicar(self, clase: ClaseAdmision):
+        metricas.fijar("admission_in_flight", clase.en_curso, clase=clase.nombre)
+        metricas.fijar("admission_queue_depth", clase.esperando, clase=clase.nombre)
+
+    def _ocupar(self, clase: ClaseAdmision):
+        clase.en_curso += 1
+        self.en_curso += 1
+        self._publicar(clase)
+
+    def _hay_lugar(self, clase: ClaseAdmision) -> bool:
+        return clase.en_curso < clase.limite and self.en_curso < self.limite_global
+
+    def _despachar(self):
+        """Da los lugares libres a las peticiones en espera por orden de prioridad"""
+        bloqueadas = []
+        while self._cola and self.en_curso < self.limite_global:
+            entrada = heapq.heappop(self._cola)
+            _, _, futuro, clase = entrada
+            if futuro.done():
+                continue  # Expiró o el cliente se desconectó
+            if clase.en_curso >= clase.limite:
+                bloqueadas.append(entrada)
+                continue
+            clase.esperando -= 1
+            self._ocupar(clase)
+            futuro.set_result(None)
+        for entrada in bloqueadas:
+            heapq.heappush(self._cola, entrada)
+
+    async def entrar(self, nombre: str) -> bool:
+        """Espera un lugar para una petición de la clase; False si se debe rechazar"""
+        clase = self.clases[nombre]
+        if self._hay_lugar(clase):
+            self._ocupar(clase)
+            return True
+        if clase.esperando >= self.max_cola:
+            metricas.incrementar("admission_rejected_total", clase=nombre, motivo="cola_llena")
+            return False
+
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._cola, (clase.prioridad, next(self._llegadas), futuro, clase))
+        clase.esperando += 1
+        self._publicar(clase)
+        inicio = time.perf_counter()
+        try:
+            await asyncio.wait_for(futuro, self.timeout)
+            return True
+        except asyncio.TimeoutError:
+            clase.esperando -= 1
+            self._publicar(clase)
+            metricas.incrementar("admission_rejected_total", clase=nombre, motivo="timeout")
+            return False
+        except asyncio.CancelledError:
+            if futuro.done() and not futuro.cancelled():
+                self.salir(nombre)  # Se le asignó lugar justo antes de cancelarse
+            else:
+                clase.esperando -= 1
+                self._publicar(clase)
+            raise
+        finally:
+            metricas.observar("admission_wait_seconds", time.perf_counter() - inicio, clase=nombre)
+
+    def salir(self, nombre: str):
+        clase = self.clases[nombre]
+        clase.en_curso -= 1
+        self.en_curso -= 1
+        self._publicar(clase)
+        self._despachar()
+
+metricas.describir("admission_in_flight", "gauge", "Peticiones en curso por clase de ruta")
+metricas.describir("admission_queue_depth", "gauge", "Peticiones esperando lugar por clase de ruta")
+metricas.describir("admission_wait_seconds", "histogram", "Tiempo de espera en la cola de admisión")
+metricas.describir("admission_rejected_total", "counter", "Peticiones rechazadas con 503 por cola llena o timeout")
+
+# Prioridad de cada clase: las escrituras pasan antes que las estadísticas y tareas pesadas
+PRIORIDADES_ADMISION = {"escrituras": 0, "lecturas": 1, "busqueda": 1, "estadisticas": 2, "masivas": 2}
+
+# Escrituras en lote o por flujo: cada una ocupa MongoDB mucho más que un alta suelta
+RUTAS_MASIVAS = ("/importar", "/productos/bulk", "/postres/bulk")
+
+# Rutas que no consultan MongoDB o son de monitoreo
+RUTAS_SIN_ADMISION = ("/ready", "/metrics", "/profiler", "/docs", "/redoc", "/openapi.json", "/buscador", "/sugerencias", "/cache")
+
+def clase_admision(metodo: str, ruta: str) -> Optional[str]:
+    """Clase de admisión de una petición (None si no pasa por el control)"""
+    if metodo == "OPTIONS" or ruta == "/" or ruta.startswith(RUTAS_SIN_ADMISION):
+        return None
+    if ruta.startswith(("/estadisticas", "/exportar", "/catalogo/reconstruir")):
+        return "estadisticas"
+    if metodo not in ("GET", "HEAD"):
+        if ruta.startswith(RUTAS_MASIVAS):
+            return "masivas"
+        return "escrituras"
+    if ruta.startswith("/buscar"):
+        return "busqueda"
+    return "lecturas"
+
+def limites_admision(texto: str) -> Dict[str, int]:
+    """Interpreta "clase=limite,clase=limite" completando con los valores por defecto"""
+    limites = {"escrituras": 60, "busqueda": 30, "lecturas": 80, "estadisticas": 10, "masivas": 4}
+    for parte in texto.split(","):
+        if "=" in parte:
+            clase, limite = parte.split("=", 1)
+            limites[clase.strip()] = int(limite)
+    return limites
+
+# Espera máxima en cola antes de responder 503 (y sugerencia de Retry-After)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1.0"))
+
+control_admision = ControlAdmision(
+    limite_global=int(os.getenv("ADMISSION_MAX_CONCURRENT", "100")),
+    clases=[
+        ClaseAdmision(nombre, limite, PRIORIDADES_ADMISION.get(nombre, 1))
+        for nombre, limite in limites_admision(os.getenv("ADMISSION_LIMITS", "")).items()
+    ],
+    max_cola=int(os.getenv("ADMISSION_QUEUE_SIZE", "200")),
+    timeout=ADMISSION_QUEUE_TIMEOUT
+)
+
+class MiddlewareAdmision:
+    """Middleware ASGI que aplica el control de admisión y responde 503 con Retry-After si hay sobrecarga"""
+
+    def __init__(self, app, control: ControlAdmision):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        clase = clase_admision(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if clase is None:
+            await self.app(scope, receive, send)
+            return
+
+        with tramo("admision"):
+            admitida = await self.control.entrar(clase)
+        if not admitida:
+            respuesta = ORJSONResponse(
+                {"detail": "Servidor saturado, intenta de nuevo en unos segundos"},
+                status_code=503,
+                headers={"Retry-After": str(max(1, math.ceil(ADMISSION_QUEUE_TIMEOUT)))}
+            )
+            await respuesta(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.control.salir(clase)
+
+# ==================== PERFILADOR Y TRAZAS ====================
+
+# Token que protege /profiler y activa el perfilado de una petición con el header X-Profile
+# (vacío = perfilador deshabilitado)
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+# Fracción de peticiones perfiladas y prefijos de ruta que se perfilan siempre (p. ej. "/buscar,/estadisticas")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_ROUTES = os.getenv("PROFILE_ROUTES", "")
+# Intervalo del muestreo de pilas y límites de memoria
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_MAX_TRACES = int(os.getenv("PROFILE_MAX_TRACES", "500"))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "5000"))
+
+# Traza de la petición en curso; Motor copia el contexto a sus hilos, así los listeners de
+# pymongo también la ven. Sin perfilado vale None y tramo() no mide nada.
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+
+class Traza:
+    """Tiempos por etapa de una petición perfilada"""
+    __slots__ = ("metodo", "ruta", "inicio", "duracion", "estado", "tramos")
+
+    def __init__(self, metodo: str, ruta: str):
+        self.metodo = metodo
+        self.ruta = ruta
+        self.inicio = time.perf_counter()
+        self.duracion = None
+        self.estado = None
+        self.tramos = []  # (etapa, segundos); "mongo:find" cuenta como etapa "mongo"
+
+    def agregar(self, nombre: str, segundos: float):
+        self.tramos.append((nombre, segundos))
+
+    def etapas(self) -> Dict[str, float]:
+        """Segundos por etapa, con el resto de la petición en "otros" (framework, middlewares, espera del loop)"""
+        etapas = {}
+        for nombre, segundos in self.tramos:
+            etapa = nombre.partition(":")[0]
+            etapas[etapa] = etapas.get(etapa, 0.0) + segundos
+        etapas["otros"] = max(0.0, self.duracion - sum(etapas.values()))
+        return etapas
+
+    def resumen(self) -> dict:
+        return {
+            "metodo": self.metodo,
+            "ruta": self.ruta,
+            "estado": self.estado,
+            "duracion_ms": round(self.duracion * 1000, 3),
+            "etapas_ms": {etapa: round(s * 1000, 3) for etapa, s in self.etapas().items()},
+            "tramos": [(nombre, round(s * 1000, 3)) for nombre, s in self.tramos],
+        }
+
+class _Tramo:
+    __slots__ = ("traza", "nombre", "inicio")
+
+    def __init__(self, traza: Traza, nombre: str):
+        self.traza = traza
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.traza.agregar(self.nombre, time.perf_counter() - self.inicio)
+
+class _TramoVacio:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+_TRAMO_VACIO = _TramoVacio()
+
+def tramo(nombre: str):
+    """Mide un bloque como etapa de la traza actual (hidratacion, respuesta, serializacion...)"""
+    traza = _traza_actual.get()
+    return _TRAMO_VACIO if traza is None else _Tramo(traza, nombre)
+
+def registrar_en_traza(nombre: str, segundos: float):
+    """Agrega un tramo ya medido (p. ej. desde los listeners de pymongo) a la traza actual"""
+    traza = _traza_actual.get()
+    if traza is not None:
+        traza.agregar(nombre, segundos)
+
+class MuestreadorPilas:
+    """
+    Perfilador por muestreo: un hilo toma la pila del hilo del event loop cada `intervalo_ms`
+    mientras haya peticiones perfiladas en curso y acumula pilas plegadas (formato de
+    flamegraph.pl / speedscope). Sin peticiones perfiladas el hilo queda bloqueado en un Event.
+    Las muestras incluyen lo que el loop ejecute en ese momento, sea o no de la petición perfilada.
+    """
+
+    def __init__(self, intervalo_ms: float, max_pilas: int):
+        self.intervalo = intervalo_ms / 1000
+        self.max_pilas = max_pilas
+        self.muestras = 0
+        self._pilas = {}  # "a;b;c" -> muestras
+        self._activas = 0
+        self._lock = threading.Lock()
+        self._hay_activas = threading.Event()
+        self._hilo = None
+        self._hilo_loop = None
+
+    def entrar(self):
+        with self._lock:
+            self._activas += 1
+            self._hay_activas.set()
+            self._hilo_loop = threading.get_ident()
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._muestrear, name="muestreador-pilas", daemon=True)
+                self._hilo.start()
+
+    def salir(self):
+        with self._lock:
+            self._activas -= 1
+            if self._activas == 0:
+                self._hay_activas.clear()
+
+    def _muestrear(self):
+        while True:
+            self._hay_activas.wait()
+            frame = sys._current_frames().get(self._hilo_loop)
+            pila = []
+            while frame is not None:
+                codigo = frame.f_code
+                pila.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                frame = frame.f_back
+            del frame
+            if pila:
+                clave = ";".join(reversed(pila))
+                with self._lock:
+                    if clave not in self._pilas and len(self._pilas) >= self.max_pilas:
+                        clave = "[pilas descartadas]"
+                    self._pilas[clave] = self._pilas.get(clave, 0) + 1
+                    self.muestras += 1
+            time.sleep(self.intervalo)
+
+    def plegadas(self) -> str:
+        with self._lock:
+            return "".join(f"{pila} {n}\n" for pila, n in sorted(self._pilas.items()))
+
+    def limpiar(self):
+        with self._lock:
+            self._pilas.clear()
+            self.muestras = 0
+
+class Perfilador:
+    """Decide qué peticiones se perfilan y guarda sus trazas recientes"""
+
+    def __init__(self, token: str, tasa: float, rutas: str, muestreador: MuestreadorPilas, max_trazas: int):
+        self.token = token
+        self.muestreador = muestreador
+        self.trazas = deque(maxlen=max_trazas)
+        self.configurar(tasa, rutas, None)
+
+    def configurar(self, tasa: float, rutas: str, segundos: Optional[float]):
+        """Cambia la fracción muestreada y las rutas; con `segundos` se desactiva solo al vencer"""
+        self.tasa = min(1.0, max(0.0, tasa))
+        self.rutas = tuple(r.strip() for r in rutas.split(",") if r.strip())
+        self.hasta = time.monotonic() + segundos if segundos else None
+        self.activo = self.tasa > 0 or bool(self.rutas)
+
+    def debe_perfilar(self, scope) -> bool:
+        if not self.activo and not self.token:
+            return False
+        ruta = scope["path"]
+        if ruta.startswith("/profiler"):
+            return False
+        if self.token:
+            for nombre, valor in scope["headers"]:
+                if nombre == b"x-profile":
+                    return secrets.compare_digest(valor, self.token.encode())
+        if not self.activo:
+            return False
+        if self.hasta is not None and time.monotonic() >= self.hasta:
+            self.configurar(0, "", None)
+            return False
+        if self.rutas and ruta.startswith(self.rutas):
+            return True
+        return self.tasa > 0 and random.random() < self.tasa
+
+    def registrar(self, traza: Traza):
+        self.trazas.append(traza)
+        metricas.incrementar("profiler_traces_total", route=traza.ruta)
+
+    def resumen(self, ultimas: int) -> dict:
+        """Por ruta: peticiones, percentiles de duración y promedio por etapa; más las últimas trazas"""
+        trazas = list(self.trazas)
+        por_ruta = {}
+        for traza in trazas:
+            por_ruta.setdefault(f"{traza.metodo} {traza.ruta}", []).append(traza)
+        rutas = {}
+        for ruta, lista in por_ruta.items():
+            duraciones = sorted(t.duracion for t in lista)
+            etapas = {}
+            for traza in lista:
+                for etapa, segundos in traza.etapas().items():
+                    etapas[etapa] = etapas.get(etapa, 0.0) + segundos
+            rutas[ruta] = {
+                "peticiones": len(lista),
+                "p50_ms": round(duraciones[len(duraciones) // 2] * 1000, 3),
+                "p95_ms": round(duraciones[min(len(duraciones) - 1, int(len(duraciones) * 0.95))] * 1000, 3),
+                "max_ms": round(duraciones[-1] * 1000, 3),
+                "promedio_por_etapa_ms": {e: round(s / len(lista) * 1000, 3) for e, s in sorted(etapas.items())},
+            }
+        return {
+            "activo": self.activo,
+            "tasa": self.tasa,
+            "rutas_perfiladas": list(self.rutas),
+            "segundos_restantes": round(max(0.0, self.hasta - time.monotonic()), 1) if self.hasta else None,
+            "muestras_de_pila": self.muestreador.muestras,
+            "rutas": rutas,
+            "ultimas": [t.resumen() for t in trazas[-ultimas:]] if ultimas else [],
+        }
+
+    def tramos_plegados(self) -> str:
+        """Trazas como pilas plegadas "METODO ruta;etapa;tramo microsegundos" para un flamegraph"""
+        acumulado = {}
+        for traza in list(self.trazas):
+            raiz = f"{traza.metodo} {traza.ruta}"
+            for nombre, segundos in traza.tramos:
+                clave = ";".join((raiz, *nombre.split(":")))
+                acumulado[clave] = acumulado.get(clave, 0.0) + segundos
+            clave = f"{raiz};otros"
+            acumulado[clave] = acumulado.get(clave, 0.0) + traza.etapas()["otros"]
+        return "".join(f"{pila} {int(s * 1_000_000)}\n" for pila, s in sorted(acumulado.items()))
+
+perfilador = Perfilador(
+    PROFILER_TOKEN, PROFILE_SAMPLE_RATE, PROFILE_ROUTES,
+    MuestreadorPilas(PROFILE_INTERVAL_MS, PROFILE_MAX_STACKS), PROFILE_MAX_TRACES
+)
+metricas.describir("profiler_traces_total", "counter", "Peticiones perfiladas por ruta")
+
+class MiddlewarePerfilado:
+    """Middleware ASGI que abre una traza para las peticiones elegidas por el perfilador"""
+
+    def __init__(self, app, perfilador: Perfilador):
+        self.app = app
+        self.perfilador = perfilador
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.perfilador.debe_perfilar(scope):
+            await self.app(scope, receive, send)
+            return
+
+        traza = Traza(scope["method"], scope["path"])
+        token = _traza_actual.set(traza)
+
+        async def send_con_estado(mensaje):
+            if mensaje["type"] == "http.response.start":
+                traza.estado = mensaje["status"]
+            await send(mensaje)
+
+        self.perfilador.muestreador.entrar()
+        try:
+            await self.app(scope, receive, send_con_estado)
+        finally:
+            self.perfilador.muestreador.salir()
+            _traza_actual.reset(token)
+            traza.duracion = time.perf_counter() - traza.inicio
+            traza.ruta = getattr(scope.get("route"), "path", scope["path"])
+            self.perfilador.registrar(traza)
+
+# ==================== COMPRESIÓN ====================
+
+# Tipos que se envían por partes (búsqueda con stream=true, exportación): gzip acumula la salida
+# hasta llenar su buffer, así que el cliente no recibiría nada hasta el final. Van sin comprimir.
+TIPOS_SIN_GZIP = {"application/x-ndjson", "text/csv"}
+
+class _RespuestaGZip(GZipResponder):
+    """GZipResponder que deja pasar sin comprimir las respuestas de TIPOS_SIN_GZIP"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sin_comprimir = False
+
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            tipo = Headers(raw=message["headers"]).get("content-type", "")
+            self.sin_comprimir = tipo.split(";")[0].strip() in TIPOS_SIN_GZIP
+        if self.sin_comprimir:
+            await self.send(message)
+        else:
+            await super().send_with_gzip(message)
+
+class MiddlewareGZip(GZipMiddleware):
+    """Compresión negociada con Accept-Encoding, salvo para las respuestas por partes"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            await _RespuestaGZip(self.app, self.minimum_size, compresslevel=self.compresslevel)(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
 # Crear la app FastAPI
 app = FastAPI(
     title="API Cafetería El Rincón Mexicano - MongoDB con Auto Incremento",
@@ -144,6 +1149,10 @@ app = FastAPI(
     version="2.1.0"
 )
 
+# Control de admisión (el más interno, para que los 503 lleven los headers de CORS)
+if os.getenv("ADMISSION_CONTROL", "1") == "1":
+    app.add_middleware(MiddlewareAdmision, control=control_admision)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -151,148 +1160,323 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Query-Index", "ETag", "Retry-After"],
 )
 
-# Función para inicializar datos de ejemplo
-async def init_sample_data():
-    """Inicializa la base de datos con categorías, productos y postres de ejemplo"""
-    
-    # Verificar si ya existen categorías
-    count_categorias = await Categoria.count()
-    
-    if count_categorias == 0:
-        # Inicializar contadores
-        await Contador.delete_all()  # Limpiar contadores existentes
-        
-        # Crear contadores para cada colección
-        contadores = [
-            Contador(collection_name="categorias", sequence_value=0),
-            Contador(collection_name="productos", sequence_value=0),
-            Contador(collection_name="postres", sequence_value=0)
-        ]
-        await Contador.insert_many(contadores)
-        
-        # Crear categorías con IDs secuenciales
-        categorias_data = [
-            {"nombre": "torta", "descripcion": "Tortas tradicionales mexicanas"},
-            {"nombre": "cuernito", "descripcion": "Cuernitos y croissants horneados"},
-            {"nombre": "quesadilla", "descripcion": "Quesadillas de tortilla de maíz"},
-            {"nombre": "taco", "descripcion": "Tacos variados"},
-            {"nombre": "baguette", "descripcion": "Baguettes gourmet"},
-            {"nombre": "bebida", "descripcion": "Bebidas frías y calientes"},
-            {"nombre": "postre", "descripcion": "Postres individuales"},
-            {"nombre": "pastel", "descripcion": "Pasteles completos y por rebanada"},
-            {"nombre": "postre_frio", "descripcion": "Postres fríos y gelatinas"}
-        ]
-        
-        categorias_iniciales = []
-        for i, cat_data in enumerate(categorias_data, 1):
-            categoria = Categoria(id=i, **cat_data)
-            categorias_iniciales.append(categoria)
-        
-        await Categoria.insert_many(categorias_iniciales)
-        # Actualizar contador de categorías
-        await Contador.find_one(Contador.collection_name == "categorias").update({"$set": {"sequence_value": len(categorias_data)}})
-        
-        print("✅ Categorías de ejemplo insertadas correctamente")
-    
-    # Verificar si ya existen productos
-    count_productos = await Producto.count()
-    
-    if count_productos == 0:
-        productos_data = [
-            # Tortas
-            {"nombre": "Torta de Jamón", "categoria": "torta", "descripcion": "Torta con jamón, queso, aguacate, jitomate y lechuga en pan telera", "precio": 45.0},
-            {"nombre": "Torta de Milanesa", "categoria": "torta", "descripcion": "Torta con milanesa de res empanizada, aguacate, jitomate, lechuga y frijoles", "precio": 60.0},
-            {"nombre": "Torta Cubana", "categoria": "torta", "descripcion": "Torta con jamón, queso, milanesa, salchicha, chorizo, huevo, aguacate y frijoles", "precio": 85.0},
-            
-            # Cuernitos
-            {"nombre": "Cuernito de Jamón y Queso", "categoria": "cuernito", "descripcion": "Croissant horneado relleno de jamón y queso gouda derretido", "precio": 38.0},
-            {"nombre": "Cuernito 3 Quesos", "categoria": "cuernito", "descripcion": "Croissant horneado relleno de queso manchego, gouda y philadelphia", "precio": 42.0},
-            
-            # Quesadillas
-            {"nombre": "Quesadilla de Queso", "categoria": "quesadilla", "descripcion": "Tortilla de maíz hecha a mano rellena de queso Oaxaca", "precio": 25.0},
-            {"nombre": "Quesadilla de Hongos", "categoria": "quesadilla", "descripcion": "Tortilla de maíz hecha a mano rellena de hongos guisados y queso", "precio": 30.0},
-            {"nombre": "Quesadilla de Tinga", "categoria": "quesadilla", "descripcion": "Tortilla de maíz hecha a mano rellena de tinga de pollo y queso", "precio": 35.0},
-            
-            # Tacos
-            {"nombre": "Taco de Pastor", "categoria": "taco", "descripcion": "Tortilla de maíz con carne de cerdo marinada en adobo y piña", "precio": 18.0},
-            {"nombre": "Taco de Suadero", "categoria": "taco", "descripcion": "Tortilla de maíz con carne de res suadero, cilantro y cebolla", "precio": 20.0},
-            {"nombre": "Taco de Barbacoa", "categoria": "taco", "descripcion": "Tortilla de maíz con carne de barbacoa de borrego, cilantro y cebolla", "precio": 25.0},
-            
-            # Baguettes
-            {"nombre": "Baguette Italiano", "categoria": "baguette", "descripcion": "Pan baguette con jamón serrano, queso provolone, tomate y pesto", "precio": 65.0},
-            {"nombre": "Baguette de Pollo", "categoria": "baguette", "descripcion": "Pan baguette con pollo a la plancha, queso manchego, lechuga y jitomate", "precio": 60.0},
-            
-            # Bebidas
-            {"nombre": "Café Americano", "categoria": "bebida", "descripcion": "Café de grano recién molido, 12 oz", "precio": 30.0},
-            {"nombre": "Agua de Horchata", "categoria": "bebida", "descripcion": "Agua fresca de arroz con canela y vainilla, 16 oz", "precio": 25.0},
-            {"nombre": "Limonada", "categoria": "bebida", "descripcion": "Limonada natural con un toque de menta, 16 oz", "precio": 28.0},
-            
-            # Postres individuales
-            {"nombre": "Rebanada de Pastel de Chocolate", "categoria": "postre", "descripcion": "Rebanada individual de pastel de chocolate con ganache", "precio": 45.0},
-            {"nombre": "Flan Individual", "categoria": "postre", "descripcion": "Porción individual de flan napolitano con caramelo", "precio": 35.0}
+# Compresión negociada (Accept-Encoding: gzip) para respuestas grandes, sin comprimir los streams
+app.add_middleware(MiddlewareGZip, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+# Trazas por etapa de las peticiones perfiladas (incluye gzip y la espera de admisión)
+app.add_middleware(MiddlewarePerfilado, perfilador=perfilador)
+
+# Latencia por ruta (el más externo, para medir la petición completa)
+app.add_middleware(MiddlewareMetricas)
+
+# ==================== SINCRONIZACIÓN DE ÍNDICES ====================
+
+# Modelos cuyos índices declarados (Settings.indices) se concilian con la base al arrancar
+MODELOS_CON_INDICES = [Contador, Categoria, Producto, Postre, ItemCatalogo, CambioCatalogo]
+
+def clave_indice(claves) -> tuple:
+    """Forma comparable de la especificación de un índice (el de texto cuenta como uno solo por colección)"""
+    pares = list(claves.items()) if isinstance(claves, dict) else list(claves)
+    if any(tipo == "text" for _, tipo in pares):
+        return ("text",)
+    return tuple((campo, int(tipo) if isinstance(tipo, float) else tipo) for campo, tipo in pares)
+
+class SincronizadorIndices:
+    """
+    Compara los índices declarados en los modelos con index_information() y crea los que faltan
+    en segundo plano, uno por uno, para que cada índice se use en cuanto termina su construcción.
+    Guarda el reporte de lo que faltaba; /ready responde 503 hasta que todos existen.
+    """
+
+    def __init__(self, modelos: list):
+        self.modelos = modelos
+        self.estado = "pendiente"  # pendiente | construyendo | listo | incompleto
+        self.listo = False  # True cuando todos los índices declarados existen
+        self.indices = []  # Un registro por índice que faltaba
+        self.segundos = None
+        self.error = None
+        self._tarea = None
+
+    async def faltantes(self) -> List[tuple]:
+        """Índices declarados que no existen en la base, como (modelo, IndexModel)"""
+        resultado = []
+        for modelo in self.modelos:
+            existentes = await modelo.get_motor_collection().index_information()
+            claves = {clave_indice(info["key"]) for info in existentes.values()}
+            resultado.extend(
+                (modelo, indice) for indice in modelo.Settings.indices
+                if clave_indice(indice.document["key"]) not in claves
+            )
+        return resultado
+
+    async def conciliar(self):
+        """Crea los índices faltantes y deja el reporte con el resultado de cada uno"""
+        inicio = time.perf_counter()
+        self.estado, self.error = "construyendo", None
+        try:
+            faltantes = await self.faltantes()
+        except PyMongoError as e:
+            self.estado, self.error = "incompleto", str(e)
+            print(f"⚠️ No se pudieron leer los índices existentes: {e}")
+            return
+
+        self.indices = [
+            {"coleccion": modelo.get_motor_collection().name, "indice": indice.document["name"],
+             "estado": "pendiente", "segundos": None, "error": None}
+            for modelo, indice in faltantes
         ]
+        if faltantes:
+            nombres = ", ".join(f"{r['coleccion']}.{r['indice']}" for r in self.indices)
+            print(f"🛠️ Faltan {len(faltantes)} índices, construyendo en segundo plano: {nombres}")
+        self.listo = not faltantes
+        metricas.fijar("mongodb_indexes_missing", len(faltantes))
+
+        for pendientes, ((modelo, indice), registro) in enumerate(zip(faltantes, self.indices), 1):
+            inicio_indice = time.perf_counter()
+            registro["estado"] = "construyendo"
+            try:
+                await modelo.get_motor_collection().create_indexes([indice])
+                registro["estado"] = "creado"
+            except PyMongoError as e:
+                registro["estado"], registro["error"] = "error", str(e)
+                print(f"❌ No se pudo crear el índice {registro['coleccion']}.{registro['indice']}: {e}")
+            registro["segundos"] = round(time.perf_counter() - inicio_indice, 3)
+            metricas.fijar("mongodb_indexes_missing", len(faltantes) - pendientes)
+
+        # La búsqueda recuerda si cada colección tenía índice de texto
+        _indices_texto.clear()
+        self.segundos = round(time.perf_counter() - inicio, 3)
+        self.listo = not any(r["estado"] == "error" for r in self.indices)
+        self.estado = "listo" if self.listo else "incompleto"
+        print(f"✅ Índices conciliados ({len(faltantes)} creados en {self.segundos}s, estado: {self.estado})")
+
+    def iniciar(self) -> asyncio.Task:
+        """Lanza la conciliación en segundo plano si no hay una en curso"""
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self.conciliar())
+        return self._tarea
+
+    def cancelar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+
+    def reporte(self) -> dict:
+        return {
+            "estado": self.estado,
+            "listo": self.listo,
+            "faltantes_al_arrancar": len(self.indices),
+            "segundos": self.segundos,
+            "error": self.error,
+            "indices": self.indices,
+        }
+
+sincronizador_indices = SincronizadorIndices(MODELOS_CON_INDICES)
+metricas.describir("mongodb_indexes_missing", "gauge", "Índices declarados en los modelos que aún no existen en la base")
+
+# ==================== ARRANQUE ====================
+
+# Siembra de datos de ejemplo en colecciones vacías (desactivar en producción)
+SEED_SAMPLE_DATA = os.getenv("SEED_SAMPLE_DATA", "1") == "1"
+# Segundos que el arranque espera la preparación de datos antes de seguir en segundo plano
+STARTUP_TIMEOUT = float(os.getenv("STARTUP_TIMEOUT", "30"))
+# Documento de `contadores` que reclama la siembra; su _id fijo solo lo puede insertar un worker
+MARCA_DATOS_EJEMPLO = "datos_ejemplo"
+
+async def reclamar_siembra() -> bool:
+    """
+    True solo en el worker que crea la marca de siembra. Con WEB_CONCURRENCY > 1 todos los
+    workers arrancan a la vez; los demás (y los arranques posteriores) no vuelven a sembrar.
+    """
+    try:
+        await Contador.get_motor_collection().insert_one(
+            {"_id": MARCA_DATOS_EJEMPLO, "collection_name": MARCA_DATOS_EJEMPLO, "sequence_value": 0}
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def sembrar_coleccion(documento, collection_name: str, datos: List[dict]) -> int:
+    """Inserta los datos de ejemplo con un rango de IDs reservado y un solo insert_many"""
+    primer_id = await asignador_ids.reservar_rango(collection_name, len(datos))
+    documentos = [documento(id=primer_id + i, **d) for i, d in enumerate(datos)]
+    await documento.insert_many(documentos)
+    print(f"✅ {len(datos)} documentos de ejemplo insertados en {collection_name}")
+    if CATALOG_SNAPSHOT:
+        # Los demás workers ya pudieron cargar su instantánea: que relean lo sembrado
+        await gestor_instantanea.publicar_cambios(
+            collection_name, [(None, d.model_dump(by_alias=True)) for d in documentos]
+        )
+    return len(datos)
+
+# Función para inicializar datos de ejemplo
+async def init_sample_data() -> int:
+    """Inserta categorías, productos y postres de ejemplo en las colecciones vacías (en paralelo)"""
+    categorias_data = [
+        {"nombre": "torta", "descripcion": "Tortas tradicionales mexicanas"},
+        {"nombre": "cuernito", "descripcion": "Cuernitos y croissants horneados"},
+        {"nombre": "quesadilla", "descripcion": "Quesadillas de tortilla de maíz"},
+        {"nombre": "taco", "descripcion": "Tacos variados"},
+        {"nombre": "baguette", "descripcion": "Baguettes gourmet"},
+        {"nombre": "bebida", "descripcion": "Bebidas frías y calientes"},
+        {"nombre": "postre", "descripcion": "Postres individuales"},
+        {"nombre": "pastel", "descripcion": "Pasteles completos y por rebanada"},
+        {"nombre": "postre_frio", "descripcion": "Postres fríos y gelatinas"}
+    ]
+
+    productos_data = [
+        # Tortas
+        {"nombre": "Torta de Jamón", "categoria": "torta", "descripcion": "Torta con jamón, queso, aguacate, jitomate y lechuga en pan telera", "precio": 45.0},
+        {"nombre": "Torta de Milanesa", "categoria": "torta", "descripcion": "Torta con milanesa de res empanizada, aguacate, jitomate, lechuga y frijoles", "precio": 60.0},
+        {"nombre": "Torta Cubana", "categoria": "torta", "descripcion": "Torta con jamón, queso, milanesa, salchicha, chorizo, huevo, aguacate y frijoles", "precio": 85.0},
         
-        productos_iniciales = []
-        for i, prod_data in enumerate(productos_data, 1):
-            producto = Producto(id=i, **prod_data)
-            productos_iniciales.append(producto)
+        # Cuernitos
+        {"nombre": "Cuernito de Jamón y Queso", "categoria": "cuernito", "descripcion": "Croissant horneado relleno de jamón y queso gouda derretido", "precio": 38.0},
+        {"nombre": "Cuernito 3 Quesos", "categoria": "cuernito", "descripcion": "Croissant horneado relleno de queso manchego, gouda y philadelphia", "precio": 42.0},
         
-        await Producto.insert_many(productos_iniciales)
-        # Actualizar contador de productos
-        await Contador.find_one(Contador.collection_name == "productos").update({"$set": {"sequence_value": len(productos_data)}})
+        # Quesadillas
+        {"nombre": "Quesadilla de Queso", "categoria": "quesadilla", "descripcion": "Tortilla de maíz hecha a mano rellena de queso Oaxaca", "precio": 25.0},
+        {"nombre": "Quesadilla de Hongos", "categoria": "quesadilla", "descripcion": "Tortilla de maíz hecha a mano rellena de hongos guisados y queso", "precio": 30.0},
+        {"nombre": "Quesadilla de Tinga", "categoria": "quesadilla", "descripcion": "Tortilla de maíz hecha a mano rellena de tinga de pollo y queso", "precio": 35.0},
         
-        print("✅ Productos de ejemplo insertados correctamente")
-    
-    # Verificar si ya existen postres
-    count_postres = await Postre.count()
-    
-    if count_postres == 0:
-        postres_data = [
-            {"nombre": "Pastel de Chocolate", "descripcion": "Delicioso pastel de chocolate con ganache de chocolate oscuro y decorado con fresas", "categoria": "pastel", "rebanadas": 12, "precio_rebanada": 45.0, "precio_total": 540.0},
-            {"nombre": "Cheesecake de Fresa", "descripcion": "Tarta de queso cremosa con base de galleta y cobertura de fresas naturales", "categoria": "pastel", "rebanadas": 10, "precio_rebanada": 50.0, "precio_total": 500.0},
-            {"nombre": "Pastel Tres Leches", "descripcion": "Esponjoso pastel bañado en tres tipos de leche con crema chantilly y canela", "categoria": "pastel", "rebanadas": 16, "precio_rebanada": 35.0, "precio_total": 560.0},
-            {"nombre": "Tarta de Manzana", "descripcion": "Clásica tarta de manzana con masa crujiente y manzanas caramelizadas", "categoria": "pastel", "rebanadas": 8, "precio_rebanada": 40.0, "precio_total": 320.0},
-            {"nombre": "Pastel de Zanahoria", "descripcion": "Húmedo pastel de zanahoria con nueces y betún de queso crema", "categoria": "pastel", "rebanadas": 12, "precio_rebanada": 42.0, "precio_total": 504.0},
-            {"nombre": "Tiramisú", "descripcion": "Postre italiano con capas de bizcocho bañado en café, mascarpone y cacao", "categoria": "postre_frio", "rebanadas": 9, "precio_rebanada": 55.0, "precio_total": 495.0},
-            {"nombre": "Pastel Red Velvet", "descripcion": "Suave pastel de terciopelo rojo con betún de queso crema", "categoria": "pastel", "rebanadas": 14, "precio_rebanada": 48.0, "precio_total": 672.0},
-            {"nombre": "Flan Napolitano Familiar", "descripcion": "Flan casero de tamaño familiar con caramelo y vainilla", "categoria": "postre_frio", "rebanadas": 10, "precio_rebanada": 25.0, "precio_total": 250.0}
-        ]
+        # Tacos
+        {"nombre": "Taco de Pastor", "categoria": "taco", "descripcion": "Tortilla de maíz con carne de cerdo marinada en adobo y piña", "precio": 18.0},
+        {"nombre": "Taco de Suadero", "categoria": "taco", "descripcion": "Tortilla de maíz con carne de res suadero, cilantro y cebolla", "precio": 20.0},
+        {"nombre": "Taco de Barbacoa", "categoria": "taco", "descripcion": "Tortilla de maíz con carne de barbacoa de borrego, cilantro y cebolla", "precio": 25.0},
         
-        postres_iniciales = []
-        for i, postre_data in enumerate(postres_data, 1):
-            postre = Postre(id=i, **postre_data)
-            postres_iniciales.append(postre)
+        # Baguettes
+        {"nombre": "Baguette Italiano", "categoria": "baguette", "descripcion": "Pan baguette con jamón serrano, queso provolone, tomate y pesto", "precio": 65.0},
+        {"nombre": "Baguette de Pollo", "categoria": "baguette", "descripcion": "Pan baguette con pollo a la plancha, queso manchego, lechuga y jitomate", "precio": 60.0},
         
-        await Postre.insert_many(postres_iniciales)
-        # Actualizar contador de postres
-        await Contador.find_one(Contador.collection_name == "postres").update({"$set": {"sequence_value": len(postres_data)}})
+        # Bebidas
+        {"nombre": "Café Americano", "categoria": "bebida", "descripcion": "Café de grano recién molido, 12 oz", "precio": 30.0},
+        {"nombre": "Agua de Horchata", "categoria": "bebida", "descripcion": "Agua fresca de arroz con canela y vainilla, 16 oz", "precio": 25.0},
+        {"nombre": "Limonada", "categoria": "bebida", "descripcion": "Limonada natural con un toque de menta, 16 oz", "precio": 28.0},
         
-        print("✅ Postres de ejemplo insertados correctamente")
+        # Postres individuales
+        {"nombre": "Rebanada de Pastel de Chocolate", "categoria": "postre", "descripcion": "Rebanada individual de pastel de chocolate con ganache", "precio": 45.0},
+        {"nombre": "Flan Individual", "categoria": "postre", "descripcion": "Porción individual de flan napolitano con caramelo", "precio": 35.0}
+    ]
+
+    postres_data = [
+        {"nombre": "Pastel de Chocolate", "descripcion": "Delicioso pastel de chocolate con ganache de chocolate oscuro y decorado con fresas", "categoria": "pastel", "rebanadas": 12, "precio_rebanada": 45.0, "precio_total": 540.0},
+        {"nombre": "Cheesecake de Fresa", "descripcion": "Tarta de queso cremosa con base de galleta y cobertura de fresas naturales", "categoria": "pastel", "rebanadas": 10, "precio_rebanada": 50.0, "precio_total": 500.0},
+        {"nombre": "Pastel Tres Leches", "descripcion": "Esponjoso pastel bañado en tres tipos de leche con crema chantilly y canela", "categoria": "pastel", "rebanadas": 16, "precio_rebanada": 35.0, "precio_total": 560.0},
+        {"nombre": "Tarta de Manzana", "descripcion": "Clásica tarta de manzana con masa crujiente y manzanas caramelizadas", "categoria": "pastel", "rebanadas": 8, "precio_rebanada": 40.0, "precio_total": 320.0},
+        {"nombre": "Pastel de Zanahoria", "descripcion": "Húmedo pastel de zanahoria con nueces y betún de queso crema", "categoria": "pastel", "rebanadas": 12, "precio_rebanada": 42.0, "precio_total": 504.0},
+        {"nombre": "Tiramisú", "descripcion": "Postre italiano con capas de bizcocho bañado en café, mascarpone y cacao", "categoria": "postre_frio", "rebanadas": 9, "precio_rebanada": 55.0, "precio_total": 495.0},
+        {"nombre": "Pastel Red Velvet", "descripcion": "Suave pastel de terciopelo rojo con betún de queso crema", "categoria": "pastel", "rebanadas": 14, "precio_rebanada": 48.0, "precio_total": 672.0},
+        {"nombre": "Flan Napolitano Familiar", "descripcion": "Flan casero de tamaño familiar con caramelo y vainilla", "categoria": "postre_frio", "rebanadas": 10, "precio_rebanada": 25.0, "precio_total": 250.0}
+    ]
+
+    semillas = [
+        (Categoria, "categorias", categorias_data),
+        (Producto, "productos", productos_data),
+        (Postre, "postres", postres_data),
+    ]
+    if not await reclamar_siembra():
+        print(f"🌱 Datos de ejemplo ya sembrados por otro worker o arranque (marca '{MARCA_DATOS_EJEMPLO}' en contadores)")
+        return 0
+    try:
+        conteos = await asyncio.gather(*(documento.count() for documento, _, _ in semillas))
+        insertados = await asyncio.gather(*(
+            sembrar_coleccion(documento, collection_name, datos)
+            for (documento, collection_name, datos), total in zip(semillas, conteos) if total == 0
+        ))
+    except Exception:
+        # Sin la marca, el siguiente arranque vuelve a intentar la siembra
+        await Contador.get_motor_collection().delete_one({"_id": MARCA_DATOS_EJEMPLO})
+        raise
+    return sum(insertados)
+
+async def preparar_datos():
+    """Siembra opcional y construcción en paralelo de los índices en memoria, el catálogo y las estadísticas"""
+    sembrados = await init_sample_data() if SEED_SAMPLE_DATA else 0
+
+    async def catalogo():
+        # Construir el catálogo de lectura si aún no existe o si se acaban de sembrar datos
+        if sembrados or os.getenv("CATALOG_REBUILD_ON_START", "0") == "1" or await ItemCatalogo.count() == 0:
+            await reconstruir_catalogo()
+
+    async def estadisticas():
+        # Construir las estadísticas materializadas si aún no existen
+        if sembrados or os.getenv("STATS_REBUILD_ON_START", "0") == "1" or await Estadistica.count() == 0:
+            await reconstruir_estadisticas()
+
+    async def instantanea():
+        # Precarga de la instantánea del catálogo de este worker
+        if CATALOG_SNAPSHOT:
+            await gestor_instantanea.cargar()
+
+    # Índices en memoria para /sugerencias y la búsqueda difusa
+    await asyncio.gather(construir_indices_busqueda(), catalogo(), estadisticas(), instantanea())
 
 # Inicialización de la base de datos
 @app.on_event("startup")
 async def startup_event():
     """Configurar la conexión a MongoDB al iniciar la aplicación"""
+    inicio = time.perf_counter()
     
     # Obtener la URL de MongoDB desde variables de entorno
     mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+    mongodb_db = os.getenv("MONGODB_DB", "cafeteria_db")
     print(f"🔗 Conectando a MongoDB: {mongodb_url}")
     
-    # Conectar a MongoDB
-    client = AsyncIOMotorClient(mongodb_url)
+    # Conectar a MongoDB con el pool configurado (se cierra en shutdown_event)
+    client = AsyncIOMotorClient(mongodb_url, event_listeners=[monitor_comandos, monitor_pool], **opciones_pool())
+    app.state.cliente_mongo = client
+    print(f"📖 Lecturas de solo consulta con preferencia {READ_PREFERENCE}")
     
     # Inicializar Beanie con la base de datos y modelos
     await init_beanie(
-        database=client.cafeteria_db,
-        document_models=[Contador, Categoria, Producto, Postre]
+        database=client[mongodb_db],
+        document_models=[Contador, Categoria, Producto, Postre, Estadistica, ItemCatalogo, CambioCatalogo]
     )
+
+    # Índices declarados en los modelos: se construyen en segundo plano sin bloquear el arranque
+    sincronizador_indices.iniciar()
+
+    # Preparación de datos con tiempo máximo; si lo supera sigue en segundo plano y /ready responde 503
+    app.state.tarea_preparacion = asyncio.create_task(preparar_datos())
+    try:
+        await asyncio.wait_for(asyncio.shield(app.state.tarea_preparacion), STARTUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"⏱️ La preparación de datos superó STARTUP_TIMEOUT ({STARTUP_TIMEOUT}s), continúa en segundo plano")
+
+    # Oyentes de escritura diferidos (estadísticas) fuera del camino de las peticiones
+    cola_oyentes.iniciar()
+
+    # Revisión de la versión compartida para recargar la instantánea con cambios de otros workers
+    if CATALOG_SNAPSHOT:
+        gestor_instantanea.iniciar()
+
+    # Invalidación de cache entre workers (opcional, requiere replica set)
+    if os.getenv("CACHE_CHANGE_STREAM", "0") == "1":
+        app.state.tarea_change_stream = asyncio.create_task(escuchar_change_stream_cache(client[mongodb_db]))
     
-    # Inicializar datos de ejemplo
-    await init_sample_data()
-    
-    print("✅ Conexión a MongoDB establecida con IDs auto incrementales")
+    app.state.segundos_arranque = round(time.perf_counter() - inicio, 3)
+    print(f"✅ Conexión a MongoDB establecida con IDs auto incrementales (arranque en {app.state.segundos_arranque}s)")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Libera los recursos en memoria al detener la aplicación"""
+    await asignador_ids.descartar_bloques()
+    await cola_oyentes.detener()
+    sincronizador_indices.cancelar()
+    gestor_instantanea.cancelar()
+    tarea_preparacion = getattr(app.state, "tarea_preparacion", None)
+    if tarea_preparacion is not None:
+        tarea_preparacion.cancel()
+    tarea_change_stream = getattr(app.state, "tarea_change_stream", None)
+    if tarea_change_stream is not None:
+        tarea_change_stream.cancel()
+    # Cerrar el pool de conexiones y los monitores del cliente
+    cliente_mongo = getattr(app.state, "cliente_mongo", None)
+    if cliente_mongo is not None:
+        cliente_mongo.close()
+        print("🔌 Conexión a MongoDB cerrada")
 
 # Funciones helper para convertir documentos a response
 def producto_to_response(producto: Producto) -> dict:
@@ -319,33 +1503,1248 @@ def postre_to_response(postre: Postre) -> dict:
         "disponible": postre.disponible
     }
 
-# Endpoint raíz
-@app.get("/")
-async def read_root():
+# Proyecciones para leer documentos crudos con Motor sin hidratar modelos Beanie
+PROYECCION_PRODUCTO = {"nombre": 1, "categoria": 1, "descripcion": 1, "precio": 1, "disponible": 1, "version": 1}
+PROYECCION_POSTRE = {
+    "nombre": 1, "descripcion": 1, "categoria": 1, "rebanadas": 1,
+    "precio_rebanada": 1, "precio_total": 1, "disponible": 1, "version": 1
+}
+
+def producto_crudo_to_response(p: dict) -> dict:
+    """Convierte un producto crudo de MongoDB a diccionario con la forma de ProductoResponse"""
     return {
-        "message": "Bienvenido a la API NoSQL de Cafetería El Rincón Mexicano",
-        "database": "MongoDB",
-        "version": "2.1.0",
-        "puerto": "8080",
-        "auto_increment": "✅ IDs secuenciales activados"
+        "id": p["_id"],
+        "nombre": p["nombre"],
+        "categoria": p["categoria"],
+        "descripcion": p["descripcion"],
+        "precio": p["precio"],
+        "disponible": p["disponible"]
     }
 
-# Endpoint para servir el buscador HTML
-@app.get("/buscador")
-async def get_buscador():
-    """Sirve la página HTML del buscador"""
-    if os.path.exists("buscador.html"):
-        return FileResponse("buscador.html")
-    else:
-        raise HTTPException(status_code=404, detail="Archivo buscador.html no encontrado")
+def postre_crudo_to_response(p: dict) -> dict:
+    """Convierte un postre crudo de MongoDB a diccionario con la forma de PostreResponse"""
+    return {
+        "id": p["_id"],
+        "nombre": p["nombre"],
+        "descripcion": p["descripcion"],
+        "categoria": p["categoria"],
+        "rebanadas": p["rebanadas"],
+        "precio_rebanada": p["precio_rebanada"],
+        "precio_total": p["precio_total"],
+        "disponible": p["disponible"]
+    }
+
+async def leer_crudos(documento, filtro: dict, proyeccion: dict) -> List[dict]:
+    """Lee documentos crudos con Motor aplicando una proyección en el servidor"""
+    return await coleccion_lectura(documento).find(filtro, proyeccion).to_list(length=None)
+
+# ==================== ESCRITURAS EN UN SOLO VIAJE ====================
+
+def etag_version(version: int) -> str:
+    """ETag de un documento a partir de su versión"""
+    return f'"{version}"'
+
+def version_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Obtiene la versión esperada del header If-Match (None si no se exige ninguna)"""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    valor = if_match.strip()
+    if valor.startswith("W/"):
+        valor = valor[2:]
+    try:
+        return int(valor.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Header If-Match inválido, usa el ETag del documento")
+
+def filtro_con_version(doc_id: int, version: Optional[int]) -> dict:
+    """Filtro por _id y, si se indica, por versión (los documentos sin campo version son la 0)"""
+    filtro = {"_id": doc_id}
+    if version is not None:
+        filtro["version"] = {"$in": [0, None]} if version == 0 else version
+    return filtro
+
+async def error_no_encontrado(documento, doc_id: int, version: Optional[int], detalle: str):
+    """Distingue entre documento inexistente (404) y versión desactualizada (412)"""
+    if version is not None and await documento.get_motor_collection().count_documents({"_id": doc_id}, limit=1):
+        raise HTTPException(status_code=412, detail="El documento fue modificado por otro usuario, vuelve a cargarlo")
+    raise HTTPException(status_code=404, detail=detalle)
+
+async def actualizar_documento(documento, coleccion: str, doc_id: int, update_data: dict,
+                               if_match: Optional[str], proyeccion: dict, detalle: str) -> dict:
+    """
+    Aplica $set e incrementa la versión con un solo find_one_and_update.
+    Se pide el documento anterior para poder invalidar lo que dependía de él;
+    el nuevo estado se deriva aplicando los mismos cambios en memoria.
+    """
+    version = version_if_match(if_match)
+    if version is None and cola_disponibilidad.activa and list(update_data) == ["disponible"] \
+            and update_data["disponible"] is not None:
+        # Los cambios sueltos de disponibilidad se agrupan con los de otras peticiones
+        despues = await cola_disponibilidad.actualizar(
+            documento, coleccion, doc_id, update_data["disponible"], proyeccion
+        )
+        if despues is None:
+            raise HTTPException(status_code=404, detail=detalle)
+        return despues
+
+    coleccion_motor = documento.get_motor_collection()
+    if not update_data:
+        actual = await coleccion_motor.find_one(filtro_con_version(doc_id, version), proyeccion)
+        if actual is None:
+            await error_no_encontrado(documento, doc_id, version, detalle)
+        return actual
+
+    antes = await coleccion_motor.find_one_and_update(
+        filtro_con_version(doc_id, version),
+        {"$set": update_data, "$inc": {"version": 1}},
+        projection=proyeccion,
+        return_document=ReturnDocument.BEFORE
+    )
+    if antes is None:
+        await error_no_encontrado(documento, doc_id, version, detalle)
+    despues = {**antes, **update_data, "version": antes.get("version", 0) + 1}
+    await notificar_cambios(coleccion, [(antes, despues)])
+    return despues
+
+async def eliminar_documento(documento, coleccion: str, doc_id: int, if_match: Optional[str],
+                             proyeccion: dict, detalle: str) -> dict:
+    """Elimina con un solo find_one_and_delete y devuelve el documento eliminado"""
+    version = version_if_match(if_match)
+    antes = await documento.get_motor_collection().find_one_and_delete(
+        filtro_con_version(doc_id, version), projection=proyeccion
+    )
+    if antes is None:
+        await error_no_encontrado(documento, doc_id, version, detalle)
+    await notificar_cambios(coleccion, [(antes, None)])
+    return antes
+
+# ==================== DISPONIBILIDAD EN LOTE ====================
+
+async def cambiar_disponibilidad(documento, coleccion: str, ids: List[int], disponible: int, proyeccion: dict) -> dict:
+    """
+    Cambia la disponibilidad de muchos documentos con un número fijo de viajes: lectura del
+    estado actual, un update_many de los que cambian y la lectura del estado final para los oyentes.
+    """
+    ids = list(dict.fromkeys(ids))
+    motor = documento.get_motor_collection()
+    actuales = {d["_id"]: d["disponible"] async for d in motor.find({"_id": {"$in": ids}}, {"disponible": 1})}
+    cambian = [i for i in ids if i in actuales and actuales[i] != disponible]
+    if cambian:
+        await motor.update_many(
+            {"_id": {"$in": cambian}, "disponible": {"$ne": disponible}},
+            {"$set": {"disponible": disponible}, "$inc": {"version": 1}}
+        )
+        despues = await motor.find({"_id": {"$in": cambian}}, proyeccion).to_list(length=None)
+        await notificar_cambios(coleccion, [
+            ({**d, "disponible": actuales[d["_id"]], "version": d.get("version", 1) - 1}, d) for d in despues
+        ])
+    return {
+        "actualizados": cambian,
+        "sin_cambios": [i for i in ids if i in actuales and actuales[i] == disponible],
+        "no_encontrados": [i for i in ids if i not in actuales]
+    }
+
+class ColaDisponibilidad:
+    """
+    Group commit de cambios de disponibilidad: las actualizaciones individuales de una
+    colección que llegan dentro de la misma ventana se escriben juntas con un bulk_write
+    no ordenado, y cada llamada recibe su propio documento actualizado (None si no existe).
+    Solo se escriben y notifican los documentos cuya disponibilidad cambia de verdad.
+    """
+
+    def __init__(self, ventana_ms: float, max_lote: int):
+        self.ventana = ventana_ms / 1000
+        self.max_lote = max(1, max_lote)
+        self._pendientes = {}  # coleccion -> [documento, proyeccion, lote, temporizador]
+        self._escrituras = set()
+
+    @property
+    def activa(self) -> bool:
+        return self.ventana > 0
+
+    async def actualizar(self, documento, coleccion: str, doc_id: int, disponible: int, proyeccion: dict) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        pendiente = self._pendientes.get(coleccion)
+        if pendiente is None:
+            temporizador = loop.call_later(self.ventana, self._despachar, coleccion)
+            pendiente = self._pendientes[coleccion] = [documento, proyeccion, [], temporizador]
+        pendiente[2].append((doc_id, disponible, futuro))
+        if len(pendiente[2]) >= self.max_lote:
+            self._despachar(coleccion)
+        return await asyncio.shield(futuro)
+
+    def _despachar(self, coleccion: str):
+        pendiente = self._pendientes.pop(coleccion, None)
+        if pendiente is None:
+            return
+        documento, proyeccion, lote, temporizador = pendiente
+        temporizador.cancel()
+        tarea = asyncio.create_task(self._escribir(documento, coleccion, proyeccion, lote))
+        self._escrituras.add(tarea)
+        tarea.add_done_callback(self._escrituras.discard)
+
+    async def _escribir(self, documento, coleccion: str, proyeccion: dict, lote: List[tuple]):
+        # Si un id se repite en el lote gana el último cambio
+        valores = {doc_id: disponible for doc_id, disponible, _ in lote}
+        metricas.incrementar("availability_group_commit_batches_total", coleccion=coleccion)
+        metricas.incrementar("availability_group_commit_updates_total", len(lote), coleccion=coleccion)
+        try:
+            motor = documento.get_motor_collection()
+            antes = {d["_id"]: d async for d in motor.find({"_id": {"$in": list(valores)}}, proyeccion)}
+            cambian = [i for i, disponible in valores.items() if i in antes and antes[i]["disponible"] != disponible]
+            despues = antes
+            if cambian:
+                # Igual que cambiar_disponibilidad: los que ya tienen ese valor no suben de versión
+                await motor.bulk_write([
+                    UpdateOne(
+                        {"_id": doc_id, "disponible": {"$ne": valores[doc_id]}},
+                        {"$set": {"disponible": valores[doc_id]}, "$inc": {"version": 1}}
+                    )
+                    for doc_id in cambian
+                ], ordered=False)
+                despues = {d["_id"]: d async for d in motor.find({"_id": {"$in": list(valores)}}, proyeccion)}
+                await notificar_cambios(coleccion, [
+                    (antes[i], despues[i]) for i in cambian
+                    if i in despues and despues[i].get("version") != antes[i].get("version")
+                ])
+        except Exception as e:
+            for _, _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        for doc_id, _, futuro in lote:
+            if not futuro.done():
+                futuro.set_result(despues.get(doc_id))
+
+metricas.describir("availability_group_commit_batches_total", "counter", "Lotes de cambios de disponibilidad escritos con group commit")
+metricas.describir("availability_group_commit_updates_total", "counter", "Cambios de disponibilidad individuales agrupados en lotes")
+
+# AVAILABILITY_GROUP_COMMIT_MS=0 (por defecto) escribe cada cambio por separado
+cola_disponibilidad = ColaDisponibilidad(
+    ventana_ms=float(os.getenv("AVAILABILITY_GROUP_COMMIT_MS", "0")),
+    max_lote=int(os.getenv("AVAILABILITY_MAX_BATCH", "500"))
+)
+
+# ==================== EVENTOS DE ESCRITURA ====================
+
+# Funciones async(coleccion, cambios) que se ejecutan tras cada escritura de los endpoints.
+# `cambios` es una lista de tuplas (antes, despues) con los documentos crudos de MongoDB;
+# antes es None en las altas y despues es None en las bajas.
+_oyentes_cambios = []  # (funcion, diferido)
+
+# Escrituras pendientes para los oyentes diferidos antes de que las peticiones esperen lugar
+WRITE_LISTENERS_QUEUE_SIZE = int(os.getenv("WRITE_LISTENERS_QUEUE_SIZE", "1000"))
+
+def oyente_cambios(funcion=None, *, diferido: bool = False):
+    """
+    Registra una función que se ejecuta después de cada escritura. Los oyentes diferidos
+    corren fuera de la petición, en orden, en la tarea de ColaOyentes.
+    """
+    def registrar(f):
+        _oyentes_cambios.append((f, diferido))
+        return f
+    return registrar(funcion) if funcion is not None else registrar
+
+async def ejecutar_oyente(oyente, coleccion: str, cambios: List[tuple]):
+    """Ejecuta un oyente aislando sus errores: la escritura ya está hecha y los demás deben correr"""
+    try:
+        await oyente(coleccion, cambios)
+    except Exception as e:
+        metricas.incrementar("write_listener_errors_total", oyente=oyente.__name__)
+        print(f"⚠️ El oyente {oyente.__name__} falló con {len(cambios)} cambios de {coleccion}: {e!r}")
+
+class ColaOyentes:
+    """
+    Cola de escrituras para los oyentes diferidos, atendida por una sola tarea para que
+    se apliquen en el orden de las escrituras. Si la tarea no está corriendo (pruebas,
+    scripts) los oyentes diferidos se ejecutan en la misma petición.
+    """
+
+    def __init__(self, capacidad: int):
+        self._cola = asyncio.Queue(maxsize=capacidad)
+        self._tarea = None
+
+    @property
+    def activa(self) -> bool:
+        return self._tarea is not None and not self._tarea.done()
+
+    async def encolar(self, coleccion: str, cambios: List[tuple]):
+        # Con la cola llena la petición espera lugar (contrapresión)
+        await self._cola.put((coleccion, cambios))
+        metricas.fijar("write_listeners_pending", self._cola.qsize())
+
+    async def atender(self):
+        while True:
+            coleccion, cambios = await self._cola.get()
+            try:
+                for oyente, diferido in _oyentes_cambios:
+                    if diferido:
+                        await ejecutar_oyente(oyente, coleccion, cambios)
+            finally:
+                self._cola.task_done()
+                metricas.fijar("write_listeners_pending", self._cola.qsize())
+
+    def iniciar(self):
+        if not self.activa:
+            self._tarea = asyncio.create_task(self.atender())
+
+    async def detener(self, espera: float = 5.0):
+        """Aplica lo pendiente (hasta `espera` segundos) y detiene la tarea"""
+        if self._tarea is None:
+            return
+        try:
+            await asyncio.wait_for(self._cola.join(), espera)
+        except asyncio.TimeoutError:
+            print(f"⚠️ {self._cola.qsize()} escrituras sin aplicar a los oyentes diferidos")
+        self._tarea.cancel()
+        self._tarea = None
+
+cola_oyentes = ColaOyentes(WRITE_LISTENERS_QUEUE_SIZE)
+metricas.describir("write_listener_errors_total", "counter", "Fallos de oyentes de escritura (la escritura ya estaba confirmada)")
+metricas.describir("write_listeners_pending", "gauge", "Escrituras en cola para los oyentes diferidos")
+
+async def notificar_cambios(coleccion: str, cambios: List[tuple]):
+    """
+    Notifica a los oyentes registrados los documentos modificados en una colección. Un
+    oyente que falla se registra y no impide que corran los demás ni la respuesta.
+    """
+    if not cambios:
+        return
+    diferir = cola_oyentes.activa
+    for oyente, diferido in _oyentes_cambios:
+        if not (diferido and diferir):
+            await ejecutar_oyente(oyente, coleccion, cambios)
+    if diferir:
+        await cola_oyentes.encolar(coleccion, cambios)
+
+def documento_crudo(documento) -> dict:
+    """Convierte un documento Beanie a su forma cruda en MongoDB (con _id)"""
+    return documento.model_dump(by_alias=True)
+
+# ==================== CATÁLOGO (MODELO DE LECTURA) ====================
+
+# Tipo de elemento del catálogo según la colección de origen, y viceversa
+TIPOS_CATALOGO = {"productos": "Producto", "postres": "Postre"}
+COLECCIONES_CATALOGO = {tipo: coleccion for coleccion, tipo in TIPOS_CATALOGO.items()}
+
+# Campos propios de cada tipo que se copian al catálogo
+CAMPOS_CATALOGO = {
+    "productos": ("precio",),
+    "postres": ("rebanadas", "precio_rebanada", "precio_total")
+}
+
+def clave_catalogo(coleccion: str, id: int) -> str:
+    """_id del elemento del catálogo que corresponde a un documento de origen"""
+    return f"{coleccion}:{id}"
+
+def item_catalogo(coleccion: str, documento: dict, categoria_descripcion: Optional[str]) -> dict:
+    """Construye el elemento del catálogo a partir del documento crudo de origen"""
+    item = {
+        "_id": clave_catalogo(coleccion, documento["_id"]),
+        "tipo": TIPOS_CATALOGO[coleccion],
+        "id_origen": documento["_id"],
+        "nombre": documento["nombre"],
+        "descripcion": documento["descripcion"],
+        "categoria": documento["categoria"],
+        "categoria_descripcion": categoria_descripcion,
+        "disponible": documento["disponible"]
+    }
+    for campo in CAMPOS_CATALOGO[coleccion]:
+        item[campo] = documento[campo]
+    return item
+
+def crudo_desde_catalogo(item: dict) -> dict:
+    """Devuelve el elemento con el _id de su colección de origen, para reutilizar los formateadores"""
+    return {**item, "_id": item["id_origen"]}
+
+def pipeline_catalogo(coleccion: str) -> List[dict]:
+    """Agregación que proyecta una colección de origen al catálogo (con $lookup de la categoría) y la fusiona"""
+    return [
+        {"$lookup": {
+            "from": "categorias", "localField": "categoria", "foreignField": "nombre", "as": "_categoria"
+        }},
+        {"$project": {
+            "_id": {"$concat": [f"{coleccion}:", {"$toString": "$_id"}]},
+            "tipo": {"$literal": TIPOS_CATALOGO[coleccion]},
+            "id_origen": "$_id",
+            "nombre": 1,
+            "descripcion": 1,
+            "categoria": 1,
+            "categoria_descripcion": {"$arrayElemAt": ["$_categoria.descripcion", 0]},
+            "disponible": 1,
+            **{campo: 1 for campo in CAMPOS_CATALOGO[coleccion]}
+        }},
+        {"$merge": {"into": "catalogo", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ]
+
+async def reconstruir_catalogo() -> dict:
+    """
+    Reconstruye el catálogo en el servidor: un $merge por colección de origen y luego
+    borra los elementos cuyo documento de origen ya no existe.
+    """
+    inicio = time.perf_counter()
+    catalogo = ItemCatalogo.get_motor_collection()
+    huerfanos = []
+    for documento, coleccion in ((Producto, "productos"), (Postre, "postres")):
+        await documento.get_motor_collection().aggregate(pipeline_catalogo(coleccion)).to_list(length=None)
+        sin_origen = catalogo.aggregate([
+            {"$match": {"tipo": TIPOS_CATALOGO[coleccion]}},
+            {"$lookup": {"from": coleccion, "localField": "id_origen", "foreignField": "_id", "as": "_origen"}},
+            {"$match": {"_origen": {"$size": 0}}},
+            {"$project": {"_id": 1}}
+        ])
+        huerfanos.extend([d["_id"] async for d in sin_origen])
+    if huerfanos:
+        await catalogo.delete_many({"_id": {"$in": huerfanos}})
+
+    total = await catalogo.count_documents({})
+    print(f"✅ Catálogo reconstruido ({total} elementos en {time.perf_counter() - inicio:.2f}s)")
+    return {"elementos": total, "eliminados": len(huerfanos), "segundos": round(time.perf_counter() - inicio, 3)}
+
+# Se registra antes que la cache para que, al invalidarla, el catálogo ya esté actualizado
+@oyente_cambios
+async def actualizar_catalogo(coleccion: str, cambios: List[tuple]):
+    """Replica en el catálogo las escrituras de productos, postres y categorías"""
+    catalogo = ItemCatalogo.get_motor_collection()
+    if coleccion == "categorias":
+        for _, despues in cambios:
+            if despues is not None:
+                await catalogo.update_many(
+                    {"categoria": despues["nombre"]},
+                    {"$set": {"categoria_descripcion": despues["descripcion"]}}
+                )
+        return
+    if coleccion not in TIPOS_CATALOGO:
+        return
+
+    # Descripciones de las categorías involucradas en una sola consulta
+    nombres = list({despues["categoria"] for _, despues in cambios if despues is not None})
+    descripciones = {}
+    if nombres:
+        cursor = Categoria.get_motor_collection().find({"nombre": {"$in": nombres}}, {"nombre": 1, "descripcion": 1})
+        descripciones = {c["nombre"]: c["descripcion"] async for c in cursor}
+
+    operaciones = []
+    for antes, despues in cambios:
+        if despues is not None:
+            item = item_catalogo(coleccion, despues, descripciones.get(despues["categoria"]))
+            operaciones.append(ReplaceOne({"_id": item["_id"]}, item, upsert=True))
+        else:
+            operaciones.append(DeleteOne({"_id": clave_catalogo(coleccion, antes["_id"])}))
+    await catalogo.bulk_write(operaciones, ordered=False)
+
+async def leer_catalogo(filtro: dict) -> List[dict]:
+    """Lee elementos del catálogo ordenados por id de origen, ya con el _id de su colección"""
+    cursor = coleccion_lectura(ItemCatalogo).find(filtro).sort("id_origen", ASCENDING)
+    return [crudo_desde_catalogo(item) async for item in cursor]
+
+async def relacionados_misma_categoria(coleccion: str, id: int, tipo_relacionado: str) -> Optional[List[dict]]:
+    """
+    Con una sola agregación sobre el catálogo obtiene los elementos de otro tipo que
+    comparten categoría con un elemento. Devuelve None si el elemento no existe.
+    """
+    pipeline = [
+        {"$match": {"_id": clave_catalogo(coleccion, id)}},
+        {"$lookup": {
+            "from": "catalogo", "localField": "categoria", "foreignField": "categoria",
+            "pipeline": [{"$match": {"tipo": tipo_relacionado}}, {"$sort": {"id_origen": 1}}],
+            "as": "relacionados"
+        }},
+        {"$project": {"relacionados": 1}}
+    ]
+    resultado = await coleccion_lectura(ItemCatalogo).aggregate(pipeline).to_list(length=1)
+    if not resultado:
+        return None
+    return [crudo_desde_catalogo(item) for item in resultado[0]["relacionados"]]
+
+# ==================== CACHE DE LECTURA ====================
+
+class CacheLectura:
+    """
+    Cache en memoria con TTL y expulsión LRU por número de entradas.
+    Cada entrada lleva etiquetas ("producto:3", "productos:categoria:taco"...) que
+    permiten invalidar con precisión desde los endpoints de escritura.
+    """
+
+    def __init__(self, max_entradas: int = 1000, ttl: float = 60.0):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # clave -> (expira, valor, etiquetas)
+        self._por_etiqueta = {}  # etiqueta -> set(claves)
+        self._generacion = 0
+        self.hits = 0
+        self.misses = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave: str):
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            self.misses += 1
+            return None
+        if entrada[0] < time.monotonic():
+            self._quitar(clave)
+            self.misses += 1
+            return None
+        self._entradas.move_to_end(clave)
+        self.hits += 1
+        return entrada[1]
+
+    def guardar(self, clave: str, valor, etiquetas, generacion: int):
+        # Si hubo una invalidación mientras se cargaba el valor, no se guarda
+        if self.max_entradas <= 0 or generacion != self._generacion:
+            return
+        self._quitar(clave)
+        self._entradas[clave] = (time.monotonic() + self.ttl, valor, etiquetas)
+        for etiqueta in etiquetas:
+            self._por_etiqueta.setdefault(etiqueta, set()).add(clave)
+        while len(self._entradas) > self.max_entradas:
+            clave_vieja = next(iter(self._entradas))
+            self._quitar(clave_vieja)
+            self.expulsiones += 1
+
+    def _quitar(self, clave: str):
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return
+        for etiqueta in entrada[2]:
+            claves = self._por_etiqueta.get(etiqueta)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_etiqueta[etiqueta]
+
+    def invalidar(self, *etiquetas: str):
+        """Elimina todas las entradas que tengan alguna de las etiquetas"""
+        self._generacion += 1
+        for etiqueta in etiquetas:
+            for clave in list(self._por_etiqueta.get(etiqueta, ())):
+                self._quitar(clave)
+                self.invalidaciones += 1
+
+    def invalidar_prefijo(self, prefijo: str):
+        """Elimina las entradas con etiquetas que empiecen por el prefijo"""
+        self.invalidar(*[e for e in self._por_etiqueta if e.startswith(prefijo)])
+
+    def limpiar(self):
+        self._generacion += 1
+        self._entradas.clear()
+        self._por_etiqueta.clear()
+
+    async def leer(self, clave: str, etiquetas, cargar):
+        """Lectura read-through: devuelve el valor en cache o lo carga y lo guarda"""
+        valor = self.obtener(clave)
+        if valor is not None:
+            return valor
+        generacion = self._generacion
+        valor = await cargar()
+        self.guardar(clave, valor, tuple(etiquetas), generacion)
+        return valor
+
+    def estadisticas(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entradas": len(self._entradas),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "expulsiones": self.expulsiones,
+            "invalidaciones": self.invalidaciones
+        }
+
+# CACHE_MAX_ENTRIES=0 desactiva la cache
+cache_lectura = CacheLectura(
+    max_entradas=int(os.getenv("CACHE_MAX_ENTRIES", "1000")),
+    ttl=float(os.getenv("CACHE_TTL_SECONDS", "60"))
+)
+
+def etiquetas_documento(coleccion: str, documento: dict) -> List[str]:
+    """Etiquetas de cache afectadas por un documento de una colección"""
+    if coleccion == "categorias":
+        return ["categorias", "menu"]
+    singular = "producto" if coleccion == "productos" else "postre"
+    return [f"{singular}:{documento['_id']}", f"{coleccion}:categoria:{documento['categoria']}", "menu"]
+
+@oyente_cambios
+async def invalidar_cache_lectura(coleccion: str, cambios: List[tuple]):
+    """Invalida las entradas de cache afectadas por las escrituras locales"""
+    etiquetas = set()
+    for antes, despues in cambios:
+        for documento in (antes, despues):
+            if documento is not None:
+                etiquetas.update(etiquetas_documento(coleccion, documento))
+    cache_lectura.invalidar(*etiquetas)
+
+async def escuchar_change_stream_cache(database):
+    """
+    Escucha el change stream de la base de datos para invalidar la cache con las
+    escrituras hechas por otros workers. Requiere un replica set.
+    """
+    colecciones = ["categorias", "productos", "postres", "catalogo"]
+    pipeline = [{"$match": {"ns.coll": {"$in": colecciones}}}]
+    try:
+        async with database.watch(pipeline, full_document="updateLookup") as stream:
+            print("✅ Change stream de invalidación de cache activo")
+            async for cambio in stream:
+                coleccion = cambio["ns"]["coll"]
+                documento = cambio.get("fullDocument")
+                id = cambio["documentKey"]["_id"]
+                if coleccion == "categorias":
+                    cache_lectura.invalidar("categorias", "menu")
+                    continue
+                if coleccion == "catalogo":
+                    # El catálogo se escribe después del origen: invalidar otra vez al replicarse
+                    coleccion, _, id = id.partition(":")
+                    id = int(id)
+                singular = "producto" if coleccion == "productos" else "postre"
+                cache_lectura.invalidar(f"{singular}:{id}", "menu")
+                if documento is not None and cambio["operationType"] == "insert":
+                    cache_lectura.invalidar(f"{coleccion}:categoria:{documento['categoria']}")
+                else:
+                    # En updates y deletes no se conoce la categoría anterior
+                    cache_lectura.invalidar_prefijo(f"{coleccion}:categoria:")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Change stream no disponible, la cache solo se invalida localmente: {e}")
+
+# Límites para altas masivas
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+def describir_error_validacion(error: ValidationError) -> str:
+    """Resume los errores de validación de pydantic en una línea"""
+    return "; ".join(f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors())
+
+async def insertar_en_bloque(documento, collection_name: str, esquema, items: List[dict]) -> dict:
+    """
+    Valida cada item con el esquema de alta, reserva un rango contiguo de IDs para los
+    válidos con una sola actualización del contador y los inserta con insert_many no
+    ordenado por lotes. Un item inválido no rechaza el lote: queda como error en su índice.
+    """
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ITEMS} elementos por petición")
+    if not items:
+        return {"total": 0, "insertados": 0, "errores": 0, "resultados": []}
+
+    resultados = [{"indice": i, "id": None, "estado": "creado", "detalle": None} for i in range(len(items))]
+    validos = []  # (índice en la petición, datos validados)
+    for i, item in enumerate(items):
+        try:
+            validos.append((i, esquema.model_validate(item).model_dump()))
+        except ValidationError as e:
+            resultados[i]["estado"] = "error"
+            resultados[i]["detalle"] = describir_error_validacion(e)
+
+    documentos = []
+    if validos:
+        primer_id = await asignador_ids.reservar_rango(collection_name, len(validos))
+        for desplazamiento, (i, datos) in enumerate(validos):
+            documentos.append({"_id": primer_id + desplazamiento, **datos})
+            resultados[i]["id"] = primer_id + desplazamiento
+
+    coleccion = documento.get_motor_collection()
+    for inicio in range(0, len(documentos), BULK_CHUNK_SIZE):
+        lote = documentos[inicio:inicio + BULK_CHUNK_SIZE]
+        try:
+            await coleccion.insert_many(lote, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                resultado = resultados[validos[inicio + error["index"]][0]]
+                resultado["estado"] = "error"
+                resultado["detalle"] = error.get("errmsg")
+
+    errores = sum(1 for r in resultados if r["estado"] == "error")
+    await notificar_cambios(collection_name, [
+        (None, doc) for doc, (i, _) in zip(documentos, validos) if resultados[i]["estado"] == "creado"
+    ])
+    return {
+        "total": len(items),
+        "insertados": len(items) - errores,
+        "errores": errores,
+        "resultados": resultados
+    }
+
+# ==================== INSTANTÁNEA DEL CATÁLOGO EN MEMORIA ====================
+
+# Con CATALOG_SNAPSHOT=1 cada worker precarga categorías, productos y postres ya en forma de
+# respuesta y atiende desde memoria las lecturas por ID, por categoría y /categorias/.
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "0") == "1"
+# Segundos entre revisiones de la versión compartida (cambios hechos en otros workers)
+CATALOG_SNAPSHOT_POLL_SECONDS = float(os.getenv("CATALOG_SNAPSHOT_POLL_SECONDS", "1.0"))
+# Revisiones que se espera el registro de una versión faltante antes de recargar completa
+CATALOG_SNAPSHOT_MAX_GAP_POLLS = int(os.getenv("CATALOG_SNAPSHOT_MAX_GAP_POLLS", "3"))
+# Documento de `contadores` cuyo valor es la versión del catálogo; cada escritura lo incrementa
+CONTADOR_VERSION_CATALOGO = "version_catalogo"
+
+def tamano_aproximado(objeto) -> int:
+    """Bytes aproximados de una estructura de dicts, listas y tuplas (sys.getsizeof recursivo)"""
+    tamano = sys.getsizeof(objeto)
+    if isinstance(objeto, (dict, MappingProxyType)):
+        tamano += sum(tamano_aproximado(k) + tamano_aproximado(v) for k, v in objeto.items())
+    elif isinstance(objeto, (list, tuple)):
+        tamano += sum(tamano_aproximado(v) for v in objeto)
+    return tamano
+
+def tamano_estimado(elementos: dict, muestra: int = 1000) -> int:
+    """Bytes aproximados de un dict grande: mide hasta `muestra` entradas y extrapola al total"""
+    medidas = [tamano_aproximado(k) + tamano_aproximado(v) for k, v in itertools.islice(elementos.items(), muestra)]
+    return sys.getsizeof(elementos) + (sum(medidas) * len(elementos) // len(medidas) if medidas else 0)
+
+def memoria_residente() -> Optional[int]:
+    """Memoria residente (RSS) del proceso en bytes, si el sistema la expone en /proc"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def categoria_crudo_to_response(c: dict) -> dict:
+    return {"id": c["_id"], "nombre": c["nombre"], "descripcion": c["descripcion"]}
+
+class InstantaneaCatalogo:
+    """
+    Catálogo en memoria con la versión compartida hasta la que está al día. Una carga completa
+    crea una instancia nueva; después los cambios se aplican en su lugar solo sobre los
+    elementos tocados. Todo corre en el loop de eventos, así que una lectura nunca ve un
+    cambio a medias, y las tuplas por categoría se reemplazan en lugar de modificarse.
+    """
+    __slots__ = ("version", "categorias", "lista_categorias", "productos", "postres", "por_categoria",
+                 "bytes", "_categorias", "_elementos", "_por_categoria")
+
+    def __init__(self, version: int, categorias: dict, productos: dict, postres: dict):
+        self.version = version
+        self._categorias = categorias  # id -> respuesta
+        self._elementos = {"productos": productos, "postres": postres}  # id -> (respuesta, versión del documento)
+        self._por_categoria = {}  # (colección, categoría) -> tupla de respuestas ordenadas por id
+        for coleccion, elementos in self._elementos.items():
+            por_categoria = {}
+            for id in sorted(elementos):
+                respuesta = elementos[id][0]
+                por_categoria.setdefault((coleccion, respuesta["categoria"]), []).append(respuesta)
+            self._por_categoria.update((clave, tuple(lista)) for clave, lista in por_categoria.items())
+        # Vistas de solo lectura para los endpoints (reflejan los cambios aplicados)
+        self.categorias = MappingProxyType(categorias)
+        self.productos = MappingProxyType(productos)
+        self.postres = MappingProxyType(postres)
+        self.por_categoria = MappingProxyType(self._por_categoria)
+        self.lista_categorias = tuple(categorias[id] for id in sorted(categorias))
+        # Se estima solo en las cargas (las tuplas por categoría comparten las respuestas, solo
+        # cuentan sus contenedores); los cambios la ajustan con el tamaño de cada elemento
+        self.bytes = sum(tamano_estimado(m) for m in (categorias, productos, postres)) + sys.getsizeof(
+            self._por_categoria) + sum(sys.getsizeof(t) for t in self._por_categoria.values())
+
+    def aplicar(self, version: int, coleccion: str, documentos: Dict[int, Optional[dict]]):
+        """
+        Aplica el estado actual de los IDs cambiados de una colección (None si se borraron) y
+        avanza la versión. El costo depende de lo cambiado y de sus categorías, no del catálogo.
+        """
+        if coleccion == "categorias":
+            for id, documento in documentos.items():
+                anterior = self._categorias.pop(id, None)
+                nueva = None if documento is None else categoria_crudo_to_response(documento)
+                if nueva is not None:
+                    self._categorias[id] = nueva
+                self.bytes += tamano_aproximado(nueva) - tamano_aproximado(anterior)
+            self.lista_categorias = tuple(self._categorias[id] for id in sorted(self._categorias))
+        elif coleccion in self._elementos:
+            elementos = self._elementos[coleccion]
+            convertir = producto_crudo_to_response if coleccion == "productos" else postre_crudo_to_response
+            afectadas = {}  # (colección, categoría) -> (ids quitados, respuestas agregadas)
+            for id, documento in documentos.items():
+                anterior = elementos.pop(id, None)
+                nuevo = None if documento is None else (convertir(documento), documento.get("version", 0))
+                if anterior is not None:
+                    afectadas.setdefault((coleccion, anterior[0]["categoria"]), (set(), []))[0].add(id)
+                if nuevo is not None:
+                    elementos[id] = nuevo
+                    afectadas.setdefault((coleccion, nuevo[0]["categoria"]), (set(), []))[1].append(nuevo[0])
+                self.bytes += tamano_aproximado(nuevo) - tamano_aproximado(anterior)
+            for clave, (quitados, agregados) in afectadas.items():
+                lista = list(self._por_categoria.get(clave, ()))
+                if len(quitados) + len(agregados) <= 32:
+                    # Pocos cambios: se ubican por búsqueda binaria sin recorrer la categoría
+                    for id in quitados:
+                        i = bisect.bisect_left(lista, id, key=id_respuesta)
+                        if i < len(lista) and lista[i]["id"] == id:
+                            del lista[i]
+                    for respuesta in agregados:
+                        bisect.insort(lista, respuesta, key=id_respuesta)
+                else:
+                    lista = sorted([r for r in lista if r["id"] not in quitados] + agregados, key=id_respuesta)
+                if lista:
+                    self._por_categoria[clave] = tuple(lista)
+                else:
+                    self._por_categoria.pop(clave, None)
+        self.version = max(self.version, version)
+
+    def __len__(self) -> int:
+        return len(self.categorias) + len(self.productos) + len(self.postres)
+
+def id_respuesta(respuesta: dict) -> int:
+    return respuesta["id"]
+
+def documentos_cambiados(cambios: List[tuple]) -> Dict[int, Optional[dict]]:
+    """Estado final de cada ID de una escritura: el documento después del cambio, o None si se borró"""
+    return {(despues if despues is not None else antes)["_id"]: despues for antes, despues in cambios}
+
+class GestorInstantanea:
+    """
+    Mantiene la instantánea vigente de este worker. Las escrituras locales incrementan la
+    versión en `contadores`, aplican su cambio sin releer la base y anotan los IDs tocados en
+    `cambios_catalogo`; los demás workers ven la versión nueva en su siguiente revisión y
+    releen solo esos IDs. Sin registro utilizable se recarga la instantánea completa.
+    """
+
+    def __init__(self, intervalo: float):
+        self.intervalo = intervalo
+        self.actual: Optional[InstantaneaCatalogo] = None
+        self.segundos_carga = None
+        self.cargas = 0
+        self.incrementales = 0
+        self.puestas_al_dia = 0
+        self.elementos_releidos = 0
+        self._revisiones_con_hueco = 0
+        self._despertar = asyncio.Event()
+        self._tarea = None
+
+    async def version_compartida(self) -> int:
+        contador = await Contador.get_motor_collection().find_one(
+            {"collection_name": CONTADOR_VERSION_CATALOGO}, {"_id": 0, "sequence_value": 1}
+        )
+        return contador["sequence_value"] if contador else 0
+
+    def _publicar(self, instantanea: InstantaneaCatalogo):
+        # Una carga lenta no debe reemplazar una instantánea más nueva
+        if self.actual is None or instantanea.version >= self.actual.version:
+            self.actual = instantanea
+            metricas.fijar("catalog_snapshot_version", instantanea.version)
+            metricas.fijar("catalog_snapshot_bytes", instantanea.bytes)
+
+    async def cargar(self, version: Optional[int] = None) -> InstantaneaCatalogo:
+        """Lee las tres colecciones en paralelo (del primario) y publica una instantánea nueva"""
+        inicio = time.perf_counter()
+        # La versión se lee antes que los datos: si una escritura cae en medio, la siguiente revisión la relee
+        if version is None:
+            version = await self.version_compartida()
+        categorias, productos, postres = await asyncio.gather(
+            Categoria.get_motor_collection().find({}).to_list(length=None),
+            Producto.get_motor_collection().find({}, PROYECCION_PRODUCTO).to_list(length=None),
+            Postre.get_motor_collection().find({}, PROYECCION_POSTRE).to_list(length=None),
+        )
+        instantanea = InstantaneaCatalogo(
+            version,
+            {c["_id"]: categoria_crudo_to_response(c) for c in categorias},
+            {p["_id"]: (producto_crudo_to_response(p), p.get("version", 0)) for p in productos},
+            {p["_id"]: (postre_crudo_to_response(p), p.get("version", 0)) for p in postres},
+        )
+        self.segundos_carga = round(time.perf_counter() - inicio, 3)
+        self.cargas += 1
+        self._revisiones_con_hueco = 0
+        self._publicar(instantanea)
+        metricas.observar("catalog_snapshot_load_seconds", self.segundos_carga)
+        rss = memoria_residente()
+        if rss is not None:
+            metricas.fijar("process_resident_memory_bytes", rss)
+        print(
+            f"🧊 Instantánea del catálogo v{version} en el worker {os.getpid()}: {len(instantanea)} elementos "
+            f"en {self.segundos_carga}s (~{instantanea.bytes // 1024} KB"
+            + (f", RSS {rss // (1024 * 1024)} MB)" if rss is not None else ")")
+        )
+        return instantanea
+
+    async def recargar(self, version: int):
+        """Recarga completa por escrituras de otros workers; los índices de búsqueda se resincronizan junto con ella"""
+        await asyncio.gather(self.cargar(version), construir_indices_busqueda())
+
+    async def publicar_cambios(self, coleccion: str, cambios: List[tuple]):
+        """Sube la versión compartida, aplica el cambio localmente si no hubo escrituras de otros workers y lo anota en el registro"""
+        contador = await Contador.get_motor_collection().find_one_and_update(
+            {"collection_name": CONTADOR_VERSION_CATALOGO},
+            {"$inc": {"sequence_value": 1}},
+            projection={"_id": 0, "sequence_value": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        version = contador["sequence_value"]
+        documentos = documentos_cambiados(cambios)
+        actual = self.actual
+        if actual is not None and version == actual.version + 1:
+            self.incrementales += 1
+            actual.aplicar(version, coleccion, documentos)
+            self._publicar(actual)
+        else:
+            # Hay versiones intermedias de otro worker: ponerse al día sin esperar la revisión
+            self._despertar.set()
+        await CambioCatalogo.get_motor_collection().insert_one({
+            "_id": version, "coleccion": coleccion, "ids": sorted(documentos), "fecha": datetime.now(timezone.utc)
+        })
+
+    async def poner_al_dia(self, version: int):
+        """
+        Aplica las versiones entre la local y `version` releyendo solo los IDs de su registro.
+        Si falta el registro de una versión durante CATALOG_SNAPSHOT_MAX_GAP_POLLS revisiones
+        (expiró, o el worker que escribió se cayó antes de anotarlo), o los cambios abarcan
+        más de la mitad del catálogo, recarga completa. Los índices de búsqueda de este worker
+        reciben los mismos cambios.
+        """
+        actual = self.actual
+        if actual is None:
+            await self.cargar(version)
+            return
+        registros = await CambioCatalogo.get_motor_collection().find(
+            {"_id": {"$gt": actual.version, "$lte": version}}
+        ).sort("_id", ASCENDING).to_list(length=None)
+        # Solo el tramo contiguo: una versión sin registro puede ser una escritura que aún no lo anota
+        contiguos = []
+        for registro in registros:
+            if registro["_id"] != actual.version + len(contiguos) + 1:
+                break
+            contiguos.append(registro)
+        if not contiguos:
+            self._revisiones_con_hueco += 1
+            if self._revisiones_con_hueco >= CATALOG_SNAPSHOT_MAX_GAP_POLLS:
+                await self.recargar(version)
+            return
+        self._revisiones_con_hueco = 0
+
+        ids = {}  # colección -> IDs a releer
+        for registro in contiguos:
+            ids.setdefault(registro["coleccion"], set()).update(registro["ids"])
+        if sum(len(v) for v in ids.values()) > len(actual) // 2:
+            await self.recargar(version)
+            return
+
+        proyecciones = {"productos": PROYECCION_PRODUCTO, "postres": PROYECCION_POSTRE}
+        modelos = {"categorias": Categoria, "productos": Producto, "postres": Postre}
+        colecciones = [c for c in ids if c in modelos]
+        leidos = await asyncio.gather(*(
+            modelos[c].get_motor_collection().find({"_id": {"$in": list(ids[c])}}, proyecciones.get(c)).to_list(length=None)
+            for c in colecciones
+        ))
+        # Si mientras tanto se publicó una carga completa, estos cambios ya no aplican sobre ella
+        if self.actual is not actual:
+            return
+        for coleccion, documentos in zip(colecciones, leidos):
+            # Los IDs que ya no existen se borraron
+            estado = dict.fromkeys(ids[coleccion])
+            estado.update((d["_id"], d) for d in documentos)
+            actual.aplicar(contiguos[-1]["_id"], coleccion, estado)
+            await sincronizar_indices_busqueda(coleccion, estado)
+            self.elementos_releidos += len(estado)
+        actual.version = max(actual.version, contiguos[-1]["_id"])
+        self.puestas_al_dia += 1
+        self._publicar(actual)
+
+    async def vigilar(self):
+        """Revisa la versión compartida cada `intervalo` segundos y se pone al día si cambió"""
+        while True:
+            try:
+                await asyncio.wait_for(self._despertar.wait(), self.intervalo)
+            except asyncio.TimeoutError:
+                pass
+            self._despertar.clear()
+            try:
+                version = await self.version_compartida()
+                if self.actual is None or version > self.actual.version:
+                    await self.poner_al_dia(version)
+            except PyMongoError as e:
+                print(f"⚠️ No se pudo revisar la versión del catálogo: {e}")
+
+    def iniciar(self):
+        if self._tarea is None or self._tarea.done():
+            self._tarea = asyncio.create_task(self.vigilar())
+
+    def cancelar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+
+    def estadisticas(self) -> dict:
+        actual = self.actual
+        return {
+            "activa": CATALOG_SNAPSHOT,
+            "worker": os.getpid(),
+            "version": actual.version if actual else None,
+            "categorias": len(actual.categorias) if actual else 0,
+            "productos": len(actual.productos) if actual else 0,
+            "postres": len(actual.postres) if actual else 0,
+            "bytes_aproximados": actual.bytes if actual else 0,
+            "memoria_residente_bytes": memoria_residente(),
+            "segundos_ultima_carga": self.segundos_carga,
+            "cargas_completas": self.cargas,
+            "cambios_incrementales": self.incrementales,
+            "puestas_al_dia": self.puestas_al_dia,
+            "elementos_releidos": self.elementos_releidos,
+            "intervalo_revision_segundos": self.intervalo,
+        }
+
+gestor_instantanea = GestorInstantanea(CATALOG_SNAPSHOT_POLL_SECONDS)
+metricas.describir("catalog_snapshot_version", "gauge", "Versión de la instantánea del catálogo de este worker")
+metricas.describir("catalog_snapshot_bytes", "gauge", "Tamaño aproximado en bytes de la instantánea del catálogo")
+metricas.describir("catalog_snapshot_load_seconds", "histogram", "Duración de las cargas completas de la instantánea")
+metricas.describir("process_resident_memory_bytes", "gauge", "Memoria residente del worker tras la última carga de la instantánea")
+
+def instantanea_vigente() -> Optional[InstantaneaCatalogo]:
+    """Instantánea para atender lecturas, o None si está desactivada o aún no se carga"""
+    return gestor_instantanea.actual if CATALOG_SNAPSHOT else None
+
+@oyente_cambios
+async def actualizar_instantanea(coleccion: str, cambios: List[tuple]):
+    """Publica las escrituras de categorías, productos y postres en la instantánea"""
+    if CATALOG_SNAPSHOT and coleccion in ("categorias", "productos", "postres"):
+        await gestor_instantanea.publicar_cambios(coleccion, cambios)
+
+# ==================== COALESCENCIA DE PETICIONES (SINGLE-FLIGHT) ====================
+
+class VueloUnico:
+    """
+    Single-flight: las llamadas concurrentes con la misma ruta y clave comparten una sola
+    ejecución y su resultado. La ejecución corre en su propia tarea, así que si el cliente
+    que la inició se desconecta los demás la siguen esperando.
+    """
+
+    def __init__(self, rutas):
+        self.rutas = set(rutas)
+        self._en_vuelo = {}  # (ruta, clave) -> tarea
+        self.ejecutadas = {}
+        self.coalescidas = {}
+
+    async def ejecutar(self, ruta: str, clave, funcion):
+        """Ejecuta funcion() o se une a la ejecución en curso con la misma clave"""
+        if ruta not in self.rutas:
+            return await funcion()
+        llave = (ruta, clave)
+        tarea = self._en_vuelo.get(llave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(funcion())
+            self._en_vuelo[llave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(llave, t))
+            self.ejecutadas[ruta] = self.ejecutadas.get(ruta, 0) + 1
+            metricas.incrementar("singleflight_requests_total", ruta=ruta, resultado="ejecutada")
+        else:
+            self.coalescidas[ruta] = self.coalescidas.get(ruta, 0) + 1
+            metricas.incrementar("singleflight_requests_total", ruta=ruta, resultado="coalescida")
+        resultado = await asyncio.shield(tarea)
+        if isinstance(resultado, Response):
+            # Cada petición envía su propia copia: los middlewares (gzip) modifican los headers al enviar
+            copia = Response(resultado.body, status_code=resultado.status_code)
+            copia.raw_headers = list(resultado.raw_headers)
+            return copia
+        return resultado
+
+    def _terminar(self, llave: tuple, tarea: asyncio.Task):
+        if self._en_vuelo.get(llave) is tarea:
+            del self._en_vuelo[llave]
+        if not tarea.cancelled():
+            tarea.exception()  # Evita el aviso de excepción no recuperada si nadie esperaba
+
+    def estadisticas(self) -> dict:
+        return {
+            ruta: {
+                "ejecutadas": self.ejecutadas.get(ruta, 0),
+                "coalescidas": self.coalescidas.get(ruta, 0),
+                "en_vuelo": sum(1 for r, _ in self._en_vuelo if r == ruta)
+            }
+            for ruta in sorted(self.rutas)
+        }
+
+metricas.describir("singleflight_requests_total", "counter", "Peticiones ejecutadas o unidas a una ejecución en curso por ruta")
+
+# Rutas con coalescencia activa (separadas por comas; vacío la desactiva)
+SINGLE_FLIGHT_ROUTES = os.getenv(
+    "SINGLE_FLIGHT_ROUTES", "buscar,productos_categoria,postres_categoria,estadisticas,menu"
+)
+vuelo_unico = VueloUnico(r.strip() for r in SINGLE_FLIGHT_ROUTES.split(",") if r.strip())
+
+# ==================== PAGINACIÓN POR CURSOR (KEYSET) ====================
+
+def codificar_cursor(datos: dict) -> str:
+    """Codifica un cursor de paginación como token opaco"""
+    return base64.urlsafe_b64encode(json.dumps(datos, separators=(",", ":")).encode()).decode()
+
+def decodificar_cursor(cursor: str) -> dict:
+    """Decodifica un cursor de paginación generado por codificar_cursor"""
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    if not isinstance(datos, dict):
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    return datos
+
+# Tamaño máximo de página al paginar con `after`; sin cursor se conserva skip/limit (0 = sin límite)
+CURSOR_MAX_LIMIT = int(os.getenv("CURSOR_MAX_LIMIT", "1000"))
+
+def offset_de_cursor(cursor: Optional[str]) -> int:
+    """Posición de un cursor por desplazamiento ({"o": n}); 400 si es de otro tipo o inválido"""
+    if not cursor:
+        return 0
+    offset = decodificar_cursor(cursor).get("o")
+    if type(offset) is not int or offset < 0:
+        raise HTTPException(status_code=400, detail="Cursor de paginación inválido")
+    return offset
+
+# Campos por los que se puede ordenar cada colección (con "-" para descendente)
+CAMPOS_ORDEN = {
+    "productos": {"id": "_id", "nombre": "nombre", "precio": "precio"},
+    "postres": {"id": "_id", "nombre": "nombre", "precio_rebanada": "precio_rebanada", "precio_total": "precio_total"},
+}
+
+def filtro_keyset(campo: str, descendente: bool, valor, ultimo_id: int) -> dict:
+    """Filtro que posiciona la consulta justo después de (valor, ultimo_id) usando el índice"""
+    operador = "$lt" if descendente else "$gt"
+    if campo == "_id":
+        return {"_id": {operador: ultimo_id}}
+    return {"$or": [
+        {campo: {operador: valor}},
+        {campo: valor, "_id": {operador: ultimo_id}}
+    ]}
+
+def consulta_keyset(documento, coleccion: str, skip: int, limit: int, orden: str,
+                    after: Optional[str], proyeccion: Optional[dict] = None,
+                    filtro_base: Optional[dict] = None) -> tuple:
+    """
+    Construye el cursor de Motor ordenado por (campo, _id), posicionado después de `after`
+    y combinado con los filtros de `filtro_base`. Devuelve (cursor, campo de orden).
+    """
+    descendente = orden.startswith("-")
+    nombre_orden = orden.lstrip("-")
+    campo = CAMPOS_ORDEN[coleccion].get(nombre_orden)
+    if campo is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Orden no válido, usa: {', '.join(CAMPOS_ORDEN[coleccion])} (prefijo '-' para descendente)"
+        )
+    direccion = DESCENDING if descendente else ASCENDING
+
+    filtro = dict(filtro_base or {})
+    if after:
+        if not 0 < limit <= CURSOR_MAX_LIMIT:
+            raise HTTPException(
+                status_code=400, detail=f"Con `after` el límite debe estar entre 1 y {CURSOR_MAX_LIMIT}"
+            )
+        posicion = decodificar_cursor(after)
+        if posicion.get("o") != orden or "id" not in posicion:
+            raise HTTPException(status_code=400, detail="El cursor no corresponde a este orden")
+        filtro_posicion = filtro_keyset(campo, descendente, posicion.get("v"), posicion["id"])
+        filtro = {"$and": [filtro, filtro_posicion]} if filtro else filtro_posicion
+
+    orden_mongo = [("_id", direccion)] if campo == "_id" else [(campo, direccion), ("_id", direccion)]
+    consulta = coleccion_lectura(documento).find(filtro, proyeccion).sort(orden_mongo)
+    if skip:
+        consulta = consulta.skip(skip)
+    # Un documento de más indica si hay página siguiente; limit=0 devuelve todo (sin cursor)
+    return (consulta.limit(limit + 1) if limit else consulta), campo
+
+async def paginar_keyset(documento, coleccion: str, skip: int, limit: int, orden: str,
+                         after: Optional[str], proyeccion: Optional[dict] = None,
+                         filtro_base: Optional[dict] = None) -> tuple:
+    """
+    Pagina una colección ordenada por (campo, _id). Con `after` busca directamente la
+    posición del cursor en el índice en lugar de recorrer `skip` documentos.
+    Devuelve los documentos crudos y el cursor de la siguiente página (o None).
+    """
+    consulta, campo = consulta_keyset(documento, coleccion, skip, limit, orden, after, proyeccion, filtro_base)
+    documentos = await consulta.to_list(length=None)
+
+    siguiente = None
+    if limit and len(documentos) > limit:
+        documentos = documentos[:limit]
+        ultimo = documentos[-1]
+        siguiente = codificar_cursor({"o": orden, "v": ultimo[campo], "id": ultimo["_id"]})
+    return documentos, siguiente
+
+# ==================== CONSULTAS FILTRADAS DEL CATÁLOGO ====================
+
+def agregar_rango(filtro: dict, campo: str, minimo: Optional[float], maximo: Optional[float]):
+    """Agrega al filtro un rango cerrado [minimo, maximo] sobre un campo"""
+    if minimo is not None and maximo is not None and minimo > maximo:
+        raise HTTPException(status_code=400, detail=f"Rango de {campo} inválido: el mínimo supera al máximo")
+    rango = {}
+    if minimo is not None:
+        rango["$gte"] = minimo
+    if maximo is not None:
+        rango["$lte"] = maximo
+    if rango:
+        filtro[campo] = rango
+
+def filtro_catalogo(categorias: Optional[List[str]], disponible: Optional[int]) -> dict:
+    """Filtro por categoría(s) y disponibilidad, en el orden del índice {categoria, disponible}"""
+    filtro = {}
+    if categorias:
+        filtro["categoria"] = categorias[0] if len(categorias) == 1 else {"$in": categorias}
+    if disponible is not None:
+        filtro["disponible"] = disponible
+    return filtro
+
+def indice_del_plan(plan: dict) -> str:
+    """Obtiene el nombre del índice usado por el plan ganador de explain (o COLLSCAN)"""
+    etapas = [plan]
+    while etapas:
+        etapa = etapas.pop()
+        if "indexName" in etapa:
+            return etapa["indexName"]
+        if etapa.get("stage") == "COLLSCAN":
+            return "COLLSCAN"
+        etapas.extend(etapa.get("inputStages", []))
+        for clave in ("inputStage", "queryPlan"):
+            if clave in etapa:
+                etapas.append(etapa[clave])
+    return "desconocido"
+
+async def consultar_catalogo(documento, coleccion: str, filtro: dict, orden: str, limit: int,
+                             after: Optional[str], proyeccion: dict, convertir, debug: bool):
+    """Ejecuta una consulta filtrada con paginación keyset y, en modo debug, reporta el índice elegido"""
+    documentos, siguiente = await paginar_keyset(
+        documento, coleccion, 0, limit, orden, after, proyeccion, filtro_base=filtro
+    )
+    headers = {}
+    if siguiente:
+        headers["X-Next-Cursor"] = siguiente
+    if debug:
+        consulta, _ = consulta_keyset(documento, coleccion, 0, limit, orden, after, proyeccion, filtro)
+        plan = await consulta.explain()
+        headers["X-Query-Index"] = indice_del_plan(plan.get("queryPlanner", {}).get("winningPlan", {}))
+    with tramo("respuesta"):
+        respuesta = [convertir(d) for d in documentos]
+    with tramo("serializacion"):
+        return ORJSONResponse(respuesta, headers=headers)
+
+# Endpoint raíz
+@app.get("/")
+async def read_root():
+    return {
+        "message": "Bienvenido a la API NoSQL de Cafetería El Rincón Mexicano",
+        "database": "MongoDB",
+        "version": "2.1.0",
+        "puerto": "8080",
+        "auto_increment": "✅ IDs secuenciales activados"
+    }
+
+# Endpoint para servir el buscador HTML
+@app.get("/buscador")
+async def get_buscador():
+    """Sirve la página HTML del buscador"""
+    if os.path.exists("buscador.html"):
+        return FileResponse("buscador.html")
+    else:
+        raise HTTPException(status_code=404, detail="Archivo buscador.html no encontrado")
 
 # ==================== ENDPOINTS PARA CATEGORÍAS ====================
 
 @app.get("/categorias/", response_model=List[CategoriaResponse], tags=["categorias"])
 async def listar_categorias():
     """Obtiene todas las categorías disponibles."""
-    categorias = await Categoria.find_all().to_list()
-    return [{"id": c.id, "nombre": c.nombre, "descripcion": c.descripcion} for c in categorias]
+    instantanea = instantanea_vigente()
+    if instantanea is not None:
+        return ORJSONResponse(list(instantanea.lista_categorias))
+    async def cargar():
+        categorias = await Categoria.find_all().to_list()
+        return [{"id": c.id, "nombre": c.nombre, "descripcion": c.descripcion} for c in categorias]
+    return await cache_lectura.leer("categorias", ["categorias"], cargar)
 
 @app.post("/categorias/", response_model=CategoriaResponse, tags=["categorias"])
 async def crear_categoria(categoria: CategoriaCreate):
@@ -353,272 +2752,1447 @@ async def crear_categoria(categoria: CategoriaCreate):
     nuevo_id = await get_next_sequence_value("categorias")
     nueva_categoria = Categoria(id=nuevo_id, **categoria.dict())
     await nueva_categoria.insert()
+    await notificar_cambios("categorias", [(None, documento_crudo(nueva_categoria))])
     return {"id": nueva_categoria.id, "nombre": nueva_categoria.nombre, "descripcion": nueva_categoria.descripcion}
 
 # ==================== ENDPOINTS PARA PRODUCTOS ====================
 
 @app.get("/productos/", response_model=List[ProductoResponse], tags=["productos"])
-async def listar_productos(skip: int = 0, limit: int = 100):
-    """Obtiene todos los productos disponibles en la cafetería."""
-    productos = await Producto.find_all().skip(skip).limit(limit).to_list()
-    return [producto_to_response(p) for p in productos]
+async def listar_productos(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, description="0 = sin límite (solo sin `after`)"),
+    orden: str = "id",
+    after: Optional[str] = None
+):
+    """
+    Obtiene todos los productos disponibles en la cafetería.
+    Para recorrer el catálogo completo usa `after` con el valor del header X-Next-Cursor.
+    """
+    productos, siguiente = await paginar_keyset(Producto, "productos", skip, limit, orden, after, PROYECCION_PRODUCTO)
+    headers = {"X-Next-Cursor": siguiente} if siguiente else None
+    with tramo("respuesta"):
+        respuesta = [producto_crudo_to_response(p) for p in productos]
+    with tramo("serializacion"):
+        return ORJSONResponse(respuesta, headers=headers)
+
+@app.get("/productos/filtro", response_model=List[ProductoResponse], tags=["productos"])
+async def filtrar_productos(
+    categoria: Optional[List[str]] = Query(None),
+    disponible: Optional[int] = Query(None, ge=0, le=1),
+    precio_min: Optional[float] = Query(None, ge=0),
+    precio_max: Optional[float] = Query(None, ge=0),
+    orden: str = "precio",
+    limit: int = Query(100, ge=0, description="0 = sin límite (solo sin `after`)"),
+    after: Optional[str] = None,
+    debug: bool = False
+):
+    """
+    Consulta productos por categoría (una o varias), disponibilidad y rango de precio,
+    ordenados y paginados por cursor (header X-Next-Cursor).
+    Con `debug=true` el header X-Query-Index indica el índice elegido por el planificador.
+    """
+    filtro = filtro_catalogo(categoria, disponible)
+    agregar_rango(filtro, "precio", precio_min, precio_max)
+    return await consultar_catalogo(
+        Producto, "productos", filtro, orden, limit, after, PROYECCION_PRODUCTO, producto_crudo_to_response, debug
+    )
 
 @app.get("/productos/{producto_id}", response_model=ProductoResponse, tags=["productos"])
 async def obtener_producto(producto_id: int):
     """Obtiene un producto específico por su ID."""
-    producto = await Producto.find_one(Producto.id == producto_id)
-    if producto is None:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
-    return producto_to_response(producto)
+    instantanea = instantanea_vigente()
+    # Si no está en la instantánea puede venir de otro worker todavía no replicado: se lee de la base
+    if instantanea is not None and producto_id in instantanea.productos:
+        respuesta, version = instantanea.productos[producto_id]
+        return ORJSONResponse(respuesta, headers={"ETag": etag_version(version)})
+    async def cargar():
+        producto = await Producto.get_motor_collection().find_one({"_id": producto_id}, PROYECCION_PRODUCTO)
+        if producto is None:
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
+        return producto_crudo_to_response(producto), producto.get("version", 0)
+    respuesta, version = await cache_lectura.leer(f"producto:{producto_id}", [f"producto:{producto_id}"], cargar)
+    return ORJSONResponse(respuesta, headers={"ETag": etag_version(version)})
 
 @app.get("/productos/categoria/{categoria}", response_model=List[ProductoResponse], tags=["productos"])
 async def obtener_productos_por_categoria(categoria: str):
     """Obtiene todos los productos de una categoría específica."""
-    productos = await Producto.find(Producto.categoria == categoria).to_list()
-    return [producto_to_response(p) for p in productos]
+    instantanea = instantanea_vigente()
+    if instantanea is not None:
+        return ORJSONResponse(list(instantanea.por_categoria.get(("productos", categoria), ())))
+    async def cargar():
+        productos = await leer_catalogo({"categoria": categoria, "tipo": "Producto"})
+        return [producto_crudo_to_response(p) for p in productos]
+    etiqueta = f"productos:categoria:{categoria}"
+    return ORJSONResponse(await vuelo_unico.ejecutar(
+        "productos_categoria", categoria, lambda: cache_lectura.leer(etiqueta, [etiqueta], cargar)
+    ))
 
 @app.post("/productos/", response_model=ProductoResponse, tags=["productos"])
 async def crear_producto(producto: ProductoCreate):
     """Crea un nuevo producto en la base de datos."""
     nuevo_id = await get_next_sequence_value("productos")
-    nuevo_producto = Producto(id=nuevo_id, **producto.dict())
+    with tramo("hidratacion"):
+        nuevo_producto = Producto(id=nuevo_id, **producto.dict())
     await nuevo_producto.insert()
-    return producto_to_response(nuevo_producto)
+    await notificar_cambios("productos", [(None, documento_crudo(nuevo_producto))])
+    with tramo("respuesta"):
+        return producto_to_response(nuevo_producto)
+
+@app.post("/productos/bulk", response_model=ResultadoBulk, tags=["productos"])
+async def crear_productos_bulk(productos: List[dict]):
+    """Crea muchos productos reservando un rango de IDs y usando insert_many por lotes.
+    Cada elemento se valida por separado y los inválidos se reportan en su índice."""
+    return await insertar_en_bloque(Producto, "productos", ProductoCreate, productos)
 
 @app.put("/productos/{producto_id}", response_model=ProductoResponse, tags=["productos"])
-async def actualizar_producto(producto_id: int, producto_update: ProductoUpdate):
-    """Actualiza un producto existente."""
-    producto = await Producto.find_one(Producto.id == producto_id)
-    if producto is None:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
-    
+async def actualizar_producto(producto_id: int, producto_update: ProductoUpdate, if_match: Optional[str] = Header(None)):
+    """
+    Actualiza un producto existente en un solo viaje a la base de datos.
+    Con el header If-Match (ETag devuelto por GET/PUT) solo se actualiza si nadie lo modificó antes.
+    """
     update_data = producto_update.dict(exclude_unset=True)
-    if update_data:
-        await producto.update({"$set": update_data})
-        producto = await Producto.find_one(Producto.id == producto_id)
-    
-    return producto_to_response(producto)
+    producto = await actualizar_documento(
+        Producto, "productos", producto_id, update_data, if_match, PROYECCION_PRODUCTO, "Producto no encontrado"
+    )
+    return ORJSONResponse(producto_crudo_to_response(producto), headers={"ETag": etag_version(producto.get("version", 0))})
 
 @app.delete("/productos/{producto_id}", tags=["productos"])
-async def eliminar_producto(producto_id: int):
-    """Elimina un producto de la base de datos."""
-    producto = await Producto.find_one(Producto.id == producto_id)
-    if producto is None:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
-    
-    nombre_producto = producto.nombre
-    await producto.delete()
-    
-    return {"message": f"Producto '{nombre_producto}' eliminado correctamente"}
+async def eliminar_producto(producto_id: int, if_match: Optional[str] = Header(None)):
+    """Elimina un producto de la base de datos (con If-Match solo si no cambió desde que se leyó)."""
+    producto = await eliminar_documento(Producto, "productos", producto_id, if_match, PROYECCION_PRODUCTO, "Producto no encontrado")
+    return {"message": f"Producto '{producto['nombre']}' eliminado correctamente"}
 
 # ==================== ENDPOINTS PARA POSTRES ====================
 
 @app.get("/postres/", response_model=List[PostreResponse], tags=["postres"])
-async def listar_postres(skip: int = 0, limit: int = 100):
-    """Obtiene todos los postres disponibles en la cafetería."""
-    postres = await Postre.find_all().skip(skip).limit(limit).to_list()
-    return [postre_to_response(p) for p in postres]
+async def listar_postres(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=0, description="0 = sin límite (solo sin `after`)"),
+    orden: str = "id",
+    after: Optional[str] = None
+):
+    """
+    Obtiene todos los postres disponibles en la cafetería.
+    Para recorrer el catálogo completo usa `after` con el valor del header X-Next-Cursor.
+    """
+    postres, siguiente = await paginar_keyset(Postre, "postres", skip, limit, orden, after, PROYECCION_POSTRE)
+    headers = {"X-Next-Cursor": siguiente} if siguiente else None
+    with tramo("respuesta"):
+        respuesta = [postre_crudo_to_response(p) for p in postres]
+    with tramo("serializacion"):
+        return ORJSONResponse(respuesta, headers=headers)
+
+@app.get("/postres/filtro", response_model=List[PostreResponse], tags=["postres"])
+async def filtrar_postres(
+    categoria: Optional[List[str]] = Query(None),
+    disponible: Optional[int] = Query(None, ge=0, le=1),
+    precio_min: Optional[float] = Query(None, ge=0, description="Precio mínimo por rebanada"),
+    precio_max: Optional[float] = Query(None, ge=0, description="Precio máximo por rebanada"),
+    rebanadas_min: Optional[int] = Query(None, gt=0),
+    rebanadas_max: Optional[int] = Query(None, gt=0),
+    orden: str = "precio_rebanada",
+    limit: int = Query(100, ge=0, description="0 = sin límite (solo sin `after`)"),
+    after: Optional[str] = None,
+    debug: bool = False
+):
+    """
+    Consulta postres por categoría (una o varias), disponibilidad, rango de precio por
+    rebanada y número de rebanadas, ordenados y paginados por cursor (header X-Next-Cursor).
+    Con `debug=true` el header X-Query-Index indica el índice elegido por el planificador.
+    """
+    filtro = filtro_catalogo(categoria, disponible)
+    agregar_rango(filtro, "precio_rebanada", precio_min, precio_max)
+    agregar_rango(filtro, "rebanadas", rebanadas_min, rebanadas_max)
+    return await consultar_catalogo(
+        Postre, "postres", filtro, orden, limit, after, PROYECCION_POSTRE, postre_crudo_to_response, debug
+    )
 
 @app.get("/postres/{postre_id}", response_model=PostreResponse, tags=["postres"])
 async def obtener_postre(postre_id: int):
     """Obtiene un postre específico por su ID."""
-    postre = await Postre.find_one(Postre.id == postre_id)
-    if postre is None:
-        raise HTTPException(status_code=404, detail="Postre no encontrado")
-    return postre_to_response(postre)
+    instantanea = instantanea_vigente()
+    if instantanea is not None and postre_id in instantanea.postres:
+        respuesta, version = instantanea.postres[postre_id]
+        return ORJSONResponse(respuesta, headers={"ETag": etag_version(version)})
+    async def cargar():
+        postre = await Postre.get_motor_collection().find_one({"_id": postre_id}, PROYECCION_POSTRE)
+        if postre is None:
+            raise HTTPException(status_code=404, detail="Postre no encontrado")
+        return postre_crudo_to_response(postre), postre.get("version", 0)
+    respuesta, version = await cache_lectura.leer(f"postre:{postre_id}", [f"postre:{postre_id}"], cargar)
+    return ORJSONResponse(respuesta, headers={"ETag": etag_version(version)})
 
 @app.get("/postres/categoria/{categoria}", response_model=List[PostreResponse], tags=["postres"])
 async def obtener_postres_por_categoria(categoria: str):
     """Obtiene todos los postres de una categoría específica."""
-    postres = await Postre.find(Postre.categoria == categoria).to_list()
-    return [postre_to_response(p) for p in postres]
+    instantanea = instantanea_vigente()
+    if instantanea is not None:
+        return ORJSONResponse(list(instantanea.por_categoria.get(("postres", categoria), ())))
+    async def cargar():
+        postres = await leer_catalogo({"categoria": categoria, "tipo": "Postre"})
+        return [postre_crudo_to_response(p) for p in postres]
+    etiqueta = f"postres:categoria:{categoria}"
+    return ORJSONResponse(await vuelo_unico.ejecutar(
+        "postres_categoria", categoria, lambda: cache_lectura.leer(etiqueta, [etiqueta], cargar)
+    ))
 
 @app.post("/postres/", response_model=PostreResponse, tags=["postres"])
 async def crear_postre(postre: PostreCreate):
     """Crea un nuevo postre en la base de datos."""
     nuevo_id = await get_next_sequence_value("postres")
-    nuevo_postre = Postre(id=nuevo_id, **postre.dict())
+    with tramo("hidratacion"):
+        nuevo_postre = Postre(id=nuevo_id, **postre.dict())
     await nuevo_postre.insert()
-    return postre_to_response(nuevo_postre)
+    await notificar_cambios("postres", [(None, documento_crudo(nuevo_postre))])
+    with tramo("respuesta"):
+        return postre_to_response(nuevo_postre)
+
+@app.post("/postres/bulk", response_model=ResultadoBulk, tags=["postres"])
+async def crear_postres_bulk(postres: List[dict]):
+    """Crea muchos postres reservando un rango de IDs y usando insert_many por lotes.
+    Cada elemento se valida por separado y los inválidos se reportan en su índice."""
+    return await insertar_en_bloque(Postre, "postres", PostreCreate, postres)
 
 @app.put("/postres/{postre_id}", response_model=PostreResponse, tags=["postres"])
-async def actualizar_postre(postre_id: int, postre_update: PostreUpdate):
-    """Actualiza un postre existente."""
-    postre = await Postre.find_one(Postre.id == postre_id)
-    if postre is None:
-        raise HTTPException(status_code=404, detail="Postre no encontrado")
-    
+async def actualizar_postre(postre_id: int, postre_update: PostreUpdate, if_match: Optional[str] = Header(None)):
+    """
+    Actualiza un postre existente en un solo viaje a la base de datos.
+    Con el header If-Match (ETag devuelto por GET/PUT) solo se actualiza si nadie lo modificó antes.
+    """
     update_data = postre_update.dict(exclude_unset=True)
-    if update_data:
-        await postre.update({"$set": update_data})
-        postre = await Postre.find_one(Postre.id == postre_id)
-    
-    return postre_to_response(postre)
+    postre = await actualizar_documento(
+        Postre, "postres", postre_id, update_data, if_match, PROYECCION_POSTRE, "Postre no encontrado"
+    )
+    return ORJSONResponse(postre_crudo_to_response(postre), headers={"ETag": etag_version(postre.get("version", 0))})
 
 @app.delete("/postres/{postre_id}", tags=["postres"])
-async def eliminar_postre(postre_id: int):
-    """Elimina un postre de la base de datos."""
-    postre = await Postre.find_one(Postre.id == postre_id)
-    if postre is None:
-        raise HTTPException(status_code=404, detail="Postre no encontrado")
-    
-    nombre_postre = postre.nombre
-    await postre.delete()
-    
-    return {"message": f"Postre '{nombre_postre}' eliminado correctamente"}
+async def eliminar_postre(postre_id: int, if_match: Optional[str] = Header(None)):
+    """Elimina un postre de la base de datos (con If-Match solo si no cambió desde que se leyó)."""
+    postre = await eliminar_documento(Postre, "postres", postre_id, if_match, PROYECCION_POSTRE, "Postre no encontrado")
+    return {"message": f"Postre '{postre['nombre']}' eliminado correctamente"}
+
+# ==================== ENDPOINT DE DISPONIBILIDAD ====================
+
+@app.patch("/disponibilidad", tags=["disponibilidad"])
+async def actualizar_disponibilidad(cambio: DisponibilidadLote):
+    """Marca muchos productos y postres como disponibles (1) o no disponibles (0) en una sola petición."""
+    if len(cambio.productos) + len(cambio.postres) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_ITEMS} elementos por petición")
+    productos, postres = await asyncio.gather(
+        cambiar_disponibilidad(Producto, "productos", cambio.productos, cambio.disponible, PROYECCION_PRODUCTO),
+        cambiar_disponibilidad(Postre, "postres", cambio.postres, cambio.disponible, PROYECCION_POSTRE)
+    )
+    return {"disponible": cambio.disponible, "productos": productos, "postres": postres}
 
 # ==================== ENDPOINTS DE BÚSQUEDA ====================
 
-@app.get("/buscar/{termino}", tags=["busqueda"])
-async def buscar_global(termino: str):
-    """
-    Busca un término en productos y postres (nombre, descripción y categoría).
-    La búsqueda es case-insensitive.
-    """
-    # Búsqueda en productos usando regex (insensible a mayúsculas)
-    productos = await Producto.find({
-        "$or": [
-            {"nombre": {"$regex": termino, "$options": "i"}},
-            {"descripcion": {"$regex": termino, "$options": "i"}},
-            {"categoria": {"$regex": termino, "$options": "i"}}
-        ]
-    }).to_list()
-    
-    # Búsqueda en postres usando regex (insensible a mayúsculas)
-    postres = await Postre.find({
+# Cache de colecciones que tienen índice de texto (nombre -> bool)
+_indices_texto = {}
+
+async def tiene_indice_texto(documento) -> bool:
+    """Indica si la colección del documento tiene un índice $text"""
+    coleccion = documento.get_motor_collection()
+    if coleccion.name not in _indices_texto:
+        indices = await coleccion.index_information()
+        _indices_texto[coleccion.name] = any(
+            tipo == "text" for info in indices.values() for _, tipo in info["key"]
+        )
+    return _indices_texto[coleccion.name]
+
+# Fallos de $text con los que la búsqueda cae a regex: índice ausente (OperationFailure) o un
+# backend sin soporte de $text, como el sustituto en memoria del benchmark (NotImplementedError)
+ERRORES_TEXTO = (OperationFailure, NotImplementedError)
+
+def descartar_indice_texto():
+    """Tras un fallo de $text, "auto" usa regex hasta que la sincronización de índices vuelva a revisar"""
+    _indices_texto[ItemCatalogo.get_motor_collection().name] = False
+
+def filtro_regex_busqueda(termino: str) -> dict:
+    """Filtro regex (insensible a mayúsculas) sobre nombre, descripción y categoría"""
+    return {
         "$or": [
             {"nombre": {"$regex": termino, "$options": "i"}},
             {"descripcion": {"$regex": termino, "$options": "i"}},
             {"categoria": {"$regex": termino, "$options": "i"}}
         ]
-    }).to_list()
-    
-    # Formatear resultados para que coincidan con el buscador HTML
-    resultados = {
+    }
+
+def cursor_busqueda(termino: str, modo: str, offset: int, limit: Optional[int]):
+    """
+    Construye el cursor de búsqueda sobre el catálogo (productos y postres en una sola
+    consulta) usando el índice de texto (ordenado por textScore) o el filtro regex.
+    Con limit pide limit + 1 para detectar otra página.
+    """
+    catalogo = coleccion_lectura(ItemCatalogo)
+    # Productos primero y luego postres, cada uno por id
+    orden = [("tipo", DESCENDING), ("id_origen", ASCENDING)]
+    if modo == "texto":
+        cursor = catalogo.find(
+            {"$text": {"$search": termino}},
+            {"score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"}), *orden])
+    else:
+        cursor = catalogo.find(filtro_regex_busqueda(termino)).sort(orden)
+
+    if offset:
+        cursor = cursor.skip(offset)
+    if limit is not None:
+        cursor = cursor.limit(limit + 1)
+    return cursor
+
+def producto_busqueda(p: dict) -> dict:
+    """Formatea un producto crudo para el buscador HTML"""
+    return {
+        "tipo": "Producto",
+        "id": p["_id"],
+        "nombre": p["nombre"],
+        "descripcion": p["descripcion"],
+        "categoria": p["categoria"],
+        "precio": f"${p['precio']:.2f}",
+        "disponible": "Sí" if p["disponible"] else "No"
+    }
+
+def postre_busqueda(p: dict) -> dict:
+    """Formatea un postre crudo para el buscador HTML"""
+    return {
+        "tipo": "Postre",
+        "id": p["_id"],
+        "nombre": p["nombre"],
+        "descripcion": p["descripcion"],
+        "categoria": p["categoria"],
+        "precio_rebanada": f"${p['precio_rebanada']:.2f}",
+        "precio_total": f"${p['precio_total']:.2f}",
+        "rebanadas": p["rebanadas"],
+        "disponible": "Sí" if p["disponible"] else "No"
+    }
+
+def resultado_busqueda(item: dict) -> dict:
+    """Formatea un elemento del catálogo para el buscador HTML según su tipo"""
+    crudo = crudo_desde_catalogo(item)
+    resultado = producto_busqueda(crudo) if item["tipo"] == "Producto" else postre_busqueda(crudo)
+    if "similitud" in item:
+        resultado["similitud"] = item["similitud"]
+    return resultado
+
+def respuesta_busqueda(termino: str, items: List[dict], modo: str, siguiente_cursor: Optional[str]) -> dict:
+    """Cuerpo de /buscar separado en productos y postres, como lo espera el buscador HTML"""
+    resultados = [resultado_busqueda(item) for item in items]
+    return {
         "termino_busqueda": termino,
-        "productos": [
-            {
-                "tipo": "Producto",
-                "id": p.id,  # Ahora es entero
-                "nombre": p.nombre,
-                "descripcion": p.descripcion,
-                "categoria": p.categoria,
-                "precio": f"${p.precio:.2f}",
-                "disponible": "Sí" if p.disponible else "No"
-            }
-            for p in productos
-        ],
-        "postres": [
-            {
-                "tipo": "Postre",
-                "id": p.id,  # Ahora es entero
-                "nombre": p.nombre,
-                "descripcion": p.descripcion,
-                "categoria": p.categoria,
-                "precio_rebanada": f"${p.precio_rebanada:.2f}",
-                "precio_total": f"${p.precio_total:.2f}",
-                "rebanadas": p.rebanadas,
-                "disponible": "Sí" if p.disponible else "No"
-            }
-            for p in postres
-        ],
-        "total_resultados": len(productos) + len(postres)
+        "productos": [r for r in resultados if r["tipo"] == "Producto"],
+        "postres": [r for r in resultados if r["tipo"] == "Postre"],
+        "total_resultados": len(resultados),
+        "modo": modo,
+        "siguiente_cursor": siguiente_cursor
     }
-    
-    return resultados
+
+# Documentos por lote al transmitir resultados en NDJSON
+SEARCH_STREAM_BATCH = int(os.getenv("SEARCH_STREAM_BATCH", "100"))
+
+async def generar_busqueda_ndjson(termino: str, modo: str, offset: int, limit: Optional[int]):
+    """
+    Genera los resultados de búsqueda como NDJSON, una línea por resultado en cuanto
+    llega cada lote del cursor, y al final una línea de resumen.
+    """
+    cursor = cursor_busqueda(termino, modo, offset, limit)
+    try:
+        lote = await cursor.to_list(length=SEARCH_STREAM_BATCH)
+    except ERRORES_TEXTO:
+        if modo != "texto":
+            raise
+        # Sin índice de texto utilizable: volver a la búsqueda regex
+        descartar_indice_texto()
+        modo = "regex"
+        cursor = cursor_busqueda(termino, modo, offset, limit)
+        lote = await cursor.to_list(length=SEARCH_STREAM_BATCH)
+
+    emitidos = 0
+    hay_mas = False
+    while lote:
+        if limit is not None and emitidos + len(lote) > limit:
+            lote = lote[:limit - emitidos]
+            hay_mas = True
+        emitidos += len(lote)
+        if lote:
+            with tramo("serializacion"):
+                lineas = b"".join(orjson.dumps(resultado_busqueda(d)) + b"\n" for d in lote)
+            yield lineas
+        if hay_mas:
+            break
+        lote = await cursor.to_list(length=SEARCH_STREAM_BATCH)
+
+    yield orjson.dumps({
+        "termino_busqueda": termino,
+        "total_resultados": emitidos,
+        "modo": modo,
+        "siguiente_cursor": codificar_cursor({"o": offset + emitidos}) if hay_mas else None
+    }) + b"\n"
+
+async def responder_busqueda_difusa(termino: str, offset: int, limit: Optional[int], stream: bool):
+    """Arma la respuesta de /buscar en modo difuso (JSON o NDJSON) con la misma forma que los otros modos"""
+    limit = limit or FUZZY_DEFAULT_LIMIT
+    items = await buscar_difuso(termino, offset, limit)
+    siguiente_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        siguiente_cursor = codificar_cursor({"o": offset + limit})
+
+    if stream:
+        async def generar():
+            # Los resultados ya están acotados en memoria: se emiten de una vez
+            yield b"".join(orjson.dumps(resultado_busqueda(item)) + b"\n" for item in items)
+            yield orjson.dumps({
+                "termino_busqueda": termino,
+                "total_resultados": len(items),
+                "modo": "difuso",
+                "siguiente_cursor": siguiente_cursor
+            }) + b"\n"
+        return StreamingResponse(generar(), media_type="application/x-ndjson")
+
+    with tramo("respuesta"):
+        cuerpo = respuesta_busqueda(termino, items, "difuso", siguiente_cursor)
+    with tramo("serializacion"):
+        return ORJSONResponse(cuerpo)
+
+@app.get("/buscar/{termino}", tags=["busqueda"])
+async def buscar_global(
+    request: Request,
+    termino: str,
+    modo: str = Query("auto", pattern="^(auto|texto|regex|difuso)$"),
+    limit: Optional[int] = Query(None, gt=0, le=1000),
+    cursor: Optional[str] = None,
+    stream: bool = False
+):
+    """
+    Busca un término en productos y postres (nombre, descripción y categoría) con una
+    sola consulta al catálogo. En modo "texto" usa su índice $text en español ordenando
+    por relevancia; "auto" lo usa cuando existe y si no cae a la búsqueda regex case-insensitive.
+    En modo "difuso" tolera acentos y errores de escritura ("barbakoa") con un índice de
+    trigramas en memoria; "auto" también lo usa cuando la búsqueda exacta no encuentra nada.
+    Con `limit` los resultados se paginan y `siguiente_cursor` apunta a la siguiente página.
+    Con `stream=true` (o `Accept: application/x-ndjson`) responde NDJSON conforme llegan los lotes.
+    """
+    auto = modo == "auto"
+    if auto:
+        modo = "texto" if await tiene_indice_texto(ItemCatalogo) else "regex"
+
+    offset = offset_de_cursor(cursor)
+    stream = stream or "application/x-ndjson" in request.headers.get("accept", "")
+
+    if modo == "difuso":
+        return await responder_busqueda_difusa(termino, offset, limit, stream)
+
+    if stream:
+        return StreamingResponse(
+            generar_busqueda_ndjson(termino, modo, offset, limit),
+            media_type="application/x-ndjson"
+        )
+
+    # Las búsquedas idénticas simultáneas comparten la misma consulta y respuesta
+    return await vuelo_unico.ejecutar(
+        "buscar", (termino, modo, auto, limit, cursor),
+        lambda: buscar_y_responder(termino, modo, auto, offset, limit, cursor)
+    )
+
+async def buscar_y_responder(termino: str, modo: str, auto: bool, offset: int,
+                             limit: Optional[int], cursor: Optional[str]):
+    """Ejecuta la búsqueda sin streaming y arma la respuesta JSON"""
+    try:
+        items = await cursor_busqueda(termino, modo, offset, limit).to_list(length=None)
+    except ERRORES_TEXTO:
+        if modo != "texto":
+            raise
+        # Sin índice de texto utilizable: volver a la búsqueda regex
+        descartar_indice_texto()
+        modo = "regex"
+        items = await cursor_busqueda(termino, modo, offset, limit).to_list(length=None)
+
+    if auto and not cursor and not items:
+        # Sin coincidencias exactas: probar con la búsqueda difusa
+        return await responder_busqueda_difusa(termino, 0, limit, False)
+
+    siguiente_cursor = None
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        siguiente_cursor = codificar_cursor({"o": offset + limit})
+
+    with tramo("respuesta"):
+        cuerpo = respuesta_busqueda(termino, items, modo, siguiente_cursor)
+    with tramo("serializacion"):
+        return ORJSONResponse(cuerpo)
+
+# ==================== SUGERENCIAS (AUTOCOMPLETADO) ====================
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas y sin acentos ("Café" -> "cafe") para comparar textos"""
+    descompuesto = unicodedata.normalize("NFD", texto.lower())
+    return "".join(c for c in descompuesto if unicodedata.category(c) != "Mn")
+
+class NodoTrie:
+    __slots__ = ("hijos", "claves")
+
+    def __init__(self):
+        self.hijos = {}
+        self.claves = set()
+
+class IndiceSugerencias:
+    """
+    Índice de prefijos en memoria sobre nombre y categoría de productos y postres.
+    Cada elemento se indexa por su nombre completo, por cada palabra del nombre
+    y por su categoría, todo normalizado sin acentos.
+    """
+
+    def __init__(self):
+        self._raiz = NodoTrie()
+        self._elementos = {}  # (tipo, id) -> {"tipo", "id", "nombre", "categoria"}
+        self._terminos = {}  # (tipo, id) -> términos indexados, para poder quitarlos
+
+    def __len__(self):
+        return len(self._elementos)
+
+    def claves(self) -> set:
+        return set(self._elementos)
+
+    @staticmethod
+    def _terminos_de(nombre: str, categoria: str) -> set:
+        nombre_normalizado = normalizar_texto(nombre)
+        return {nombre_normalizado, normalizar_texto(categoria), *nombre_normalizado.split()}
+
+    def agregar(self, tipo: str, id: int, nombre: str, categoria: str):
+        clave = (tipo, id)
+        self.quitar(tipo, id)
+        self._elementos[clave] = {"tipo": tipo, "id": id, "nombre": nombre, "categoria": categoria}
+        self._terminos[clave] = self._terminos_de(nombre, categoria)
+        for termino in self._terminos[clave]:
+            nodo = self._raiz
+            for caracter in termino:
+                nodo = nodo.hijos.setdefault(caracter, NodoTrie())
+            nodo.claves.add(clave)
+
+    def quitar(self, tipo: str, id: int):
+        clave = (tipo, id)
+        for termino in self._terminos.pop(clave, ()):
+            camino = [self._raiz]
+            for caracter in termino:
+                nodo = camino[-1].hijos.get(caracter)
+                if nodo is None:
+                    break
+                camino.append(nodo)
+            else:
+                camino[-1].claves.discard(clave)
+                # Podar los nodos que quedaron vacíos
+                for i in range(len(termino) - 1, -1, -1):
+                    nodo = camino[i + 1]
+                    if nodo.claves or nodo.hijos:
+                        break
+                    del camino[i].hijos[termino[i]]
+        self._elementos.pop(clave, None)
+
+    def sugerir(self, prefijo: str, k: int = 10) -> List[dict]:
+        """Devuelve hasta k elementos cuyo nombre, palabra o categoría empieza con el prefijo"""
+        prefijo = normalizar_texto(prefijo.strip())
+        if not prefijo:
+            return []
+        nodo = self._raiz
+        for caracter in prefijo:
+            nodo = nodo.hijos.get(caracter)
+            if nodo is None:
+                return []
+
+        # Recorrido en orden alfabético que se detiene al juntar suficientes candidatos, también
+        # dentro de un nodo: el de una categoría puede tener miles de claves
+        limite = k * 4
+        candidatos = []
+        vistos = set()
+        pila = [nodo]
+        while pila and len(candidatos) < limite:
+            actual = pila.pop()
+            for clave in actual.claves:
+                if clave not in vistos:
+                    vistos.add(clave)
+                    candidatos.append(self._elementos[clave])
+                    if len(candidatos) >= limite:
+                        break
+            pila.extend(actual.hijos[c] for c in sorted(actual.hijos, reverse=True))
+
+        def relevancia(elemento):
+            nombre = normalizar_texto(elemento["nombre"])
+            if nombre.startswith(prefijo):
+                return (0, len(nombre), nombre)
+            if any(palabra.startswith(prefijo) for palabra in nombre.split()):
+                return (1, len(nombre), nombre)
+            return (2, len(nombre), nombre)
+
+        return sorted(candidatos, key=relevancia)[:k]
+
+indice_sugerencias = IndiceSugerencias()
+
+async def construir_indices_busqueda():
+    """
+    Carga todos los productos y postres en los índices en memoria (prefijos y trigramas) en
+    una sola lectura. Los índices se actualizan en su lugar y al final se quitan los elementos
+    que ya no existen, así también sirve para resincronizarlos con una recarga completa.
+    """
+    inicio = time.perf_counter()
+    previos = indice_sugerencias.claves() | indice_difuso.claves()
+    vistos = set()
+    for documento, tipo in ((Producto, "Producto"), (Postre, "Postre")):
+        cursor = documento.get_motor_collection().find({}, {"nombre": 1, "categoria": 1, "descripcion": 1})
+        async for d in cursor:
+            vistos.add((tipo, d["_id"]))
+            indice_sugerencias.agregar(tipo, d["_id"], d["nombre"], d["categoria"])
+            indice_difuso.agregar(tipo, d["_id"], d["nombre"], d.get("descripcion"), d["categoria"])
+    for tipo, id in previos - vistos:
+        indice_sugerencias.quitar(tipo, id)
+        indice_difuso.quitar(tipo, id)
+    print(
+        f"✅ Índices de búsqueda construidos ({len(indice_sugerencias)} elementos, "
+        f"{indice_difuso.estadisticas()['palabras']} palabras en {time.perf_counter() - inicio:.2f}s)"
+    )
+
+@oyente_cambios
+async def actualizar_indice_sugerencias(coleccion: str, cambios: List[tuple]):
+    """Mantiene el índice de prefijos al día con las escrituras"""
+    tipo = TIPOS_CATALOGO.get(coleccion)
+    if tipo is None:
+        return
+    for antes, despues in cambios:
+        if despues is not None:
+            indice_sugerencias.agregar(tipo, despues["_id"], despues["nombre"], despues["categoria"])
+        elif antes is not None:
+            indice_sugerencias.quitar(tipo, antes["_id"])
+
+@app.get("/sugerencias", tags=["busqueda"])
+async def obtener_sugerencias(q: str = Query(..., min_length=1, max_length=100), k: int = Query(10, gt=0, le=50)):
+    """Autocompletado por prefijo de nombre o categoría, servido desde memoria (sin consultar MongoDB)"""
+    return ORJSONResponse({"q": q, "sugerencias": indice_sugerencias.sugerir(q, k)})
+
+# ==================== BÚSQUEDA DIFUSA (TRIGRAMAS) ====================
+
+# Similitud mínima (0-1) entre una palabra buscada y una palabra del índice
+FUZZY_MIN_SIMILARITY = float(os.getenv("FUZZY_MIN_SIMILARITY", "0.3"))
+# Palabras distintas como máximo en el vocabulario del índice (acota la memoria)
+FUZZY_MAX_VOCABULARY = int(os.getenv("FUZZY_MAX_VOCABULARY", "200000"))
+# Resultados por colección en modo difuso cuando no se indica `limit`
+FUZZY_DEFAULT_LIMIT = int(os.getenv("FUZZY_DEFAULT_LIMIT", "50"))
+
+def trigramas(palabra: str) -> frozenset:
+    """Trigramas de una palabra, con relleno para que pesen el inicio y el final"""
+    relleno = f"  {palabra} "
+    return frozenset(relleno[i:i + 3] for i in range(len(relleno) - 2))
+
+# Palabras demasiado comunes para aportar al ranking (y que más memoria ocuparían)
+PALABRAS_VACIAS = frozenset({
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "los", "o", "para", "por", "sin", "un", "una", "y"
+})
+
+def palabras_normalizadas(texto: str) -> List[str]:
+    """Palabras sin acentos ni puntuación de un texto, omitiendo números sueltos y palabras vacías"""
+    limpio = "".join(c if c.isalnum() else " " for c in normalizar_texto(texto))
+    return [p for p in limpio.split() if not p.isdigit() and p not in PALABRAS_VACIAS]
+
+class IndiceDifuso:
+    """
+    Índice de trigramas en memoria sobre nombre, descripción y categoría de productos
+    y postres. Los trigramas se indexan por palabra del vocabulario y no por documento,
+    así la memoria crece con el vocabulario (acotado) y no con el volumen de texto.
+    """
+
+    def __init__(self, umbral: float = FUZZY_MIN_SIMILARITY, max_vocabulario: int = FUZZY_MAX_VOCABULARY):
+        self.umbral = umbral
+        self.max_vocabulario = max_vocabulario
+        self.palabras_descartadas = 0
+        self._trigramas = {}  # trigrama -> palabras que lo contienen
+        self._palabras = {}  # palabra -> (tipo, id) de los elementos que la contienen
+        self._num_trigramas = {}  # palabra -> cantidad de trigramas
+        self._elementos = {}  # (tipo, id) -> palabras indexadas, para poder quitarlas
+
+    def __len__(self):
+        return len(self._elementos)
+
+    def claves(self) -> set:
+        return set(self._elementos)
+
+    def agregar(self, tipo: str, id: int, *textos: Optional[str]):
+        clave = (tipo, id)
+        self.quitar(tipo, id)
+        indexadas = set()
+        for palabra in {p for texto in textos if texto for p in palabras_normalizadas(texto)}:
+            elementos = self._palabras.get(palabra)
+            if elementos is None:
+                if len(self._palabras) >= self.max_vocabulario:
+                    self.palabras_descartadas += 1
+                    continue
+                elementos = self._palabras[palabra] = set()
+                grupo = trigramas(palabra)
+                self._num_trigramas[palabra] = len(grupo)
+                for trigrama in grupo:
+                    self._trigramas.setdefault(trigrama, set()).add(palabra)
+            elementos.add(clave)
+            indexadas.add(palabra)
+        self._elementos[clave] = indexadas
+
+    def quitar(self, tipo: str, id: int):
+        clave = (tipo, id)
+        for palabra in self._elementos.pop(clave, ()):
+            elementos = self._palabras[palabra]
+            elementos.discard(clave)
+            if elementos:
+                continue
+            # Ningún elemento usa ya la palabra: sacarla del vocabulario
+            del self._palabras[palabra]
+            del self._num_trigramas[palabra]
+            for trigrama in trigramas(palabra):
+                palabras = self._trigramas[trigrama]
+                palabras.discard(palabra)
+                if not palabras:
+                    del self._trigramas[trigrama]
+
+    def palabras_similares(self, palabra: str) -> Dict[str, float]:
+        """Palabras del vocabulario cuya similitud de trigramas (Jaccard) alcanza el umbral"""
+        buscados = trigramas(palabra)
+        comunes = {}
+        for trigrama in buscados:
+            for candidata in self._trigramas.get(trigrama, ()):
+                comunes[candidata] = comunes.get(candidata, 0) + 1
+        similares = {}
+        for candidata, n in comunes.items():
+            similitud = n / (len(buscados) + self._num_trigramas[candidata] - n)
+            if similitud >= self.umbral:
+                similares[candidata] = similitud
+        return similares
+
+    def buscar(self, texto: str) -> Dict[tuple, float]:
+        """
+        Puntúa los elementos contra el texto: por cada palabra buscada se toma la
+        palabra más parecida del elemento y el puntaje es el promedio (0-1).
+        """
+        buscadas = palabras_normalizadas(texto)
+        puntajes = {}
+        for palabra in buscadas:
+            mejores = {}
+            for similar, similitud in self.palabras_similares(palabra).items():
+                for clave in self._palabras[similar]:
+                    if similitud > mejores.get(clave, 0):
+                        mejores[clave] = similitud
+            for clave, similitud in mejores.items():
+                puntajes[clave] = puntajes.get(clave, 0) + similitud
+        return {clave: total / len(buscadas) for clave, total in puntajes.items()}
+
+    def estadisticas(self) -> dict:
+        return {
+            "elementos": len(self._elementos),
+            "palabras": len(self._palabras),
+            "trigramas": len(self._trigramas),
+            "max_vocabulario": self.max_vocabulario,
+            "palabras_descartadas": self.palabras_descartadas
+        }
+
+indice_difuso = IndiceDifuso()
+
+@oyente_cambios
+async def actualizar_indice_difuso(coleccion: str, cambios: List[tuple]):
+    """Mantiene el índice de trigramas al día con las escrituras"""
+    tipo = TIPOS_CATALOGO.get(coleccion)
+    if tipo is None:
+        return
+    for antes, despues in cambios:
+        if despues is not None:
+            indice_difuso.agregar(
+                tipo, despues["_id"], despues["nombre"], despues.get("descripcion"), despues["categoria"])
+        elif antes is not None:
+            indice_difuso.quitar(tipo, antes["_id"])
+
+async def sincronizar_indices_busqueda(coleccion: str, documentos: Dict[int, Optional[dict]]):
+    """
+    Aplica a los índices de búsqueda el estado de IDs escritos en otro worker (None si se
+    borraron): los oyentes de este worker solo reciben sus propias escrituras.
+    """
+    # Del estado anterior los oyentes solo usan el _id, para quitar los borrados
+    cambios = [({"_id": id}, documento) for id, documento in documentos.items()]
+    await actualizar_indice_sugerencias(coleccion, cambios)
+    await actualizar_indice_difuso(coleccion, cambios)
+
+async def buscar_difuso(termino: str, offset: int, limit: int) -> List[dict]:
+    """
+    Búsqueda difusa sin acentos: el ranking sale del índice de trigramas en memoria y
+    del catálogo solo se lee por _id la página pedida (limit + 1) en una consulta.
+    Devuelve los elementos del catálogo con la similitud en el campo "similitud".
+    """
+    with tramo("indice_memoria"):
+        puntajes = indice_difuso.buscar(termino)
+        pagina = sorted(puntajes, key=lambda clave: (-puntajes[clave], clave))[offset:offset + limit + 1]
+    if not pagina:
+        return []
+    claves = {clave_catalogo(COLECCIONES_CATALOGO[tipo], id): (tipo, id) for tipo, id in pagina}
+    cursor = coleccion_lectura(ItemCatalogo).find({"_id": {"$in": list(claves)}})
+    encontrados = {claves[item["_id"]]: item async for item in cursor}
+    return [
+        {**encontrados[clave], "similitud": round(puntajes[clave], 3)}
+        for clave in pagina if clave in encontrados
+    ]
 
 # ==================== ENDPOINTS DE RELACIONES (SIMPLES) ====================
 
 @app.get("/productos/{producto_id}/misma-categoria", response_model=List[PostreResponse], tags=["relaciones"])
 async def obtener_postres_misma_categoria(producto_id: int):
     """Obtiene todos los postres de la misma categoría que un producto"""
-    producto = await Producto.find_one(Producto.id == producto_id)
-    if producto is None:
+    postres = await relacionados_misma_categoria("productos", producto_id, "Postre")
+    if postres is None:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    postres = await Postre.find(Postre.categoria == producto.categoria).to_list()
-    return [postre_to_response(p) for p in postres]
+    return ORJSONResponse([postre_crudo_to_response(p) for p in postres])
 
 @app.get("/postres/{postre_id}/misma-categoria", response_model=List[ProductoResponse], tags=["relaciones"])
 async def obtener_productos_misma_categoria(postre_id: int):
     """Obtiene todos los productos de la misma categoría que un postre"""
-    postre = await Postre.find_one(Postre.id == postre_id)
-    if postre is None:
+    productos = await relacionados_misma_categoria("postres", postre_id, "Producto")
+    if productos is None:
         raise HTTPException(status_code=404, detail="Postre no encontrado")
     
-    productos = await Producto.find(Producto.categoria == postre.categoria).to_list()
-    return [producto_to_response(p) for p in productos]
+    return ORJSONResponse([producto_crudo_to_response(p) for p in productos])
+
+# ==================== ENDPOINTS DEL CATÁLOGO ====================
+
+@app.get("/catalogo/categoria/{categoria}", tags=["catálogo"])
+async def obtener_catalogo_por_categoria(categoria: str):
+    """Productos y postres de una categoría (con su descripción) en una sola consulta al catálogo"""
+    async def cargar():
+        items = await coleccion_lectura(ItemCatalogo).find({"categoria": categoria}).sort(
+            [("tipo", DESCENDING), ("id_origen", ASCENDING)]
+        ).to_list(length=None)
+        return {
+            "categoria": categoria,
+            "descripcion": items[0].get("categoria_descripcion") if items else None,
+            "productos": [producto_crudo_to_response(crudo_desde_catalogo(i)) for i in items if i["tipo"] == "Producto"],
+            "postres": [postre_crudo_to_response(crudo_desde_catalogo(i)) for i in items if i["tipo"] == "Postre"]
+        }
+    etiquetas = [f"productos:categoria:{categoria}", f"postres:categoria:{categoria}", "categorias"]
+    return ORJSONResponse(await cache_lectura.leer(f"catalogo:categoria:{categoria}", etiquetas, cargar))
+
+@app.get("/catalogo/instantanea", tags=["catálogo"])
+async def obtener_estado_instantanea():
+    """Versión, tamaño, tiempo de carga y memoria del worker que atiende la petición"""
+    return gestor_instantanea.estadisticas()
+
+@app.post("/catalogo/reconstruir", tags=["catálogo"])
+async def reconstruir_catalogo_endpoint():
+    """Reconstruye el catálogo de lectura desde productos, postres y categorías"""
+    resultado = await reconstruir_catalogo()
+    cache_lectura.limpiar()
+    return {"message": "Catálogo reconstruido correctamente", **resultado}
+
+# ==================== MENÚ COMPLETO ====================
+
+def pipeline_menu(disponible: Optional[int]) -> List[dict]:
+    """Categorías ordenadas con sus productos y postres anidados por un $lookup sobre el nombre"""
+    filtro = {} if disponible is None else {"disponible": disponible}
+
+    def anidar(coleccion: str, proyeccion: dict) -> dict:
+        return {"$lookup": {
+            "from": coleccion, "localField": "nombre", "foreignField": "categoria",
+            "pipeline": [{"$match": filtro}, {"$sort": {"_id": 1}}, {"$project": proyeccion}],
+            "as": coleccion
+        }}
+
+    return [
+        {"$sort": {"nombre": 1}},
+        anidar("productos", PROYECCION_PRODUCTO),
+        anidar("postres", PROYECCION_POSTRE)
+    ]
+
+def etag_contenido(cuerpo: bytes) -> str:
+    """ETag a partir del contenido serializado (igual en todos los workers)"""
+    return f'"{hashlib.blake2b(cuerpo, digest_size=8).hexdigest()}"'
+
+def etag_coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Indica si el header If-None-Match incluye el ETag (comparación débil)"""
+    if if_none_match is None:
+        return False
+    etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas
+
+@app.get("/menu", tags=["menu"])
+async def obtener_menu(
+    disponible: Optional[int] = Query(None, ge=0, le=1),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Menú completo: cada categoría con sus productos y postres, armado con una sola
+    agregación. La respuesta serializada queda en cache hasta la siguiente escritura y
+    con If-None-Match responde 304 si el menú no cambió.
+    """
+    async def cargar():
+        categorias = await coleccion_lectura(Categoria).aggregate(
+            pipeline_menu(disponible)
+        ).to_list(length=None)
+        menu = [
+            {
+                "id": c["_id"],
+                "nombre": c["nombre"],
+                "descripcion": c["descripcion"],
+                "productos": [producto_crudo_to_response(p) for p in c["productos"]],
+                "postres": [postre_crudo_to_response(p) for p in c["postres"]]
+            }
+            for c in categorias
+        ]
+        cuerpo = orjson.dumps({
+            "categorias": menu,
+            "total_productos": sum(len(c["productos"]) for c in menu),
+            "total_postres": sum(len(c["postres"]) for c in menu)
+        })
+        return cuerpo, etag_contenido(cuerpo)
+
+    cuerpo, etag = await vuelo_unico.ejecutar(
+        "menu", disponible, lambda: cache_lectura.leer(f"menu:{disponible}", ["menu"], cargar)
+    )
+    cabeceras = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_coincide(if_none_match, etag):
+        return Response(status_code=304, headers=cabeceras)
+    return Response(cuerpo, media_type="application/json", headers=cabeceras)
+
+# ==================== IMPORTACIÓN Y EXPORTACIÓN ====================
+
+# Documentos por lote al leer el cursor de exportación
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Lotes de bulk_write de una importación que pueden estar en curso a la vez
+IMPORT_MAX_IN_FLIGHT = int(os.getenv("IMPORT_MAX_IN_FLIGHT", "2"))
+# Errores por fila que se detallan en la respuesta de una importación
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Colección -> (documento, esquema de alta con el que se validan y exportan los campos)
+COLECCIONES_IMPORTABLES = {
+    "productos": (Producto, ProductoCreate),
+    "postres": (Postre, PostreCreate),
+    "categorias": (Categoria, CategoriaCreate)
+}
+
+def coleccion_importable(coleccion: str) -> tuple:
+    """Documento y esquema de una colección importable/exportable (404 si no lo es)"""
+    if coleccion not in COLECCIONES_IMPORTABLES:
+        raise HTTPException(status_code=404, detail=f"Colección no soportada: {coleccion}")
+    return COLECCIONES_IMPORTABLES[coleccion]
+
+def lineas_csv(filas: List[list]) -> bytes:
+    """Serializa filas como CSV"""
+    salida = io.StringIO()
+    csv.writer(salida, lineterminator="\n").writerows(filas)
+    return salida.getvalue().encode()
+
+async def generar_exportacion(documento, campos: List[str], formato: str):
+    """Lee la colección por lotes desde un cursor de Motor y emite cada lote ya serializado"""
+    cursor = coleccion_lectura(documento).find({}, {campo: 1 for campo in campos}).sort("_id", ASCENDING)
+    if formato == "csv":
+        yield lineas_csv([["id", *campos]])
+    while lote := await cursor.to_list(length=EXPORT_BATCH_SIZE):
+        if formato == "csv":
+            yield lineas_csv([[d["_id"], *(d.get(campo) for campo in campos)] for d in lote])
+        else:
+            yield b"".join(
+                orjson.dumps({"id": d["_id"], **{campo: d.get(campo) for campo in campos}}) + b"\n"
+                for d in lote
+            )
+
+async def lineas_del_cuerpo(request: Request):
+    """Divide el cuerpo de la petición en líneas conforme llega, sin cargarlo completo en memoria"""
+    decodificador = codecs.getincrementaldecoder("utf-8")()
+    pendiente = ""
+    async for trozo in request.stream():
+        pendiente += decodificador.decode(trozo)
+        *lineas, pendiente = pendiente.split("\n")
+        for linea in lineas:
+            yield linea
+    pendiente += decodificador.decode(b"", final=True)
+    if pendiente:
+        yield pendiente
+
+class LineasPendientes:
+    """Líneas ya recibidas del cuerpo, en el orden en que las consume un csv.reader"""
+
+    def __init__(self):
+        self.lineas = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lineas:
+            raise StopIteration
+        return self.lineas.popleft()
+
+async def filas_importacion(request: Request, formato: str):
+    """
+    Genera (número de línea, fila como dict o mensaje de error) a partir del cuerpo NDJSON o
+    CSV. En CSV un solo csv.reader consume las líneas conforme llegan; un registro se lee
+    cuando sus comillas están cerradas, así los campos con saltos de línea llegan completos.
+    """
+    encabezados = None
+    numero = 0
+    pendientes = LineasPendientes()
+    lector = csv.reader(pendientes)
+    inicio_registro = None
+    comillas = 0
+    async for linea in lineas_del_cuerpo(request):
+        numero += 1
+        if formato == "csv":
+            if inicio_registro is None:
+                if not linea.strip():
+                    continue
+                inicio_registro = numero
+            pendientes.lineas.append(linea + "\n")
+            comillas += linea.count('"')
+            if comillas % 2:
+                continue  # Un campo entre comillas sigue en la siguiente línea
+            valores = next(lector)
+            fila_inicio, inicio_registro, comillas = inicio_registro, None, 0
+            if encabezados is None:
+                encabezados = [v.strip() for v in valores]
+                continue
+            # Las celdas vacías toman el valor por defecto del esquema
+            yield fila_inicio, {k: v for k, v in zip(encabezados, valores) if v != ""}
+            continue
+        linea = linea.rstrip("\r")
+        if not linea.strip():
+            continue
+        try:
+            fila = orjson.loads(linea)
+        except orjson.JSONDecodeError as e:
+            yield numero, f"JSON inválido: {e}"
+            continue
+        yield numero, fila if isinstance(fila, dict) else "Cada línea debe ser un objeto JSON"
+    if inicio_registro is not None:
+        yield inicio_registro, "Campo entre comillas sin cerrar al final del archivo"
+
+async def importar_filas(documento, coleccion: str, esquema, filas) -> dict:
+    """
+    Valida cada fila con el esquema de alta y escribe los lotes válidos con bulk_write no
+    ordenado, reservando un rango de IDs por lote. Solo hay IMPORT_MAX_IN_FLIGHT lotes
+    escribiéndose a la vez: mientras tanto no se sigue leyendo el cuerpo (contrapresión).
+    """
+    resumen = {"coleccion": coleccion, "total": 0, "insertados": 0, "errores": 0, "detalle_errores": []}
+    motor = documento.get_motor_collection()
+    lugares = asyncio.Semaphore(IMPORT_MAX_IN_FLIGHT)
+    tareas = []
+
+    def registrar_error(fila: int, error: str):
+        resumen["errores"] += 1
+        if len(resumen["detalle_errores"]) < IMPORT_MAX_ERRORS:
+            resumen["detalle_errores"].append({"fila": fila, "error": error})
+
+    async def escribir(lote: List[tuple]):
+        try:
+            try:
+                primer_id = await asignador_ids.reservar_rango(coleccion, len(lote))
+                documentos = [{"_id": primer_id + i, **datos} for i, (_, datos) in enumerate(lote)]
+                fallidos = {}
+                try:
+                    await motor.bulk_write([InsertOne(d) for d in documentos], ordered=False)
+                except BulkWriteError as e:
+                    fallidos = {error["index"]: error.get("errmsg") for error in e.details.get("writeErrors", [])}
+            except Exception as e:
+                # El lote completo falló (conexión, tiempo de espera...): cada fila cuenta como error
+                print(f"⚠️ Lote de {len(lote)} filas de {coleccion} sin escribir: {e!r}")
+                for numero, _ in lote:
+                    registrar_error(numero, f"Lote no escrito: {e}")
+                return
+            for indice, mensaje in fallidos.items():
+                registrar_error(lote[indice][0], mensaje)
+            resumen["insertados"] += len(lote) - len(fallidos)
+            await notificar_cambios(coleccion, [
+                (None, d) for i, d in enumerate(documentos) if i not in fallidos
+            ])
+        finally:
+            lugares.release()
+
+    async def enviar(lote: List[tuple]):
+        await lugares.acquire()
+        tareas.append(asyncio.create_task(escribir(lote)))
+
+    lote = []
+    try:
+        async for numero, fila in filas:
+            resumen["total"] += 1
+            if isinstance(fila, str):
+                registrar_error(numero, fila)
+                continue
+            try:
+                lote.append((numero, esquema.model_validate(fila).model_dump()))
+            except ValidationError as e:
+                registrar_error(numero, describir_error_validacion(e))
+                continue
+            if len(lote) >= BULK_CHUNK_SIZE:
+                await enviar(lote)
+                lote = []
+        if lote:
+            await enviar(lote)
+    finally:
+        await asyncio.gather(*tareas)
+
+    resumen["errores_omitidos"] = resumen["errores"] - len(resumen["detalle_errores"])
+    return resumen
+
+@app.get("/exportar/{coleccion}", tags=["importación"])
+async def exportar_coleccion(coleccion: str, formato: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Exporta productos, postres o categorías como NDJSON o CSV, transmitiendo por lotes desde el cursor."""
+    documento, esquema = coleccion_importable(coleccion)
+    media_type = "text/csv" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        generar_exportacion(documento, list(esquema.model_fields), formato),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{coleccion}.{formato}"'}
+    )
+
+@app.post("/importar/{coleccion}", tags=["importación"])
+async def importar_coleccion(request: Request, coleccion: str, formato: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """
+    Importa productos, postres o categorías desde un cuerpo NDJSON o CSV (con encabezados)
+    que se procesa conforme llega. Cada fila se valida con el esquema de alta y recibe un ID
+    nuevo; la respuesta resume lo insertado y detalla los errores por número de línea.
+    """
+    documento, esquema = coleccion_importable(coleccion)
+    return await importar_filas(documento, coleccion, esquema, filas_importacion(request, formato))
+
+# ==================== ESTADÍSTICAS MATERIALIZADAS ====================
+
+# Campos de precio que se suman (para promedios) y de los que se guardan mínimo y máximo
+CAMPOS_ESTADISTICAS = {
+    "productos": {"sumas": ["precio"], "extremos": ["precio"]},
+    "postres": {"sumas": ["precio_rebanada", "precio_total"], "extremos": []},
+}
+
+def grupo_estadisticas(coleccion: str) -> dict:
+    """Etapa $group que calcula las estadísticas por categoría de una colección"""
+    campos = CAMPOS_ESTADISTICAS[coleccion]
+    grupo = {"_id": "$categoria", "total": {"$sum": 1}}
+    for campo in campos["sumas"]:
+        grupo[f"suma_{campo}"] = {"$sum": f"${campo}"}
+    for campo in campos["extremos"]:
+        grupo[f"min_{campo}"] = {"$min": f"${campo}"}
+        grupo[f"max_{campo}"] = {"$max": f"${campo}"}
+    return {"$group": grupo}
+
+def estadistica_desde_grupo(coleccion: str, grupo: dict) -> dict:
+    """Convierte el resultado de grupo_estadisticas en un documento de Estadistica"""
+    campos = CAMPOS_ESTADISTICAS[coleccion]
+    return {
+        "_id": f"{coleccion}:{grupo['_id']}",
+        "coleccion": coleccion,
+        "categoria": grupo["_id"],
+        "total": grupo["total"],
+        "sumas": {campo: grupo[f"suma_{campo}"] for campo in campos["sumas"]},
+        "minimos": {campo: grupo[f"min_{campo}"] for campo in campos["extremos"]},
+        "maximos": {campo: grupo[f"max_{campo}"] for campo in campos["extremos"]},
+    }
+
+async def reconstruir_estadisticas() -> int:
+    """
+    Recalcula todas las estadísticas con una sola agregación ($unionWith + $facet)
+    y reemplaza los documentos materializados. Devuelve el número de categorías.
+    """
+    def proyeccion(coleccion: str) -> dict:
+        campos = set(CAMPOS_ESTADISTICAS[coleccion]["sumas"] + CAMPOS_ESTADISTICAS[coleccion]["extremos"])
+        return {"$project": {"_id": 0, "coleccion": {"$literal": coleccion}, "categoria": 1, **{c: 1 for c in campos}}}
+
+    pipeline = [
+        proyeccion("productos"),
+        {"$unionWith": {"coll": "postres", "pipeline": [proyeccion("postres")]}},
+        {"$facet": {
+            coleccion: [{"$match": {"coleccion": coleccion}}, grupo_estadisticas(coleccion)]
+            for coleccion in CAMPOS_ESTADISTICAS
+        }}
+    ]
+    facetas = await Producto.get_motor_collection().aggregate(pipeline).to_list(length=None)
+    documentos = [
+        estadistica_desde_grupo(coleccion, grupo)
+        for coleccion, grupos in (facetas[0] if facetas else {}).items()
+        for grupo in grupos
+    ]
+
+    operaciones = [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in documentos]
+    operaciones.append(DeleteMany({"_id": {"$nin": [d["_id"] for d in documentos]}}))
+    await Estadistica.get_motor_collection().bulk_write(operaciones, ordered=False)
+    print(f"✅ Estadísticas materializadas reconstruidas ({len(documentos)} categorías)")
+    return len(documentos)
+
+async def recalcular_categoria(coleccion: str, categoria: str):
+    """Recalcula las estadísticas de una sola categoría (usa el índice de categoría)"""
+    documento = Producto if coleccion == "productos" else Postre
+    grupos = await documento.get_motor_collection().aggregate([
+        {"$match": {"categoria": categoria}},
+        grupo_estadisticas(coleccion)
+    ]).to_list(length=None)
+    estadisticas = Estadistica.get_motor_collection()
+    if grupos:
+        await estadisticas.replace_one(
+            {"_id": f"{coleccion}:{categoria}"}, estadistica_desde_grupo(coleccion, grupos[0]), upsert=True
+        )
+    else:
+        await estadisticas.delete_one({"_id": f"{coleccion}:{categoria}"})
+
+# Diferido: las estadísticas toleran un pequeño retraso y cuestan varias consultas por categoría
+@oyente_cambios(diferido=True)
+async def actualizar_estadisticas(coleccion: str, cambios: List[tuple]):
+    """
+    Aplica incrementalmente las escrituras a las estadísticas materializadas:
+    $inc de totales y sumas, $min/$max para las altas. Si se quita un precio que era
+    el mínimo o el máximo de su categoría, esa categoría se recalcula.
+    """
+    if coleccion not in CAMPOS_ESTADISTICAS:
+        return
+    campos = CAMPOS_ESTADISTICAS[coleccion]
+    por_categoria = {}  # categoria -> {"altas": [...], "bajas": [...]}
+    for antes, despues in cambios:
+        if antes is not None and despues is not None and all(
+            antes.get(c) == despues.get(c) for c in ["categoria", *campos["sumas"], *campos["extremos"]]
+        ):
+            continue  # El cambio no afecta las estadísticas
+        if antes is not None:
+            por_categoria.setdefault(antes["categoria"], {"altas": [], "bajas": []})["bajas"].append(antes)
+        if despues is not None:
+            por_categoria.setdefault(despues["categoria"], {"altas": [], "bajas": []})["altas"].append(despues)
+
+    estadisticas = Estadistica.get_motor_collection()
+    for categoria, movimientos in por_categoria.items():
+        altas, bajas = movimientos["altas"], movimientos["bajas"]
+        actualizacion = {
+            "$inc": {
+                "total": len(altas) - len(bajas),
+                **{f"sumas.{c}": sum(d[c] for d in altas) - sum(d[c] for d in bajas) for c in campos["sumas"]}
+            },
+            "$setOnInsert": {"coleccion": coleccion, "categoria": categoria}
+        }
+        if not campos["extremos"]:
+            # Misma forma que los documentos de reconstruir_estadisticas
+            actualizacion["$setOnInsert"].update(minimos={}, maximos={})
+        if altas and campos["extremos"]:
+            actualizacion["$min"] = {f"minimos.{c}": min(d[c] for d in altas) for c in campos["extremos"]}
+            actualizacion["$max"] = {f"maximos.{c}": max(d[c] for d in altas) for c in campos["extremos"]}
+
+        resultado = await estadisticas.find_one_and_update(
+            {"_id": f"{coleccion}:{categoria}"}, actualizacion,
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        extremo_quitado = any(
+            d[c] <= resultado.get("minimos", {}).get(c, d[c]) or d[c] >= resultado.get("maximos", {}).get(c, d[c])
+            for d in bajas for c in campos["extremos"]
+        )
+        if resultado["total"] <= 0 or extremo_quitado:
+            await recalcular_categoria(coleccion, categoria)
 
 # ==================== ENDPOINTS DE ESTADÍSTICAS ====================
 
 @app.get("/estadisticas/", tags=["estadísticas"])
 async def obtener_estadisticas():
-    """Obtiene estadísticas generales de productos y postres."""
-    # Estadísticas de productos por categoría
-    pipeline_productos = [
-        {
-            "$group": {
-                "_id": "$categoria",
-                "total_productos": {"$sum": 1},
-                "precio_promedio": {"$avg": "$precio"},
-                "precio_minimo": {"$min": "$precio"},
-                "precio_maximo": {"$max": "$precio"}
+    """Obtiene estadísticas generales de productos y postres (precalculadas)."""
+    estadisticas = await vuelo_unico.ejecutar("estadisticas", None, leer_estadisticas)
+    with tramo("serializacion"):
+        return ORJSONResponse(estadisticas)
+
+async def leer_estadisticas() -> dict:
+    """Arma la respuesta de /estadisticas/ a partir de los documentos materializados"""
+    documentos = await coleccion_lectura(Estadistica).find({"total": {"$gt": 0}}).to_list(length=None)
+
+    with tramo("respuesta"):
+        estadisticas_productos = sorted((
+            {
+                "_id": d["categoria"],
+                "total_productos": d["total"],
+                "precio_promedio": d["sumas"]["precio"] / d["total"],
+                "precio_minimo": d["minimos"]["precio"],
+                "precio_maximo": d["maximos"]["precio"]
             }
-        },
-        {
-            "$sort": {"total_productos": -1}
-        }
-    ]
-    
-    estadisticas_productos = await Producto.aggregate(pipeline_productos).to_list()
-    total_productos = await Producto.count()
-    total_postres = await Postre.count()
-    
-    # Estadísticas de postres por categoría
-    pipeline_postres = [
-        {
-            "$group": {
-                "_id": "$categoria",
-                "total_postres": {"$sum": 1},
-                "precio_promedio_rebanada": {"$avg": "$precio_rebanada"},
-                "precio_promedio_total": {"$avg": "$precio_total"}
+            for d in documentos if d["coleccion"] == "productos"
+        ), key=lambda e: -e["total_productos"])
+
+        estadisticas_postres = sorted((
+            {
+                "_id": d["categoria"],
+                "total_postres": d["total"],
+                "precio_promedio_rebanada": d["sumas"]["precio_rebanada"] / d["total"],
+                "precio_promedio_total": d["sumas"]["precio_total"] / d["total"]
             }
-        },
-        {
-            "$sort": {"total_postres": -1}
+            for d in documentos if d["coleccion"] == "postres"
+        ), key=lambda e: -e["total_postres"])
+
+        return {
+            "resumen": {
+                "total_productos": sum(e["total_productos"] for e in estadisticas_productos),
+                "total_postres": sum(e["total_postres"] for e in estadisticas_postres),
+                "total_categorias": len(set([p["_id"] for p in estadisticas_productos] + [p["_id"] for p in estadisticas_postres]))
+            },
+            "estadisticas_productos": estadisticas_productos,
+            "estadisticas_postres": estadisticas_postres
         }
-    ]
-    
-    estadisticas_postres = await Postre.aggregate(pipeline_postres).to_list()
-    
-    return {
-        "resumen": {
-            "total_productos": total_productos,
-            "total_postres": total_postres,
-            "total_categorias": len(set([p["_id"] for p in estadisticas_productos] + [p["_id"] for p in estadisticas_postres]))
-        },
-        "estadisticas_productos": estadisticas_productos,
-        "estadisticas_postres": estadisticas_postres
-    }
+
+@app.post("/estadisticas/reconstruir", tags=["estadísticas"])
+async def reconstruir_estadisticas_endpoint():
+    """Recalcula desde cero las estadísticas materializadas."""
+    categorias = await reconstruir_estadisticas()
+    return {"message": "Estadísticas reconstruidas correctamente", "categorias": categorias}
 
 # ==================== ENDPOINT PARA VER CONTADORES ====================
 
 @app.get("/contadores/", tags=["administración"])
 async def obtener_contadores():
     """Obtiene los valores actuales de los contadores de auto incremento"""
-    contadores = await Contador.find_all().to_list()
+    # Lectura cruda: `ids_perdidos` no es parte del modelo Contador
+    contadores = await Contador.get_motor_collection().find({}, {"_id": 0}).to_list(length=None)
     return {
         "contadores": [
             {
-                "coleccion": c.collection_name,
-                "proximo_id": c.sequence_value + 1,
-                "ultimo_id_usado": c.sequence_value
+                "coleccion": c["collection_name"],
+                "proximo_id": c["sequence_value"] + 1,
+                "ultimo_id_usado": c["sequence_value"],
+                # IDs reservados en bloques que los workers descartaron al apagarse
+                "ids_perdidos": c.get("ids_perdidos", 0)
             }
-            for c in contadores
-        ]
+            for c in contadores if c["collection_name"] not in (CONTADOR_VERSION_CATALOGO, MARCA_DATOS_EJEMPLO)
+        ],
+        "version_catalogo": next(
+            (c["sequence_value"] for c in contadores if c["collection_name"] == CONTADOR_VERSION_CATALOGO), 0
+        ),
+        "asignador": asignador_ids.estadisticas()
+    }
+
+# ==================== ENDPOINTS DE ARRANQUE E ÍNDICES ====================
+
+@app.get("/ready", tags=["administración"])
+async def verificar_disponibilidad():
+    """Readiness: 200 solo cuando la preparación de datos terminó y todos los índices declarados existen"""
+    tarea = getattr(app.state, "tarea_preparacion", None)
+    terminada = tarea is not None and tarea.done() and not tarea.cancelled()
+    error_preparacion = str(tarea.exception()) if terminada and tarea.exception() is not None else None
+    datos_listos = terminada and error_preparacion is None
+    listo = datos_listos and sincronizador_indices.listo
+    return ORJSONResponse({
+        "listo": listo,
+        "datos_preparados": datos_listos,
+        "error_preparacion": error_preparacion,
+        "segundos_arranque": getattr(app.state, "segundos_arranque", None),
+        "indices": sincronizador_indices.reporte(),
+    }, status_code=200 if listo else 503)
+
+@app.get("/indices/", tags=["administración"])
+async def obtener_reporte_indices():
+    """Reporte de la última conciliación de índices (los que faltaban y cuánto tardó cada uno)"""
+    return sincronizador_indices.reporte()
+
+@app.post("/indices/sincronizar", tags=["administración"])
+async def sincronizar_indices():
+    """Vuelve a conciliar los índices declarados en segundo plano (p. ej. tras corregir un error)"""
+    sincronizador_indices.iniciar()
+    return {"message": "Conciliación de índices iniciada", "estado": sincronizador_indices.estado}
+
+# ==================== ENDPOINTS DE CACHE ====================
+
+@app.get("/cache/", tags=["administración"])
+async def obtener_estadisticas_cache():
+    """Obtiene los contadores de hits/misses de la cache de lectura"""
+    return cache_lectura.estadisticas()
+
+@app.get("/cache/coalescencia", tags=["administración"])
+async def obtener_estadisticas_coalescencia():
+    """Peticiones ejecutadas y coalescidas por ruta con single-flight"""
+    return vuelo_unico.estadisticas()
+
+@app.delete("/cache/", tags=["administración"])
+async def limpiar_cache():
+    """Vacía la cache de lectura"""
+    cache_lectura.limpiar()
+    return {"message": "Cache vaciada correctamente"}
+
+# ==================== ENDPOINTS DEL PERFILADOR ====================
+
+def exigir_token_perfilador(x_admin_token: Optional[str]):
+    """Los endpoints del perfilador requieren el header X-Admin-Token igual a PROFILER_TOKEN"""
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail="Perfilador deshabilitado (define PROFILER_TOKEN)")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token.encode(), PROFILER_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Token de administración inválido")
+
+@app.post("/profiler/iniciar", tags=["administración"])
+async def iniciar_perfilado(
+    tasa: float = Query(0.0, ge=0, le=1),
+    rutas: str = "",
+    segundos: Optional[float] = Query(None, gt=0, le=86400),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Perfila una fracción `tasa` de las peticiones y todas las que empiecen con alguno de los
+    prefijos de `rutas` (separados por coma), durante `segundos` o hasta /profiler/detener.
+    Una petición también se perfila si trae el header X-Profile con el token.
+    """
+    exigir_token_perfilador(x_admin_token)
+    perfilador.configurar(tasa, rutas, segundos)
+    return perfilador.resumen(0)
+
+@app.post("/profiler/detener", tags=["administración"])
+async def detener_perfilado(x_admin_token: Optional[str] = Header(None)):
+    """Deja de perfilar por muestreo y por ruta (las trazas guardadas se conservan)"""
+    exigir_token_perfilador(x_admin_token)
+    perfilador.configurar(0, "", None)
+    return perfilador.resumen(0)
+
+@app.get("/profiler/trazas", tags=["administración"])
+async def obtener_trazas(ultimas: int = Query(20, ge=0, le=500), x_admin_token: Optional[str] = Header(None)):
+    """Resumen por ruta (p50, p95 y promedio por etapa) y las últimas trazas con sus tramos"""
+    exigir_token_perfilador(x_admin_token)
+    return perfilador.resumen(ultimas)
+
+@app.get("/profiler/flamegraph", tags=["administración"])
+async def descargar_flamegraph(
+    fuente: str = Query("muestras", pattern="^(muestras|tramos)$"),
+    x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Pilas plegadas para flamegraph.pl o speedscope: `muestras` son las pilas del event loop
+    tomadas por el muestreador; `tramos` son las etapas de las trazas en microsegundos.
+    """
+    exigir_token_perfilador(x_admin_token)
+    contenido = perfilador.muestreador.plegadas() if fuente == "muestras" else perfilador.tramos_plegados()
+    return PlainTextResponse(contenido, headers={"Content-Disposition": f'attachment; filename="perfil-{fuente}.folded"'})
+
+@app.delete("/profiler/", tags=["administración"])
+async def limpiar_perfilador(x_admin_token: Optional[str] = Header(None)):
+    """Descarta las trazas y las muestras de pila acumuladas"""
+    exigir_token_perfilador(x_admin_token)
+    perfilador.trazas.clear()
+    perfilador.muestreador.limpiar()
+    return {"message": "Trazas y muestras descartadas"}
+
+# ==================== ENDPOINTS DE MÉTRICAS ====================
+
+@app.get("/metrics", tags=["administración"])
+async def exportar_metricas():
+    """Métricas de latencia HTTP y de comandos de MongoDB en formato Prometheus"""
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/pool", tags=["administración"])
+async def obtener_estado_pool():
+    """Conexiones abiertas, en uso y checkouts fallidos por servidor, con las opciones del pool"""
+    return {
+        "opciones": opciones_pool(),
+        "workers": WEB_CONCURRENCY,
+        "preferencia_lectura": READ_PREFERENCE,
+        "max_staleness_segundos": READ_MAX_STALENESS_SECONDS if READ_PREFERENCE != "primary" else None,
+        "servidores": monitor_pool.estadisticas(),
     }
 
+@app.get("/metrics/consultas-lentas", tags=["administración"])
+async def obtener_consultas_lentas():
+    """Últimos comandos de MongoDB que superaron SLOW_QUERY_MS, con la forma de su filtro"""
+    return {"umbral_ms": SLOW_QUERY_MS, "consultas": list(consultas_lentas)}
+
 # Punto de entrada para ejecutar la aplicación
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # WEB_CONCURRENCY > 1 levanta un proceso por worker, cada uno con su pool e instantánea.
+    # UVICORN_RELOAD=1 (desarrollo) recarga al cambiar el código y usa un solo worker.
+    recargar = os.getenv("UVICORN_RELOAD", "0") == "1"
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=1 if recargar else WEB_CONCURRENCY,
+        reload=recargar,
+    )
\ No newline at end of file
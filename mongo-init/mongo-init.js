@@ -16,6 +16,9 @@ db.createUser({
   ]
 });
 
+// Los mismos índices están declarados en los modelos (Settings.indices de main.py) y la API
+// crea en segundo plano los que falten al arrancar, aunque la base no se haya creado aquí
+
 // ==================== ÍNDICES PARA CONTADORES ====================
 db.contadores.createIndex({ "collection_name": 1 }, { unique: true });
 
@@ -39,6 +42,13 @@ db.productos.createIndex({ "disponible": 1 });
 // Índice compuesto para búsquedas por categoría y disponibilidad
 db.productos.createIndex({ "categoria": 1, "disponible": 1 });
 
+// Índices compuestos para la paginación por cursor (orden + _id como desempate)
+db.productos.createIndex({ "precio": 1, "_id": 1 });
+db.productos.createIndex({ "nombre": 1, "_id": 1 });
+
+// Índice para /productos/filtro: igualdad (categoría, disponible) + orden/rango por precio
+db.productos.createIndex({ "categoria": 1, "disponible": 1, "precio": 1, "_id": 1 });
+
 // Índice de texto para búsquedas
 db.productos.createIndex({
   "nombre": "text",
@@ -64,6 +74,14 @@ db.postres.createIndex({ "disponible": 1 });
 // Índice compuesto para búsquedas por categoría
 db.postres.createIndex({ "categoria": 1, "disponible": 1 });
 
+// Índices compuestos para la paginación por cursor (orden + _id como desempate)
+db.postres.createIndex({ "nombre": 1, "_id": 1 });
+db.postres.createIndex({ "precio_rebanada": 1, "_id": 1 });
+db.postres.createIndex({ "precio_total": 1, "_id": 1 });
+
+// Índice para /postres/filtro: igualdad (categoría, disponible) + orden/rango por precio por rebanada
+db.postres.createIndex({ "categoria": 1, "disponible": 1, "precio_rebanada": 1, "_id": 1 });
+
 // Índice de texto para búsquedas en postres
 db.postres.createIndex({
   "nombre": "text",
@@ -76,6 +94,24 @@ db.postres.createIndex({
 
 print('✅ Índices de postres creados');
 
+// ==================== ÍNDICES PARA EL CATÁLOGO ====================
+// Modelo de lectura desnormalizado (productos + postres) que mantiene la API
+
+// Índice para las consultas por categoría y las relaciones misma-categoria
+db.catalogo.createIndex({ "categoria": 1, "tipo": 1, "id_origen": 1 });
+
+// Índice de texto para la búsqueda global en una sola consulta
+db.catalogo.createIndex({
+  "nombre": "text",
+  "descripcion": "text",
+  "categoria": "text"
+}, {
+  default_language: 'spanish',
+  name: 'busqueda_texto_catalogo'
+});
+
+print('✅ Índices del catálogo creados');
+
 // ==================== VALIDACIONES DE ESQUEMA ====================
 
 // Validación para contadores
@@ -0,0 +1,39 @@
+"""
+Fixtures de las pruebas: los modelos se inicializan sobre mongomock_motor (MongoDB en
+memoria), así las pruebas corren sin servidor. Dependencias en requirements-dev.txt.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from beanie import init_beanie
+from mongomock import aggregate
+from mongomock_motor import AsyncMongoMockClient
+
+import main
+
+# mongomock no implementa $unionWith, que usa la reconstrucción de estadísticas
+# (igual que el modo --en-memoria de benchmarks/carga.py)
+def _union_with(in_collection, database, options):
+    return list(in_collection) + list(database[options["coll"]].aggregate(options.get("pipeline", [])))
+
+aggregate._PIPELINE_HANDLERS.setdefault("$unionWith", _union_with)
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+async def base():
+    """Base de datos vacía con los modelos de Beanie inicializados"""
+    database = AsyncMongoMockClient()["cafeteria_pruebas"]
+    await init_beanie(
+        database=database,
+        document_models=[main.Contador, main.Categoria, main.Producto, main.Postre, main.Estadistica, main.ItemCatalogo, main.CambioCatalogo]
+    )
+    main.cache_lectura.limpiar()
+    main.indice_sugerencias = main.IndiceSugerencias()
+    main.indice_difuso = main.IndiceDifuso()
+    yield database
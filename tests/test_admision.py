@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def control(limite_global: int = 1, timeout: float = 1.0, max_cola: int = 10) -> main.ControlAdmision:
+    return main.ControlAdmision(
+        limite_global=limite_global,
+        clases=[
+            main.ClaseAdmision(nombre, 10, prioridad)
+            for nombre, prioridad in main.PRIORIDADES_ADMISION.items()
+        ],
+        max_cola=max_cola,
+        timeout=timeout
+    )
+
+
+@pytest.mark.parametrize("metodo, ruta, clase", [
+    ("POST", "/productos/", "escrituras"),
+    ("PATCH", "/disponibilidad", "escrituras"),
+    ("POST", "/productos/bulk", "masivas"),
+    ("POST", "/postres/bulk", "masivas"),
+    ("POST", "/importar/productos", "masivas"),
+    ("GET", "/exportar/productos", "estadisticas"),
+    ("POST", "/estadisticas/reconstruir", "estadisticas"),
+    ("GET", "/buscar", "busqueda"),
+    ("GET", "/productos/", "lecturas"),
+    ("GET", "/metrics", None),
+])
+def test_clase_de_cada_ruta(metodo, ruta, clase):
+    assert main.clase_admision(metodo, ruta) == clase
+
+
+async def test_al_liberarse_entra_primero_la_de_mayor_prioridad():
+    admision = control()
+    assert await admision.entrar("lecturas")
+    orden = []
+
+    async def esperar(nombre):
+        assert await admision.entrar(nombre)
+        orden.append(nombre)
+        admision.salir(nombre)
+
+    # Llegan en orden inverso a su prioridad
+    tareas = []
+    for nombre in ("masivas", "estadisticas", "lecturas", "escrituras"):
+        tareas.append(asyncio.create_task(esperar(nombre)))
+        await asyncio.sleep(0)
+    assert admision.clases["escrituras"].esperando == 1
+
+    admision.salir("lecturas")
+    await asyncio.gather(*tareas)
+
+    # Entre las de igual prioridad entra primero la más antigua
+    assert orden == ["escrituras", "lecturas", "masivas", "estadisticas"]
+    assert admision.en_curso == 0
+
+
+async def test_la_espera_que_supera_el_timeout_se_rechaza_y_libera_la_cola():
+    admision = control(timeout=0.05)
+    assert await admision.entrar("escrituras")
+
+    assert not await admision.entrar("masivas")
+
+    assert admision.clases["masivas"].esperando == 0
+    admision.salir("escrituras")
+    assert await admision.entrar("masivas")
+
+
+async def test_con_la_cola_llena_se_rechaza_sin_esperar():
+    admision = control(max_cola=1)
+    assert await admision.entrar("lecturas")
+    en_cola = asyncio.create_task(admision.entrar("lecturas"))
+    await asyncio.sleep(0)
+
+    assert not await asyncio.wait_for(admision.entrar("lecturas"), 0.01)
+
+    admision.salir("lecturas")
+    assert await en_cola
+
+
+async def test_middleware_responde_503_con_retry_after(monkeypatch):
+    monkeypatch.setattr(main, "ADMISSION_QUEUE_TIMEOUT", 2.5)
+    admision = control(timeout=0.05)
+    app = FastAPI()
+
+    @app.post("/importar/productos")
+    async def importar():
+        return {"ok": True}
+
+    cliente = AsyncClient(transport=ASGITransport(app=main.MiddlewareAdmision(app, admision)), base_url="http://prueba")
+    async with cliente:
+        assert (await cliente.post("/importar/productos")).status_code == 200
+        assert admision.en_curso == 0
+
+        assert await admision.entrar("escrituras")
+        respuesta = await cliente.post("/importar/productos")
+
+    assert respuesta.status_code == 503
+    assert respuesta.headers["Retry-After"] == "3"
+    assert admision.clases["masivas"].en_curso == 0
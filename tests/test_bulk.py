@@ -0,0 +1,25 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_bulk_reporta_items_invalidos_sin_rechazar_el_lote(base):
+    items = [
+        {"nombre": "Latte", "categoria": "Bebidas", "descripcion": "Con leche", "precio": 45},
+        {"nombre": "Gratis", "categoria": "Bebidas", "descripcion": "Precio inválido", "precio": 0},
+        {"nombre": "Moka", "categoria": "Bebidas", "descripcion": "Con chocolate", "precio": 50},
+    ]
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        respuesta = await cliente.post("/productos/bulk", json=items)
+
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert (cuerpo["total"], cuerpo["insertados"], cuerpo["errores"]) == (3, 2, 1)
+    assert [r["estado"] for r in cuerpo["resultados"]] == ["creado", "error", "creado"]
+    assert "precio" in cuerpo["resultados"][1]["detalle"]
+    assert cuerpo["resultados"][1]["id"] is None
+    assert cuerpo["resultados"][2]["id"] == cuerpo["resultados"][0]["id"] + 1
+    assert await base["productos"].count_documents({}) == 2
@@ -0,0 +1,49 @@
+import orjson
+import pytest
+from httpx import ASGITransport, AsyncClient
+from pymongo import TEXT
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def cliente(base, monkeypatch):
+    monkeypatch.setattr(main, "_indices_texto", {})
+    # mongomock acepta el índice de texto pero no ejecuta $text (NotImplementedError)
+    await base["catalogo"].create_index([("nombre", TEXT), ("descripcion", TEXT)])
+    productos = [
+        {"nombre": "Latte", "categoria": "Bebidas", "descripcion": "Café con leche", "precio": 45},
+        {"nombre": "Torta de jamón", "categoria": "Tortas", "descripcion": "Con aguacate", "precio": 60},
+    ]
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        await cliente.post("/productos/bulk", json=productos)
+        yield cliente
+
+
+@pytest.mark.parametrize("stream", [False, True])
+async def test_auto_cae_a_regex_si_text_no_esta_disponible(cliente, stream):
+    respuesta = await cliente.get("/buscar/latte", params={"stream": stream})
+    assert respuesta.status_code == 200
+    if stream:
+        *resultados, resumen = [orjson.loads(linea) for linea in respuesta.text.splitlines()]
+    else:
+        resumen = respuesta.json()
+        resultados = resumen["productos"]
+    assert resumen["modo"] == "regex"
+    assert [r["nombre"] for r in resultados] == ["Latte"]
+    assert main._indices_texto == {"catalogo": False}
+
+
+@pytest.mark.parametrize("datos", [{"o": "id", "v": 1, "id": 1}, {"o": -5}, {"o": 2.5}, {"x": 1}])
+async def test_cursor_de_otro_tipo_es_400(cliente, datos):
+    respuesta = await cliente.get("/buscar/latte", params={"modo": "regex", "cursor": main.codificar_cursor(datos)})
+    assert respuesta.status_code == 400
+
+
+async def test_cursor_de_busqueda_pagina(cliente):
+    primera = (await cliente.get("/buscar/o", params={"modo": "regex", "limit": 1})).json()
+    segunda = await cliente.get("/buscar/o", params={"modo": "regex", "limit": 1, "cursor": primera["siguiente_cursor"]})
+    assert segunda.status_code == 200
+    assert segunda.json()["total_resultados"] == 1
@@ -0,0 +1,72 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+PRODUCTO = {"nombre": "Latte", "categoria": "Bebidas", "descripcion": "Con leche", "precio": 45}
+
+
+@pytest.fixture
+async def cliente(base):
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        yield cliente
+
+
+async def test_cache_invalida_por_etiqueta_y_prefijo():
+    cache = main.CacheLectura(max_entradas=10, ttl=60)
+    cargas = []
+
+    async def cargar():
+        cargas.append(1)
+        return len(cargas)
+
+    assert await cache.leer("producto:1", ["producto:1", "productos:categoria:Bebidas"], cargar) == 1
+    assert await cache.leer("producto:1", ["producto:1"], cargar) == 1
+    cache.invalidar("producto:1")
+    assert await cache.leer("producto:1", ["producto:1", "productos:categoria:Bebidas"], cargar) == 2
+    cache.invalidar_prefijo("productos:")
+    assert await cache.leer("producto:1", ["producto:1"], cargar) == 3
+    assert cache.estadisticas()["invalidaciones"] == 2
+
+
+async def test_escritura_invalida_la_lectura_en_cache(cliente):
+    creado = (await cliente.post("/productos/", json=PRODUCTO)).json()
+    ruta = f"/productos/{creado['id']}"
+    assert (await cliente.get(ruta)).json()["precio"] == 45
+
+    assert (await cliente.put(ruta, json={"precio": 50})).status_code == 200
+    assert (await cliente.get(ruta)).json()["precio"] == 50
+
+
+async def test_oyente_que_falla_no_rompe_la_escritura_ni_a_los_demas(cliente, monkeypatch):
+    async def oyente_roto(coleccion, cambios):
+        raise RuntimeError("fallo de prueba")
+
+    # Se registra primero para comprobar que los oyentes siguientes (la cache) siguen corriendo
+    monkeypatch.setattr(main, "_oyentes_cambios", [(oyente_roto, False), *main._oyentes_cambios])
+    creado = (await cliente.post("/productos/", json=PRODUCTO)).json()
+    ruta = f"/productos/{creado['id']}"
+    await cliente.get(ruta)
+
+    respuesta = await cliente.put(ruta, json={"precio": 50})
+    assert respuesta.status_code == 200
+    assert (await cliente.get(ruta)).json()["precio"] == 50
+
+
+async def test_oyentes_diferidos_corren_fuera_de_la_peticion(cliente, monkeypatch):
+    aplicados = []
+
+    async def oyente_diferido(coleccion, cambios):
+        aplicados.append(coleccion)
+
+    monkeypatch.setattr(main, "_oyentes_cambios", [*main._oyentes_cambios, (oyente_diferido, True)])
+    cola = main.ColaOyentes(10)
+    monkeypatch.setattr(main, "cola_oyentes", cola)
+    cola.iniciar()
+    try:
+        assert (await cliente.post("/productos/", json=PRODUCTO)).status_code == 200
+    finally:
+        await cola.detener()
+    assert aplicados == ["productos"]
@@ -0,0 +1,31 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def cliente(base):
+    productos = [
+        {"nombre": f"Producto {i}", "categoria": "Bebidas", "descripcion": "Descripción de prueba", "precio": 10 + i}
+        for i in range(100)
+    ]
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        await cliente.post("/productos/bulk", json=productos)
+        yield cliente
+
+
+async def test_listado_grande_se_comprime(cliente):
+    respuesta = await cliente.get("/productos/", headers={"Accept-Encoding": "gzip"})
+    assert respuesta.headers.get("content-encoding") == "gzip"
+    assert len(respuesta.json()) == 100
+
+
+@pytest.mark.parametrize("formato", ["csv", "ndjson"])
+async def test_exportacion_por_partes_no_se_comprime(cliente, formato):
+    respuesta = await cliente.get(f"/exportar/productos?formato={formato}", headers={"Accept-Encoding": "gzip"})
+    assert respuesta.status_code == 200
+    assert "content-encoding" not in respuesta.headers
+    assert "Producto 99" in respuesta.text
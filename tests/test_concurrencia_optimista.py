@@ -0,0 +1,66 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+PRODUCTO = {"nombre": "Latte", "categoria": "Bebidas", "descripcion": "Con leche", "precio": 45}
+
+
+@pytest.fixture
+async def cliente(base):
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        yield cliente
+
+
+@pytest.fixture
+async def ruta(cliente):
+    creado = (await cliente.post("/productos/", json=PRODUCTO)).json()
+    return f"/productos/{creado['id']}"
+
+
+async def test_if_match_vigente_actualiza_y_sube_la_version(cliente, ruta):
+    etag = (await cliente.get(ruta)).headers["ETag"]
+    assert etag == '"0"'
+
+    respuesta = await cliente.put(ruta, json={"precio": 50}, headers={"If-Match": etag})
+
+    assert respuesta.status_code == 200
+    assert respuesta.headers["ETag"] == '"1"'
+    assert respuesta.json()["precio"] == 50
+    assert (await cliente.get(ruta)).headers["ETag"] == '"1"'
+
+
+async def test_if_match_desactualizado_es_412_y_no_escribe(cliente, ruta):
+    assert (await cliente.put(ruta, json={"precio": 50}, headers={"If-Match": '"0"'})).status_code == 200
+
+    respuesta = await cliente.put(ruta, json={"precio": 60}, headers={"If-Match": '"0"'})
+
+    assert respuesta.status_code == 412
+    assert (await cliente.get(ruta)).json()["precio"] == 50
+
+
+@pytest.mark.parametrize("if_match", ['"uno"', "W/abc", ""])
+async def test_if_match_mal_formado_es_400(cliente, ruta, if_match):
+    respuesta = await cliente.put(ruta, json={"precio": 50}, headers={"If-Match": if_match})
+    assert respuesta.status_code == 400
+
+
+async def test_if_match_debil_y_comodin_se_aceptan(cliente, ruta):
+    assert (await cliente.put(ruta, json={"precio": 50}, headers={"If-Match": 'W/"0"'})).status_code == 200
+    assert (await cliente.put(ruta, json={"precio": 55}, headers={"If-Match": "*"})).status_code == 200
+
+
+async def test_delete_con_version_desactualizada_es_412(cliente, ruta):
+    await cliente.put(ruta, json={"precio": 50})
+
+    assert (await cliente.delete(ruta, headers={"If-Match": '"0"'})).status_code == 412
+    assert (await cliente.get(ruta)).status_code == 200
+    assert (await cliente.delete(ruta, headers={"If-Match": '"1"'})).status_code == 200
+    assert (await cliente.get(ruta)).status_code == 404
+
+
+async def test_documento_inexistente_es_404_aunque_haya_if_match(cliente):
+    assert (await cliente.put("/productos/999", json={"precio": 5}, headers={"If-Match": '"0"'})).status_code == 404
+    assert (await cliente.delete("/productos/999", headers={"If-Match": '"0"'})).status_code == 404
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def producto(i: int) -> dict:
+    return {"nombre": f"Producto {i}", "categoria": "Bebidas", "descripcion": "Prueba", "precio": 10 + i}
+
+
+@pytest.fixture
+async def cliente(base):
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        yield cliente
+
+
+@pytest.fixture
+async def ids(cliente):
+    return [(await cliente.post("/productos/", json=producto(i))).json()["id"] for i in range(3)]
+
+
+@pytest.fixture
+def cambios(monkeypatch):
+    """Cambios (antes, despues) que reciben los oyentes de escritura"""
+    recibidos = []
+
+    async def registrar(coleccion, lote):
+        recibidos.extend(lote)
+
+    monkeypatch.setattr(main, "_oyentes_cambios", [*main._oyentes_cambios, (registrar, False)])
+    return recibidos
+
+
+async def versiones(base, ids) -> list:
+    return [(await base["productos"].find_one({"_id": i}))["version"] for i in ids]
+
+
+async def test_patch_disponibilidad_separa_cambiados_sin_cambios_y_no_encontrados(base, cliente, ids, cambios):
+    assert (await cliente.put(f"/productos/{ids[1]}", json={"disponible": 0})).status_code == 200
+    cambios.clear()
+
+    respuesta = await cliente.patch("/disponibilidad", json={"productos": [ids[0], ids[1], 999], "disponible": 0})
+
+    assert respuesta.status_code == 200
+    assert respuesta.json()["productos"] == {"actualizados": [ids[0]], "sin_cambios": [ids[1]], "no_encontrados": [999]}
+    assert await versiones(base, ids) == [1, 1, 0]
+    assert [(antes["_id"], antes["disponible"], despues["disponible"]) for antes, despues in cambios] == [(ids[0], 1, 0)]
+
+
+async def test_group_commit_escribe_un_lote_solo_con_lo_que_cambia(base, cliente, ids, cambios, monkeypatch):
+    monkeypatch.setattr(main, "cola_disponibilidad", main.ColaDisponibilidad(ventana_ms=20, max_lote=100))
+    coleccion = main.Producto.get_motor_collection()
+    bulk_write_original = type(coleccion).bulk_write
+    lotes = []
+
+    async def bulk_write_registrado(self, operaciones, *args, **kwargs):
+        if self.name == "productos":  # Los oyentes también escriben en lote en el catálogo
+            lotes.append(operaciones)
+        return await bulk_write_original(self, operaciones, *args, **kwargs)
+
+    monkeypatch.setattr(type(coleccion), "bulk_write", bulk_write_registrado)
+
+    respuestas = await asyncio.gather(
+        cliente.put(f"/productos/{ids[0]}", json={"disponible": 0}),
+        cliente.put(f"/productos/{ids[1]}", json={"disponible": 1}),
+        cliente.put(f"/productos/{ids[2]}", json={"disponible": 0}),
+        cliente.put("/productos/999", json={"disponible": 0}),
+    )
+
+    assert [r.status_code for r in respuestas] == [200, 200, 200, 404]
+    assert [r.json()["disponible"] for r in respuestas[:3]] == [0, 1, 0]
+    assert len(lotes) == 1 and len(lotes[0]) == 2
+    # El que ya tenía ese valor no sube de versión
+    assert await versiones(base, ids) == [1, 0, 1]
+    assert sorted((antes["_id"], antes["disponible"], antes["version"], despues["version"]) for antes, despues in cambios) == [
+        (ids[0], 1, 0, 1), (ids[2], 1, 0, 1)
+    ]
+
+    # Repetir el mismo valor no cambia nada ni invalida el ETag vigente
+    cambios.clear()
+    assert (await cliente.put(f"/productos/{ids[0]}", json={"disponible": 0})).headers["ETag"] == '"1"'
+    assert len(lotes) == 1 and cambios == []
+    assert (await cliente.put(f"/productos/{ids[0]}", json={"precio": 99}, headers={"If-Match": '"1"'})).status_code == 200
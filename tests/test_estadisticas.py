@@ -0,0 +1,71 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def cliente(base):
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        productos = [
+            {"nombre": f"Taco {precio}", "categoria": "taco", "descripcion": "Prueba", "precio": precio}
+            for precio in (10, 20, 30, 40)
+        ]
+        await cliente.post("/productos/bulk", json=productos)
+        await cliente.post("/postres/", json={
+            "nombre": "Pastel", "descripcion": "Prueba", "categoria": "pastel", "rebanadas": 8, "precio_rebanada": 30,
+            "precio_total": 240
+        })
+        yield cliente
+
+
+async def assert_igual_a_reconstruir(base):
+    """Las estadísticas mantenidas incrementalmente coinciden con las de una reconstrucción completa"""
+    incrementales = await base["estadisticas"].find({"total": {"$gt": 0}}).sort("_id").to_list(length=None)
+    await main.reconstruir_estadisticas()
+    reconstruidas = await base["estadisticas"].find({"total": {"$gt": 0}}).sort("_id").to_list(length=None)
+    assert incrementales == reconstruidas
+    return {e["_id"]: e for e in reconstruidas}
+
+
+async def test_altas_iguales_a_reconstruir(cliente, base):
+    estadisticas = await assert_igual_a_reconstruir(base)
+    assert estadisticas["productos:taco"]["total"] == 4
+    assert estadisticas["postres:pastel"]["sumas"]["precio_total"] == 240
+
+
+@pytest.mark.parametrize("precio", [10, 40])
+async def test_borrar_el_minimo_o_el_maximo_recalcula(cliente, base, precio):
+    producto = await base["productos"].find_one({"precio": precio})
+    assert (await cliente.delete(f"/productos/{producto['_id']}")).status_code == 200
+
+    taco = (await assert_igual_a_reconstruir(base))["productos:taco"]
+    assert (taco["minimos"]["precio"], taco["maximos"]["precio"]) == ((20, 40) if precio == 10 else (10, 30))
+
+
+async def test_cambiar_disponible_no_altera_las_estadisticas(cliente, base):
+    antes = await base["estadisticas"].find_one({"_id": "productos:taco"})
+    producto = await base["productos"].find_one({"precio": 10})
+    assert (await cliente.put(f"/productos/{producto['_id']}", json={"disponible": 0})).status_code == 200
+    assert (await cliente.patch("/disponibilidad", json={"productos": [producto["_id"]], "disponible": 1})).status_code == 200
+
+    assert (await assert_igual_a_reconstruir(base))["productos:taco"] == antes
+
+
+async def test_cambio_de_precio_y_de_categoria(cliente, base):
+    minimo = await base["productos"].find_one({"precio": 10})
+    maximo = await base["productos"].find_one({"precio": 40})
+    await cliente.put(f"/productos/{minimo['_id']}", json={"precio": 50})
+    await cliente.put(f"/productos/{maximo['_id']}", json={"categoria": "torta"})
+
+    estadisticas = await assert_igual_a_reconstruir(base)
+    assert (estadisticas["productos:taco"]["minimos"]["precio"], estadisticas["productos:taco"]["maximos"]["precio"]) == (20, 50)
+    assert estadisticas["productos:torta"]["total"] == 1
+
+
+async def test_borrar_el_ultimo_de_una_categoria(cliente, base):
+    postre = await base["postres"].find_one({})
+    await cliente.delete(f"/postres/{postre['_id']}")
+    assert "postres:pastel" not in await assert_igual_a_reconstruir(base)
@@ -0,0 +1,26 @@
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+async def test_reservar_rango_entrega_ids_contiguos(base):
+    asignador = main.AsignadorIDs()
+    assert await asignador.reservar_rango("productos", 5) == 1
+    assert await asignador.reservar_rango("productos", 3) == 6
+    contador = await base.contadores.find_one({"collection_name": "productos"})
+    assert contador["sequence_value"] == 8
+
+async def test_descartar_bloques_registra_ids_perdidos(base):
+    asignador = main.AsignadorIDs(tamano_bloque=10)
+    assert await asignador.siguiente("productos") == 1
+    assert await asignador.siguiente("productos") == 2
+    assert asignador.estadisticas()["colecciones"]["productos"]["ids_pendientes_en_bloque"] == 8
+
+    await asignador.descartar_bloques()
+
+    contador = await base.contadores.find_one({"collection_name": "productos"})
+    assert contador["ids_perdidos"] == 8
+    assert asignador.estadisticas()["colecciones"]["productos"]["ids_perdidos"] == 8
+    # El siguiente ID viene de un bloque nuevo, después del descartado
+    assert await asignador.siguiente("productos") == 11
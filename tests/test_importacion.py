@@ -0,0 +1,64 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from pymongo.errors import AutoReconnect
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def filas_de(filas):
+    for numero, fila in enumerate(filas, start=1):
+        yield numero, fila
+
+
+def producto(i: int) -> dict:
+    return {"nombre": f"Producto {i}", "categoria": "Bebidas", "descripcion": "Prueba", "precio": 10 + i}
+
+
+async def test_importar_cuenta_filas_invalidas_y_lotes_fallidos(base, monkeypatch):
+    monkeypatch.setattr(main, "BULK_CHUNK_SIZE", 2)
+    coleccion = main.Producto.get_motor_collection()
+    bulk_write_original = type(coleccion).bulk_write
+    llamadas = []
+
+    async def bulk_write_que_falla_una_vez(self, *args, **kwargs):
+        llamadas.append(1)
+        if len(llamadas) == 1:
+            raise AutoReconnect("conexión perdida")
+        return await bulk_write_original(self, *args, **kwargs)
+
+    monkeypatch.setattr(type(coleccion), "bulk_write", bulk_write_que_falla_una_vez)
+    filas = [producto(1), producto(2), {**producto(3), "precio": -1}, producto(4), producto(5)]
+
+    resumen = await main.importar_filas(main.Producto, "productos", main.ProductoCreate, filas_de(filas))
+
+    assert resumen["total"] == 5
+    assert (resumen["insertados"], resumen["errores"]) == (2, 3)
+    assert sorted(e["fila"] for e in resumen["detalle_errores"]) == [1, 2, 3]
+    assert all("Lote no escrito" in e["error"] for e in resumen["detalle_errores"] if e["fila"] != 3)
+    assert await base["productos"].count_documents({}) == 2
+
+
+async def test_csv_exportado_con_saltos_de_linea_se_reimporta_completo(base):
+    descripcion = 'Primera línea\nSegunda, con "comillas"\n\nCuarta'
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        assert (await cliente.post("/productos/", json={**producto(1), "descripcion": descripcion})).status_code == 200
+        assert (await cliente.post("/productos/", json=producto(2))).status_code == 200
+        exportado = (await cliente.get("/exportar/productos", params={"formato": "csv"})).content
+        await base["productos"].delete_many({})
+
+        resumen = (await cliente.post("/importar/productos", params={"formato": "csv"}, content=exportado)).json()
+
+    assert (resumen["insertados"], resumen["errores"]) == (2, 0)
+    importados = await base["productos"].find({}).sort("nombre", 1).to_list(length=None)
+    assert [p["descripcion"] for p in importados] == [descripcion, "Prueba"]
+
+
+async def test_csv_con_comillas_sin_cerrar_reporta_la_linea_del_registro(base):
+    cuerpo = 'nombre,categoria,descripcion,precio\nTé,Bebidas,Verde,20\nCafé,Bebidas,"Sin cerrar\n,30\n'
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        resumen = (await cliente.post("/importar/productos", params={"formato": "csv"}, content=cuerpo)).json()
+
+    assert (resumen["insertados"], resumen["errores"]) == (1, 1)
+    assert resumen["detalle_errores"][0]["fila"] == 3
@@ -0,0 +1,130 @@
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def producto(id: int, categoria: str, precio: float = 10.0) -> dict:
+    return {"_id": id, "nombre": f"Producto {id}", "categoria": categoria, "descripcion": "Prueba",
+            "precio": precio, "disponible": 1, "version": 0}
+
+
+def instantanea_de(*productos) -> main.InstantaneaCatalogo:
+    return main.InstantaneaCatalogo(
+        1,
+        {1: {"id": 1, "nombre": "Bebidas", "descripcion": "Frías y calientes"}},
+        {p["_id"]: (main.producto_crudo_to_response(p), 0) for p in productos},
+        {},
+    )
+
+
+def ids_de(instantanea, categoria: str) -> list:
+    return [r["id"] for r in instantanea.por_categoria.get(("productos", categoria), ())]
+
+
+def test_aplicar_actualiza_solo_los_elementos_y_categorias_cambiados():
+    instantanea = instantanea_de(producto(1, "Bebidas"), producto(3, "Bebidas"), producto(2, "Tortas"),
+                                 producto(4, "Tacos"))
+    tacos = instantanea.por_categoria[("productos", "Tacos")]
+
+    instantanea.aplicar(2, "productos", {
+        3: producto(3, "Tortas", 30.0),  # Cambia de categoría
+        1: None,  # Baja
+        5: producto(5, "Tortas"),  # Alta
+    })
+
+    assert instantanea.version == 2
+    assert ids_de(instantanea, "Tortas") == [2, 3, 5]
+    assert ("productos", "Bebidas") not in instantanea.por_categoria
+    assert instantanea.productos[3][0]["precio"] == 30.0 and 1 not in instantanea.productos
+    assert instantanea.por_categoria[("productos", "Tacos")] is tacos
+
+
+def test_aplicar_categorias_reordena_la_lista():
+    instantanea = instantanea_de()
+    instantanea.aplicar(2, "categorias", {0: {"_id": 0, "nombre": "Antojitos", "descripcion": "Nueva"}, 1: None})
+    assert [c["nombre"] for c in instantanea.lista_categorias] == ["Antojitos"]
+
+
+async def test_otro_worker_relee_solo_los_ids_cambiados(base):
+    productos = base["productos"]
+    await productos.insert_many([producto(i, "Bebidas") for i in range(1, 11)])
+    escritor, lector = main.GestorInstantanea(1.0), main.GestorInstantanea(1.0)
+    await escritor.cargar()
+    await lector.cargar()
+
+    antes = await productos.find_one({"_id": 4})
+    await productos.update_one({"_id": 4}, {"$set": {"categoria": "Tortas"}})
+    await escritor.publicar_cambios("productos", [(antes, await productos.find_one({"_id": 4}))])
+    await lector.poner_al_dia(await lector.version_compartida())
+
+    for gestor in (escritor, lector):
+        assert gestor.actual.version == 1
+        assert ids_de(gestor.actual, "Tortas") == [4]
+        assert gestor.cargas == 1
+    assert escritor.incrementales == 1
+    assert (lector.puestas_al_dia, lector.elementos_releidos) == (1, 1)
+
+
+async def test_version_sin_registro_recarga_tras_esperar(base, monkeypatch):
+    monkeypatch.setattr(main, "CATALOG_SNAPSHOT_MAX_GAP_POLLS", 2)
+    await base["productos"].insert_one(producto(1, "Bebidas"))
+    lector = main.GestorInstantanea(1.0)
+    await lector.cargar()
+
+    # Otro worker subió la versión y se cayó antes de anotar el registro
+    await base["contadores"].update_one(
+        {"collection_name": main.CONTADOR_VERSION_CATALOGO}, {"$inc": {"sequence_value": 1}}, upsert=True
+    )
+    await base["productos"].insert_one(producto(2, "Bebidas"))
+
+    await lector.poner_al_dia(1)
+    assert (lector.actual.version, lector.cargas) == (0, 1)
+    await lector.poner_al_dia(1)
+    assert (lector.actual.version, lector.cargas) == (1, 2)
+    assert ids_de(lector.actual, "Bebidas") == [1, 2]
+
+
+def ids_sugeridos(prefijo: str) -> list:
+    return sorted(s["id"] for s in main.indice_sugerencias.sugerir(prefijo, 50))
+
+
+async def test_cambios_de_otro_worker_llegan_a_los_indices_de_busqueda(base):
+    productos = base["productos"]
+    await productos.insert_many([producto(i, "Bebidas") for i in range(1, 11)])
+    await main.construir_indices_busqueda()
+    escritor, lector = main.GestorInstantanea(1.0), main.GestorInstantanea(1.0)
+    await escritor.cargar()
+    await lector.cargar()
+
+    # Escrituras de otro worker: sus oyentes no corren en este proceso
+    antes = await productos.find_one({"_id": 4})
+    await productos.update_one({"_id": 4}, {"$set": {"nombre": "Horchata", "descripcion": "Agua fresca de arroz"}})
+    await productos.delete_one({"_id": 5})
+    await escritor.publicar_cambios("productos", [(antes, await productos.find_one({"_id": 4})), ({"_id": 5}, None)])
+    await lector.poner_al_dia(await lector.version_compartida())
+
+    assert ids_sugeridos("horch") == [4]
+    assert 5 not in ids_sugeridos("bebidas") and 4 in ids_sugeridos("bebidas")
+    assert list(main.indice_difuso.buscar("orchata")) == [("Producto", 4)]
+
+
+async def test_recarga_completa_resincroniza_los_indices_de_busqueda(base, monkeypatch):
+    monkeypatch.setattr(main, "CATALOG_SNAPSHOT_MAX_GAP_POLLS", 1)
+    await base["productos"].insert_many([producto(1, "Bebidas"), producto(2, "Bebidas")])
+    await main.construir_indices_busqueda()
+    lector = main.GestorInstantanea(1.0)
+    await lector.cargar()
+
+    # Otro worker borró uno y dio de alta otro sin dejar registro utilizable
+    await base["contadores"].update_one(
+        {"collection_name": main.CONTADOR_VERSION_CATALOGO}, {"$inc": {"sequence_value": 1}}, upsert=True
+    )
+    await base["productos"].delete_one({"_id": 1})
+    await base["productos"].insert_one({**producto(3, "Tortas"), "nombre": "Torta cubana"})
+    await lector.poner_al_dia(1)
+
+    assert lector.cargas == 2
+    assert ids_sugeridos("producto") == [2]
+    assert ids_sugeridos("torta") == [3]
@@ -0,0 +1,55 @@
+import pytest
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def cliente(base):
+    productos = [
+        {"nombre": f"Producto {i}", "categoria": "Bebidas", "descripcion": "Prueba", "precio": 10 + i % 3}
+        for i in range(5)
+    ]
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://prueba") as cliente:
+        assert (await cliente.post("/productos/bulk", json=productos)).json()["insertados"] == 5
+        yield cliente
+
+
+def test_cursor_ida_y_vuelta():
+    datos = {"o": "-precio", "v": 12.5, "id": 7}
+    assert main.decodificar_cursor(main.codificar_cursor(datos)) == datos
+
+
+@pytest.mark.parametrize("cursor", ["no-es-base64!", main.codificar_cursor({"o": "id"})[:-4], "WzFd"])
+def test_cursor_invalido_es_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        main.decodificar_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+async def test_recorrer_con_cursor_con_empates_de_precio(cliente):
+    vistos, after = [], None
+    while True:
+        parametros = {"orden": "precio", "limit": 2, **({"after": after} if after else {})}
+        respuesta = await cliente.get("/productos/", params=parametros)
+        vistos += [p["id"] for p in respuesta.json()]
+        after = respuesta.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert sorted(vistos) == [1, 2, 3, 4, 5] and len(vistos) == 5
+
+
+async def test_limit_cero_sin_cursor_devuelve_todo(cliente):
+    respuesta = await cliente.get("/productos/", params={"limit": 0})
+    assert respuesta.status_code == 200
+    assert len(respuesta.json()) == 5 and "X-Next-Cursor" not in respuesta.headers
+    assert len((await cliente.get("/productos/", params={"skip": 3, "limit": 5000})).json()) == 2
+
+
+async def test_limite_fuera_de_rango_con_cursor_es_400(cliente):
+    after = (await cliente.get("/productos/", params={"limit": 2})).headers["X-Next-Cursor"]
+    assert (await cliente.get("/productos/", params={"limit": 0, "after": after})).status_code == 400
+    assert (await cliente.get("/productos/", params={"limit": 5000, "after": after})).status_code == 400
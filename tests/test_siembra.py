@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_workers_simultaneos_siembran_una_sola_vez(base):
+    sembrados = await asyncio.gather(*(main.init_sample_data() for _ in range(4)))
+
+    assert sembrados.count(0) == 3
+    conteos = [await base[c].count_documents({}) for c in ("categorias", "productos", "postres")]
+    assert sum(conteos) == max(sembrados)
+    assert len(await base["categorias"].distinct("nombre")) == conteos[0]
+
+    # Un arranque posterior tampoco siembra, aunque la colección se haya vaciado
+    await base["postres"].delete_many({})
+    assert await main.init_sample_data() == 0
+
+
+async def test_siembra_fallida_libera_la_marca(base, monkeypatch):
+    async def falla(*args):
+        raise RuntimeError("sin conexión")
+
+    monkeypatch.setattr(main, "sembrar_coleccion", falla)
+    with pytest.raises(RuntimeError):
+        await main.init_sample_data()
+    monkeypatch.undo()
+
+    assert await main.init_sample_data() > 0
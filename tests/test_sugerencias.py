@@ -0,0 +1,34 @@
+import main
+
+
+class ElementosContados(dict):
+    """dict que cuenta los accesos por clave, para medir cuántos candidatos se revisan"""
+    lecturas = 0
+
+    def __getitem__(self, clave):
+        self.lecturas += 1
+        return super().__getitem__(clave)
+
+
+def test_sugerir_no_recorre_toda_una_categoria_grande():
+    indice = main.IndiceSugerencias()
+    for i in range(5000):
+        indice.agregar("Producto", i, f"Orden {i}", "Tacos")
+    indice._elementos = ElementosContados(indice._elementos)
+
+    sugerencias = indice.sugerir("tac", k=10)
+
+    assert len(sugerencias) == 10
+    assert all(s["categoria"] == "Tacos" for s in sugerencias)
+    assert indice._elementos.lecturas <= 40
+
+
+def test_sugerir_prefiere_nombres_que_empiezan_con_el_prefijo():
+    indice = main.IndiceSugerencias()
+    indice.agregar("Producto", 1, "Agua de horchata", "Bebidas")
+    indice.agregar("Producto", 2, "Horchata", "Bebidas")
+    indice.agregar("Postre", 3, "Pastel", "Postres")
+    indice.quitar("Postre", 3)
+
+    assert [s["id"] for s in indice.sugerir("Hórch")] == [2, 1]
+    assert indice.sugerir("past") == []
@@ -0,0 +1,25 @@
+import asyncio
+
+import pytest
+from fastapi.responses import ORJSONResponse
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_llamadas_simultaneas_comparten_una_ejecucion_con_respuestas_propias():
+    vuelo = main.VueloUnico(["buscar"])
+    ejecuciones = []
+
+    async def funcion():
+        ejecuciones.append(1)
+        await asyncio.sleep(0.01)
+        return ORJSONResponse({"total": 1})
+
+    respuestas = await asyncio.gather(*(vuelo.ejecutar("buscar", "latte", funcion) for _ in range(3)))
+
+    assert len(ejecuciones) == 1
+    assert vuelo.estadisticas()["buscar"] == {"ejecutadas": 1, "coalescidas": 2, "en_vuelo": 0}
+    assert len({id(r) for r in respuestas}) == 3 and len({id(r.raw_headers) for r in respuestas}) == 3
+    assert all(r.body == b'{"total":1}' for r in respuestas)